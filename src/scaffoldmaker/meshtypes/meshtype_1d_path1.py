@@ -4,6 +4,7 @@ Generates a 1-D path mesh.
 
 from __future__ import division
 import math
+import numpy as np
 from opencmiss.utils.zinc.field import findOrCreateFieldCoordinates, findOrCreateFieldGroup
 from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.element import Element, Elementbasis
@@ -12,6 +13,7 @@ from opencmiss.zinc.node import Node
 from scaffoldmaker.meshtypes.scaffold_base import Scaffold_base
 from scaffoldmaker.utils.interpolation import DerivativeScalingMode, smoothCubicHermiteDerivativesLine, smoothCubicHermiteCrossDerivativesLine
 from scaffoldmaker.utils import vector
+from scaffoldmaker.utils.zinc_utils import extract_node_field_parameters_array
 from opencmiss.zinc.result import RESULT_OK
 
 
@@ -224,10 +226,6 @@ def extractPathParametersFromRegion(region, valueLabels, groupName=None):
     coordinates = fieldmodule.findFieldByName('coordinates').castFiniteElement()
     componentsCount = coordinates.getNumberOfComponents()
     assert componentsCount in [ 1, 2, 3 ], 'extractPathParametersFromRegion.  Invalid coordinates number of components'
-    cache = fieldmodule.createFieldcache()
-
-    valueLabelsCount = len(valueLabels)
-    returnValues = [[] for i in range(valueLabelsCount)]
     nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
     if groupName:
         group = fieldmodule.findFieldByName(groupName).castGroup()
@@ -236,18 +234,12 @@ def extractPathParametersFromRegion(region, valueLabels, groupName=None):
             nodes = nodeGroup.getNodesetGroup()
         else:
             print('extractPathParametersFromRegion: missing group "' + groupName + '"')
-    nodeIter = nodes.createNodeiterator()
-    node = nodeIter.next()
-    while node.isValid():
-        cache.setNode(node)
-        for i in range(valueLabelsCount):
-            result, values = coordinates.getNodeParameters(cache, -1, valueLabels[i], 1, componentsCount)
-            for c in range(componentsCount, 3):
-                values.append(0.0)
-            returnValues[i].append(values)
-        node = nodeIter.next()
-
-    return returnValues
+    nodeValueLabels, nodeIdentifiers, nodeParameters, mask = \
+        extract_node_field_parameters_array(nodes, coordinates, valueLabels)
+    returnValues = np.zeros((len(valueLabels), nodeIdentifiers.size, 3))
+    if nodeParameters.shape[2] > 0:
+        returnValues[:, :, :componentsCount] = nodeParameters[:, :, 0, :].transpose(1, 0, 2)
+    return returnValues.tolist()
 
 
 def setPathParameters(region, nodeValueLabels, nodeValues, editGroupName=None):
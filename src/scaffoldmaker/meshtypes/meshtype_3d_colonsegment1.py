@@ -514,7 +514,6 @@ def getColonSegmentInnerPoints(region, elementsCountAroundTC,
     segmentAxis = [0.0, 0.0, 1.0]
 
     d2HalfSet = []
-    d2Raw = []
     xInnerRaw = []
     dx_ds2InnerRaw = []
     xFinal = []
@@ -551,22 +550,15 @@ def getColonSegmentInnerPoints(region, elementsCountAroundTC,
             relaxedLengthList.append(lengthAroundFace)
             contractedWallThicknessList.append(wallThickness)
 
-        for n1 in range(elementsCountAround):
-            xUp = []
-            d2Up = []
-            for n2 in range(elementsCountAlongSegment + 1):
+        d2Up = []
+        for n2 in range(elementsCountAlongSegment + 1):
+            for n1 in range(elementsCountAround):
                 n = elementsCountAround * n2 + n1
-                xUp.append(xFinal[n])
                 d2 = [ xFinal[n + elementsCountAround][i] - xFinal[n][i] if n2 < elementsCountAlongSegment else
                        xFinal[n][i] - xFinal[n - elementsCountAround][i] for i in range(3)]
                 d2Up.append(d2)
-            d2Smoothed = interp.smoothCubicHermiteDerivativesLine(xUp, d2Up)
-            d2Raw.append(d2Smoothed)
-
-        # Re-arrange d2Raw
-        for n2 in range(elementsCountAlongSegment + 1):
-            for n1 in range(elementsCountAround):
-                d2Final.append(d2Raw[n1][n2])
+        # Smooth all lines up at once
+        d2Final = tubemesh.smoothd2AlongColumns(xFinal, d2Up, elementsCountAround, elementsCountAlongSegment)
 
         # Create annotation groups for mouse colon
         mzGroup = AnnotationGroup(region, get_colon_term("mesenteric zone"))
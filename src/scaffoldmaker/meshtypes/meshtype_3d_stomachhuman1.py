@@ -9545,8 +9545,9 @@ class MeshType_3d_stomachhuman1(Scaffold_base):
     Human stomach mesh generator wrapper for ScaffoldMaker
     Uses data from fitted mesh, which can be refined globally or along lattitude and longitude
     '''
-    hostStomach = Stomach()
-    
+    # host mesh is loaded on first use and kept for the life of the process
+    _hostStomach = None
+
     @staticmethod
     def getName():
         return '3D Stomach Human 1'
@@ -9578,6 +9579,15 @@ class MeshType_3d_stomachhuman1(Scaffold_base):
         if (options['Number of elements along the axis'] < 6) :
             options['Number of elements along the axis'] = 6
 
+    @classmethod
+    def getHostStomach(cls):
+        """
+        :return: Stomach host mesh, loaded on first call.
+        """
+        if cls._hostStomach is None:
+            cls._hostStomach = Stomach()
+        return cls._hostStomach
+
     @classmethod
     def generateBaseMesh(cls, region, options):
         """
@@ -9591,6 +9601,6 @@ class MeshType_3d_stomachhuman1(Scaffold_base):
         wallElements= options['Number of elements through the wall']
         normalizeCircumferentialSegmentLengths = options['Normalize Circumferential Segment Lengths']
         
-        cls.hostStomach.generateMesh(region, circumferentialElements,
+        cls.getHostStomach().generateMesh(region, circumferentialElements,
             axialElements, wallElements, normalizeCircumferentialSegmentLengths,{}, {})
         return []
@@ -7,6 +7,7 @@ from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.field import Field
 from scaffoldmaker.utils.meshrefinement import MeshRefinement
 from scaffoldmaker.utils.derivativemoothing import DerivativeSmoothing
+from scaffoldmaker.utils.generationprofile import profileStage
 from scaffoldmaker.utils.interpolation import DerivativeScalingMode
 from scaffoldmaker.utils.zinc_utils import extract_node_field_parameters, print_node_field_parameters
 
@@ -93,6 +94,23 @@ class Scaffold_base:
         if options['Real option'] < 0.0:
             options['Real option'] = 0.0
 
+    @classmethod
+    def getOptionGenerationStage(cls, optionName):
+        '''
+        Get the earliest generation stage affected by option, so a GenerationCache can
+        reuse results of earlier stages when it changes. Stages in order are:
+        'base': generateBaseMesh(); 'refine': MeshRefinement with refineMesh().
+        Defining faces, adding subelements and defineFaceAnnotations() are always re-run
+        when any option changes.
+        Override if refine options do not start with 'Refine', or other options only
+        affect refinement.
+        :param optionName: Name of option from getDefaultOptions().
+        :return: Stage name 'base' or 'refine'.
+        '''
+        if optionName.startswith('Refine'):
+            return 'refine'
+        return 'base'
+
     @classmethod
     def generateBaseMesh(cls, region, options):
         """
@@ -126,32 +144,71 @@ class Scaffold_base:
         pass
 
     @classmethod
-    def generateMesh(cls, region, options):
+    def generateMesh(cls, region, options, generationCache=None, profile=None):
         """
         Generate base or refined mesh.
         Some classes may override to a simpler version just generating the base mesh.
         :param region: Zinc region to create mesh in. Must be empty.
         :param options: Dict containing options. See getDefaultOptions().
+        :param generationCache: Optional GenerationCache holding results of stages of the
+        last generation, which are reused if the options they depend on are unchanged.
+        :param profile: Optional GenerationProfile to record statistics for each stage in.
         :return: list of AnnotationGroup for mesh.
         """
         fieldmodule = region.getFieldmodule()
         with ChangeManager(fieldmodule):
-            if options.get('Refine'):
+            if generationCache:
+                finalKey = generationCache.getStageKey(cls, options, None)
+                with profileStage(profile, 'readGenerationCache', region):
+                    annotationGroups = generationCache.getFinal(finalKey, region)
+                if annotationGroups is not None:
+                    return annotationGroups
+                baseKey = generationCache.getStageKey(cls, options, ('base',))
+                baseRegion, baseAnnotationGroups = generationCache.getBase(baseKey)
+                if not baseRegion:
+                    baseRegion = generationCache.createBaseRegion(baseKey)
+                    with profileStage(profile, 'generateBaseMesh', baseRegion):
+                        baseAnnotationGroups = cls.generateBaseMesh(baseRegion, options)
+                    generationCache.setBaseAnnotationGroups(baseAnnotationGroups)
+                if options.get('Refine'):
+                    refineKey = generationCache.getStageKey(cls, options, ('refine',), baseKey)
+                    with profileStage(profile, 'readGenerationCache', region):
+                        annotationGroups = generationCache.getRefine(refineKey, region)
+                    if annotationGroups is None:
+                        with profileStage(profile, 'refineMesh', region):
+                            meshrefinement = MeshRefinement(baseRegion, region, baseAnnotationGroups)
+                            cls.refineMesh(meshrefinement, options)
+                            annotationGroups = meshrefinement.getAnnotationGroups()
+                            del meshrefinement
+                        generationCache.setRefine(refineKey, region, annotationGroups)
+                else:
+                    with profileStage(profile, 'readGenerationCache', region):
+                        annotationGroups = generationCache.readBase(region)
+            elif options.get('Refine'):
                 baseRegion = region.createRegion()
-                annotationGroups = cls.generateBaseMesh(baseRegion, options)
-                meshrefinement = MeshRefinement(baseRegion, region, annotationGroups)
-                cls.refineMesh(meshrefinement, options)
-                annotationGroups = meshrefinement.getAnnotationGroups()
+                with profileStage(profile, 'generateBaseMesh', baseRegion):
+                    annotationGroups = cls.generateBaseMesh(baseRegion, options)
+                with profileStage(profile, 'refineMesh', region):
+                    meshrefinement = MeshRefinement(baseRegion, region, annotationGroups)
+                    cls.refineMesh(meshrefinement, options)
+                    annotationGroups = meshrefinement.getAnnotationGroups()
             else:
-                annotationGroups = cls.generateBaseMesh(region, options)
-            fieldmodule.defineAllFaces()
-            oldAnnotationGroups = copy.copy(annotationGroups)
-            for annotationGroup in annotationGroups:
-                annotationGroup.addSubelements()
-            cls.defineFaceAnnotations(region, options, annotationGroups)
-            for annotation in annotationGroups:
-                if annotation not in oldAnnotationGroups:
+                with profileStage(profile, 'generateBaseMesh', region):
+                    annotationGroups = cls.generateBaseMesh(region, options)
+            with profileStage(profile, 'defineAllFaces', region):
+                fieldmodule.defineAllFaces()
+            with profileStage(profile, 'addSubelements', region):
+                oldAnnotationGroups = copy.copy(annotationGroups)
+                for annotationGroup in annotationGroups:
                     annotationGroup.addSubelements()
+            with profileStage(profile, 'defineFaceAnnotations', region):
+                cls.defineFaceAnnotations(region, options, annotationGroups)
+                for annotation in annotationGroups:
+                    if annotation not in oldAnnotationGroups:
+                        annotationGroup.addSubelements()
+            if generationCache:
+                with profileStage(profile, 'writeGenerationCache'):
+                    generationCache.setFinal(finalKey, region, annotationGroups)
         return annotationGroups
 
     @classmethod
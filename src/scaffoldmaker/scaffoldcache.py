@@ -0,0 +1,201 @@
+"""
+Content-addressed cache of generated scaffolds, keyed by ScaffoldPackage settings.
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import os
+from opencmiss.utils.zinc.general import ChangeManager
+from opencmiss.zinc.field import FieldGroup
+from scaffoldmaker.annotation.annotationgroup import AnnotationGroup
+from scaffoldmaker.scaffolds import Scaffolds_JSONEncoder
+
+
+class ScaffoldCache:
+    '''
+    Optional in-memory and on-disk LRU cache of generated scaffold models.
+    Entries are the serialised Zinc model after generateMesh() and mesh edits,
+    before user annotation groups and transformation are applied, plus the
+    terms of the automatic annotation groups.
+    Pass to ScaffoldPackage.generate() to use.
+    '''
+
+    def __init__(self, maxMemoryEntries=32, maxMemoryBytes=256*1024*1024, directory=None, maxDiskBytes=1024*1024*1024):
+        '''
+        :param maxMemoryEntries: Maximum number of models held in memory, or 0 for no memory cache.
+        :param maxMemoryBytes: Maximum total size of serialised models held in memory.
+        :param directory: Optional directory to also store models in. Created if it does not exist.
+        :param maxDiskBytes: Maximum total size of model files in directory.
+        '''
+        self._maxMemoryEntries = maxMemoryEntries
+        self._maxMemoryBytes = maxMemoryBytes
+        self._directory = directory
+        self._maxDiskBytes = maxDiskBytes
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # map key -> (model bytes, annotation group terms), least recently used first
+        self._memoryEntries = collections.OrderedDict()
+        self._memoryBytes = 0
+        self._hits = 0
+        self._diskHits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def getKey(scaffoldPackage):
+        '''
+        Get stable hash of the settings affecting the generated model: scaffold type,
+        scaffold settings including nested ScaffoldPackage options, mesh edits and
+        user annotation groups. Rotation, scale and translation are not included as
+        they are applied after the cached model is loaded.
+        :param scaffoldPackage: ScaffoldPackage to get key for.
+        :return: Hexadecimal digest string.
+        '''
+        dct = copy.copy(scaffoldPackage.toDict())
+        for name in ('rotation', 'scale', 'translation'):
+            dct.pop(name, None)
+        jsonString = json.dumps(dct, cls=Scaffolds_JSONEncoder, sort_keys=True)
+        return hashlib.sha256(jsonString.encode('utf-8')).hexdigest()
+
+    def getStatistics(self):
+        '''
+        :return: Dict of cache counters and sizes.
+        '''
+        return {
+            'hits': self._hits,
+            'disk hits': self._diskHits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'memory entries': len(self._memoryEntries),
+            'memory bytes': self._memoryBytes
+            }
+
+    def clear(self):
+        '''
+        Remove all entries from memory and disk, and reset counters.
+        '''
+        self._memoryEntries.clear()
+        self._memoryBytes = 0
+        if self._directory:
+            for filename in self._getDiskFilenames():
+                os.remove(filename)
+        self._hits = self._diskHits = self._misses = self._evictions = 0
+
+    def load(self, key, region):
+        '''
+        Read cached model for key into region, if present.
+        :param key: Key from getKey().
+        :param region: Empty Zinc region to read model into.
+        :return: List of AnnotationGroup rebuilt for region, or None if not cached.
+        '''
+        entry = self._memoryEntries.get(key)
+        if entry:
+            self._memoryEntries.move_to_end(key)
+        elif self._directory:
+            entry = self._readDiskEntry(key)
+            if entry:
+                self._diskHits += 1
+                self._addMemoryEntry(key, entry)
+        if not entry:
+            self._misses += 1
+            return None
+        self._hits += 1
+        model, terms = entry
+        fieldmodule = region.getFieldmodule()
+        with ChangeManager(fieldmodule):
+            sir = region.createStreaminformationRegion()
+            sir.createStreamresourceMemoryBuffer(model)
+            region.read(sir)
+            annotationGroups = []
+            for term in terms:
+                annotationGroup = AnnotationGroup(region, tuple(term))
+                annotationGroup.getGroup().setSubelementHandlingMode(FieldGroup.SUBELEMENT_HANDLING_MODE_FULL)
+                annotationGroups.append(annotationGroup)
+        return annotationGroups
+
+    def store(self, key, region, annotationGroups):
+        '''
+        Serialise model in region and store it under key.
+        :param key: Key from getKey().
+        :param region: Zinc region containing generated model.
+        :param annotationGroups: List of AnnotationGroup for model.
+        '''
+        sir = region.createStreaminformationRegion()
+        srm = sir.createStreamresourceMemory()
+        region.write(sir)
+        result, model = srm.getBuffer()
+        if isinstance(model, str):
+            model = bytes(model, 'utf-8')
+        terms = [ list(annotationGroup.getTerm()) for annotationGroup in annotationGroups ]
+        entry = (model, terms)
+        self._addMemoryEntry(key, entry)
+        if self._directory:
+            self._writeDiskEntry(key, entry)
+
+    def _addMemoryEntry(self, key, entry):
+        if self._maxMemoryEntries <= 0:
+            return
+        oldEntry = self._memoryEntries.pop(key, None)
+        if oldEntry:
+            self._memoryBytes -= len(oldEntry[0])
+        self._memoryEntries[key] = entry
+        self._memoryBytes += len(entry[0])
+        while self._memoryEntries and ((len(self._memoryEntries) > self._maxMemoryEntries) or
+                                       (self._memoryBytes > self._maxMemoryBytes)):
+            evictedKey, evictedEntry = self._memoryEntries.popitem(last=False)
+            self._memoryBytes -= len(evictedEntry[0])
+            self._evictions += 1
+
+    def _getDiskFilenames(self, key=None):
+        '''
+        :return: Model and annotation filenames for key, or list of all cache filenames if key is None.
+        '''
+        if key:
+            base = os.path.join(self._directory, key)
+            return base + '.exf', base + '.json'
+        return [ os.path.join(self._directory, filename) for filename in os.listdir(self._directory)
+                 if os.path.splitext(filename)[1] in ('.exf', '.json') ]
+
+    def _readDiskEntry(self, key):
+        modelFilename, termsFilename = self._getDiskFilenames(key)
+        try:
+            with open(modelFilename, 'rb') as f:
+                model = f.read()
+            with open(termsFilename, 'r') as f:
+                terms = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # touch so disk eviction is least recently used
+        os.utime(modelFilename)
+        return (model, terms)
+
+    def _writeDiskEntry(self, key, entry):
+        model, terms = entry
+        modelFilename, termsFilename = self._getDiskFilenames(key)
+        # write terms last as their presence marks a complete entry
+        with open(modelFilename, 'wb') as f:
+            f.write(model)
+        with open(termsFilename, 'w') as f:
+            json.dump(terms, f)
+        self._evictDisk()
+
+    def _evictDisk(self):
+        '''
+        Remove least recently used model files until total size is within limit.
+        '''
+        modelFilenames = [ filename for filename in self._getDiskFilenames() if filename.endswith('.exf') ]
+        sizes = { filename: os.path.getsize(filename) for filename in modelFilenames }
+        totalBytes = sum(sizes.values())
+        if totalBytes <= self._maxDiskBytes:
+            return
+        for filename in sorted(modelFilenames, key=os.path.getmtime):
+            os.remove(filename)
+            termsFilename = os.path.splitext(filename)[0] + '.json'
+            if os.path.exists(termsFilename):
+                os.remove(termsFilename)
+            totalBytes -= sizes[filename]
+            self._evictions += 1
+            if totalBytes <= self._maxDiskBytes:
+                break
@@ -10,6 +10,8 @@ from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.utils.maths.vectorops import euler_to_rotation_matrix
 from scaffoldmaker.annotation.annotationgroup import AnnotationGroup, findAnnotationGroupByName
 from scaffoldmaker.meshtypes.scaffold_base import Scaffold_base
+from scaffoldmaker.utils.generationcache import GenerationCache
+from scaffoldmaker.utils.generationprofile import profileStage
 
 class ScaffoldPackage:
     '''
@@ -57,6 +59,8 @@ class ScaffoldPackage:
         self._userAnnotationGroups = []
         # region is set in generate(); can only instantiate user AnnotationGroups then
         self._region = None
+        # optional cache of generation stages for fast regeneration after option changes
+        self._generationCache = None
 
     def __eq__(self, other):
         '''
@@ -221,25 +225,59 @@ class ScaffoldPackage:
             del coordinates
         return doApply
 
-    def generate(self, region, applyTransformation=True):
+    def isGenerationCacheEnabled(self):
+        return self._generationCache is not None
+
+    def setGenerationCacheEnabled(self, enable):
+        '''
+        Enable or disable caching of generation stages so that subsequent calls to generate()
+        only re-run stages affected by changed scaffold settings, e.g. refinement only.
+        Uses more memory; intended for interactive editing.
+        :param enable: True to enable, False to disable and free the cache.
+        '''
+        if enable:
+            if not self._generationCache:
+                self._generationCache = GenerationCache()
+        else:
+            self._generationCache = None
+
+    def generate(self, region, applyTransformation=True, cache=None, profile=None):
         '''
         Generate the finite element scaffold and define annotation groups.
         :param applyTransformation: If True (default) apply scale, rotation and translation to
         node coordinates. Specify False if client will transform, e.g. with graphics transformations.
+        :param cache: Optional ScaffoldCache to load the untransformed model from, or to
+        store it in if not yet cached.
+        :param profile: Optional GenerationProfile to record statistics for each stage in.
         '''
         self._region = region
-        with ChangeManager(region.getFieldmodule()):
-            self._autoAnnotationGroups = self._scaffoldType.generateMesh(region, self._scaffoldSettings)
-            if self._meshEdits:
-                # apply mesh edits, a Zinc-readable model file containing node edits
-                # Note: these are untransformed coordinates
-                sir = region.createStreaminformationRegion()
-                srm = sir.createStreamresourceMemoryBuffer(self._meshEdits)
-                region.read(sir)
+        with ChangeManager(region.getFieldmodule()), profileStage(profile, 'generate', region):
+            cacheKey = cache.getKey(self) if cache else None
+            if cache:
+                with profileStage(profile, 'loadScaffoldCache', region):
+                    self._autoAnnotationGroups = cache.load(cacheKey, region)
+            else:
+                self._autoAnnotationGroups = None
+            if self._autoAnnotationGroups is None:
+                with profileStage(profile, 'generateMesh', region):
+                    self._autoAnnotationGroups = self._scaffoldType.generateMesh(region, self._scaffoldSettings,
+                        generationCache=self._generationCache, profile=profile)
+                if self._meshEdits:
+                    # apply mesh edits, a Zinc-readable model file containing node edits
+                    # Note: these are untransformed coordinates
+                    with profileStage(profile, 'meshEdits', region):
+                        sir = region.createStreaminformationRegion()
+                        srm = sir.createStreamresourceMemoryBuffer(self._meshEdits)
+                        region.read(sir)
+                if cache:
+                    with profileStage(profile, 'storeScaffoldCache'):
+                        cache.store(cacheKey, region, self._autoAnnotationGroups)
             # define user AnnotationGroups from serialised Dict
-            self._userAnnotationGroups = [ AnnotationGroup.fromDict(dct, self._region) for dct in self._userAnnotationGroupsDict ]
+            with profileStage(profile, 'userAnnotationGroups'):
+                self._userAnnotationGroups = [ AnnotationGroup.fromDict(dct, self._region) for dct in self._userAnnotationGroupsDict ]
             if applyTransformation:
-                self.applyTransformation()
+                with profileStage(profile, 'applyTransformation'):
+                    self.applyTransformation()
 
     def getAnnotationGroups(self):
         '''
@@ -2,94 +2,82 @@
 Class for listing and accessing all mesh type scripts supported by scaffoldmaker.
 """
 
+import importlib
 import json
-from scaffoldmaker.meshtypes.meshtype_1d_bifurcationtree1 import MeshType_1d_bifurcationtree1
-from scaffoldmaker.meshtypes.meshtype_1d_path1 import MeshType_1d_path1
-from scaffoldmaker.meshtypes.meshtype_2d_plate1 import MeshType_2d_plate1
-from scaffoldmaker.meshtypes.meshtype_2d_platehole1 import MeshType_2d_platehole1
-from scaffoldmaker.meshtypes.meshtype_2d_sphere1 import MeshType_2d_sphere1
-from scaffoldmaker.meshtypes.meshtype_2d_tube1 import MeshType_2d_tube1
-from scaffoldmaker.meshtypes.meshtype_2d_tubebifurcation1 import MeshType_2d_tubebifurcation1
-from scaffoldmaker.meshtypes.meshtype_3d_bladder1 import MeshType_3d_bladder1
-from scaffoldmaker.meshtypes.meshtype_3d_bladderurethra1 import MeshType_3d_bladderurethra1
-from scaffoldmaker.meshtypes.meshtype_3d_box1 import MeshType_3d_box1
-from scaffoldmaker.meshtypes.meshtype_3d_boxhole1 import MeshType_3d_boxhole1
-from scaffoldmaker.meshtypes.meshtype_3d_cecum1 import MeshType_3d_cecum1
-from scaffoldmaker.meshtypes.meshtype_3d_colon1 import MeshType_3d_colon1
-from scaffoldmaker.meshtypes.meshtype_3d_colonsegment1 import MeshType_3d_colonsegment1
-from scaffoldmaker.meshtypes.meshtype_3d_heart1 import MeshType_3d_heart1
-from scaffoldmaker.meshtypes.meshtype_3d_heart2 import MeshType_3d_heart2
-from scaffoldmaker.meshtypes.meshtype_3d_heartarterialroot1 import MeshType_3d_heartarterialroot1
-from scaffoldmaker.meshtypes.meshtype_3d_heartarterialvalve1 import MeshType_3d_heartarterialvalve1
-from scaffoldmaker.meshtypes.meshtype_3d_heartatria1 import MeshType_3d_heartatria1
-from scaffoldmaker.meshtypes.meshtype_3d_heartatria2 import MeshType_3d_heartatria2
-from scaffoldmaker.meshtypes.meshtype_3d_heartventricles1 import MeshType_3d_heartventricles1
-from scaffoldmaker.meshtypes.meshtype_3d_heartventricles2 import MeshType_3d_heartventricles2
-from scaffoldmaker.meshtypes.meshtype_3d_heartventricles3 import MeshType_3d_heartventricles3
-from scaffoldmaker.meshtypes.meshtype_3d_heartventriclesbase1 import MeshType_3d_heartventriclesbase1
-from scaffoldmaker.meshtypes.meshtype_3d_heartventriclesbase2 import MeshType_3d_heartventriclesbase2
-from scaffoldmaker.meshtypes.meshtype_3d_lens1 import MeshType_3d_lens1
-from scaffoldmaker.meshtypes.meshtype_3d_lung1 import MeshType_3d_lung1
-from scaffoldmaker.meshtypes.meshtype_3d_ostium1 import MeshType_3d_ostium1
-from scaffoldmaker.meshtypes.meshtype_3d_smallintestine1 import MeshType_3d_smallintestine1
-from scaffoldmaker.meshtypes.meshtype_3d_solidsphere1 import MeshType_3d_solidsphere1
-from scaffoldmaker.meshtypes.meshtype_3d_solidcylinder1 import MeshType_3d_solidcylinder1
-from scaffoldmaker.meshtypes.meshtype_3d_sphereshell1 import MeshType_3d_sphereshell1
-from scaffoldmaker.meshtypes.meshtype_3d_sphereshellseptum1 import MeshType_3d_sphereshellseptum1
-from scaffoldmaker.meshtypes.meshtype_3d_stellate1 import MeshType_3d_stellate1
-from scaffoldmaker.meshtypes.meshtype_3d_stomachhuman1 import MeshType_3d_stomachhuman1
-from scaffoldmaker.meshtypes.meshtype_3d_tube1 import MeshType_3d_tube1
-from scaffoldmaker.meshtypes.meshtype_3d_tubeseptum1 import MeshType_3d_tubeseptum1
+import multiprocessing
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows
+from opencmiss.zinc.context import Context
 from scaffoldmaker.scaffoldpackage import ScaffoldPackage
 
 
+# scaffold type name, module and class name, imported on first use so only the
+# scaffold types in use pay for importing their modules
+_scaffoldTypeModules = [
+    ('1D Bifurcation Tree 1', 'scaffoldmaker.meshtypes.meshtype_1d_bifurcationtree1', 'MeshType_1d_bifurcationtree1'),
+    ('1D Path 1', 'scaffoldmaker.meshtypes.meshtype_1d_path1', 'MeshType_1d_path1'),
+    ('2D Plate 1', 'scaffoldmaker.meshtypes.meshtype_2d_plate1', 'MeshType_2d_plate1'),
+    ('2D Plate Hole 1', 'scaffoldmaker.meshtypes.meshtype_2d_platehole1', 'MeshType_2d_platehole1'),
+    ('2D Sphere 1', 'scaffoldmaker.meshtypes.meshtype_2d_sphere1', 'MeshType_2d_sphere1'),
+    ('2D Tube 1', 'scaffoldmaker.meshtypes.meshtype_2d_tube1', 'MeshType_2d_tube1'),
+    ('2D Tube Bifurcation 1', 'scaffoldmaker.meshtypes.meshtype_2d_tubebifurcation1', 'MeshType_2d_tubebifurcation1'),
+    ('3D Bladder 1', 'scaffoldmaker.meshtypes.meshtype_3d_bladder1', 'MeshType_3d_bladder1'),
+    ('3D Bladder with Urethra 1', 'scaffoldmaker.meshtypes.meshtype_3d_bladderurethra1', 'MeshType_3d_bladderurethra1'),
+    ('3D Box 1', 'scaffoldmaker.meshtypes.meshtype_3d_box1', 'MeshType_3d_box1'),
+    ('3D Box Hole 1', 'scaffoldmaker.meshtypes.meshtype_3d_boxhole1', 'MeshType_3d_boxhole1'),
+    ('3D Cecum 1', 'scaffoldmaker.meshtypes.meshtype_3d_cecum1', 'MeshType_3d_cecum1'),
+    ('3D Colon 1', 'scaffoldmaker.meshtypes.meshtype_3d_colon1', 'MeshType_3d_colon1'),
+    ('3D Colon Segment 1', 'scaffoldmaker.meshtypes.meshtype_3d_colonsegment1', 'MeshType_3d_colonsegment1'),
+    ('3D Heart 1', 'scaffoldmaker.meshtypes.meshtype_3d_heart1', 'MeshType_3d_heart1'),
+    ('3D Heart 2', 'scaffoldmaker.meshtypes.meshtype_3d_heart2', 'MeshType_3d_heart2'),
+    ('3D Heart Arterial Root 1', 'scaffoldmaker.meshtypes.meshtype_3d_heartarterialroot1', 'MeshType_3d_heartarterialroot1'),
+    ('3D Heart Arterial Valve 1', 'scaffoldmaker.meshtypes.meshtype_3d_heartarterialvalve1', 'MeshType_3d_heartarterialvalve1'),
+    ('3D Heart Atria 1', 'scaffoldmaker.meshtypes.meshtype_3d_heartatria1', 'MeshType_3d_heartatria1'),
+    ('3D Heart Atria 2', 'scaffoldmaker.meshtypes.meshtype_3d_heartatria2', 'MeshType_3d_heartatria2'),
+    ('3D Heart Ventricles 1', 'scaffoldmaker.meshtypes.meshtype_3d_heartventricles1', 'MeshType_3d_heartventricles1'),
+    ('3D Heart Ventricles 2', 'scaffoldmaker.meshtypes.meshtype_3d_heartventricles2', 'MeshType_3d_heartventricles2'),
+    ('3D Heart Ventricles 3', 'scaffoldmaker.meshtypes.meshtype_3d_heartventricles3', 'MeshType_3d_heartventricles3'),
+    ('3D Heart Ventricles with Base 1', 'scaffoldmaker.meshtypes.meshtype_3d_heartventriclesbase1', 'MeshType_3d_heartventriclesbase1'),
+    ('3D Heart Ventricles with Base 2', 'scaffoldmaker.meshtypes.meshtype_3d_heartventriclesbase2', 'MeshType_3d_heartventriclesbase2'),
+    ('3D Lens 1', 'scaffoldmaker.meshtypes.meshtype_3d_lens1', 'MeshType_3d_lens1'),
+    ('3D Lung 1', 'scaffoldmaker.meshtypes.meshtype_3d_lung1', 'MeshType_3d_lung1'),
+    ('3D Ostium 1', 'scaffoldmaker.meshtypes.meshtype_3d_ostium1', 'MeshType_3d_ostium1'),
+    ('3D Small Intestine 1', 'scaffoldmaker.meshtypes.meshtype_3d_smallintestine1', 'MeshType_3d_smallintestine1'),
+    ('3D Solid Sphere 1', 'scaffoldmaker.meshtypes.meshtype_3d_solidsphere1', 'MeshType_3d_solidsphere1'),
+    ('3D Solid Cylinder 1', 'scaffoldmaker.meshtypes.meshtype_3d_solidcylinder1', 'MeshType_3d_solidcylinder1'),
+    ('3D Sphere Shell 1', 'scaffoldmaker.meshtypes.meshtype_3d_sphereshell1', 'MeshType_3d_sphereshell1'),
+    ('3D Sphere Shell Septum 1', 'scaffoldmaker.meshtypes.meshtype_3d_sphereshellseptum1', 'MeshType_3d_sphereshellseptum1'),
+    ('3D Stellate 1', 'scaffoldmaker.meshtypes.meshtype_3d_stellate1', 'MeshType_3d_stellate1'),
+    ('3D Stomach Human 1', 'scaffoldmaker.meshtypes.meshtype_3d_stomachhuman1', 'MeshType_3d_stomachhuman1'),
+    ('3D Tube 1', 'scaffoldmaker.meshtypes.meshtype_3d_tube1', 'MeshType_3d_tube1'),
+    ('3D Tube Septum 1', 'scaffoldmaker.meshtypes.meshtype_3d_tubeseptum1', 'MeshType_3d_tubeseptum1'),
+    ]
+
+
 class Scaffolds(object):
+    '''
+    Registry of scaffold types. Modules for scaffold types are only imported when
+    a type is found by name or all types are requested.
+    '''
 
     def __init__(self):
-        self._allScaffoldTypes = [
-            MeshType_1d_bifurcationtree1,
-            MeshType_1d_path1,
-            MeshType_2d_plate1,
-            MeshType_2d_platehole1,
-            MeshType_2d_sphere1,
-            MeshType_2d_tube1,
-            MeshType_2d_tubebifurcation1,
-            MeshType_3d_bladder1,
-            MeshType_3d_bladderurethra1,
-            MeshType_3d_box1,
-            MeshType_3d_boxhole1,
-            MeshType_3d_cecum1,
-            MeshType_3d_colon1,
-            MeshType_3d_colonsegment1,
-            MeshType_3d_heart1,
-            MeshType_3d_heart2,
-            MeshType_3d_heartarterialroot1,
-            MeshType_3d_heartarterialvalve1,
-            MeshType_3d_heartatria1,
-            MeshType_3d_heartatria2,
-            MeshType_3d_heartventricles1,
-            MeshType_3d_heartventricles2,
-            MeshType_3d_heartventricles3,
-            MeshType_3d_heartventriclesbase1,
-            MeshType_3d_heartventriclesbase2,
-            MeshType_3d_lens1,
-            MeshType_3d_lung1,
-            MeshType_3d_ostium1,
-            MeshType_3d_smallintestine1,
-            MeshType_3d_solidsphere1,
-            MeshType_3d_solidcylinder1,
-            MeshType_3d_sphereshell1,
-            MeshType_3d_sphereshellseptum1,
-            MeshType_3d_stellate1,
-            MeshType_3d_stomachhuman1,
-            MeshType_3d_tube1,
-            MeshType_3d_tubeseptum1,
-            ]
+        self._scaffoldTypeModules = { name: (moduleName, className) for name, moduleName, className in _scaffoldTypeModules }
+        self._scaffoldTypeNames = [ name for name, moduleName, className in _scaffoldTypeModules ]
+
+    def _getScaffoldType(self, name):
+        moduleName, className = self._scaffoldTypeModules[name]
+        return getattr(importlib.import_module(moduleName), className)
 
     def findScaffoldTypeByName(self, name):
-        for scaffoldType in self._allScaffoldTypes:
-            if scaffoldType.getName() == name:
-                return scaffoldType
+        if name in self._scaffoldTypeModules:
+            return self._getScaffoldType(name)
         return None
 
     def getDefaultMeshType(self):
@@ -99,7 +87,7 @@ class Scaffolds(object):
         return self.getDefaultScaffoldType()
 
     def getDefaultScaffoldType(self):
-        return MeshType_3d_box1
+        return self._getScaffoldType('3D Box 1')
 
     def getMeshTypes(self):
         '''
@@ -107,8 +95,73 @@ class Scaffolds(object):
         '''
         return self.getScaffoldTypes()
 
+    def getScaffoldTypeNames(self):
+        '''
+        :return: List of names of all scaffold types, without importing them.
+        '''
+        return list(self._scaffoldTypeNames)
+
     def getScaffoldTypes(self):
-        return self._allScaffoldTypes
+        '''
+        Get all scaffold types, importing modules for any not yet imported.
+        '''
+        return [ self._getScaffoldType(name) for name in self._scaffoldTypeNames ]
+
+    def __iter__(self):
+        return iter(self.getScaffoldTypes())
+
+    def generateBatch(self, packages, workers=None):
+        '''
+        Generate many scaffolds in parallel across a pool of processes, each
+        generating into its own Zinc context. Failures are isolated per item: if a
+        worker process dies, items running at the time are rerun in a process of
+        their own, and items not yet started are resubmitted to a new pool.
+        :param packages: List of ScaffoldPackage or dicts in the form of
+        ScaffoldPackage.toDict(), including scaffoldTypeName.
+        :param workers: Maximum number of worker processes, or None for number of CPUs.
+        :return: List of result dicts in the same order as packages, with keys:
+            model: Zinc model file bytes for generated, transformed scaffold, or None if failed.
+            annotationGroups: List of AnnotationGroup.toDict() for all annotation groups.
+            time: Wall time in seconds to generate and serialise the scaffold.
+            peakRss: Peak resident set size of worker process while generating the scaffold in
+            kilobytes, or None if unknown. Exact on Linux; elsewhere it is only known if it
+            exceeds the peak of earlier items generated by the same worker process.
+            error: Formatted traceback string if generation failed, otherwise None.
+        '''
+        packageStrings = []
+        for package in packages:
+            dct = package.toDict() if isinstance(package, ScaffoldPackage) else dict(package)
+            dct['_ScaffoldPackage'] = True
+            packageStrings.append(json.dumps(dct, cls=Scaffolds_JSONEncoder))
+        results = [ None ]*len(packageStrings)
+        pendingIndexes = list(range(len(packageStrings)))
+        while pendingIndexes:
+            # workers record indexes of items they start so those running when a worker dies are known
+            startedQueue = multiprocessing.SimpleQueue()
+            brokenIndexes = []
+            with ProcessPoolExecutor(max_workers=workers, initializer=_initBatchWorker, initargs=(startedQueue,)) as executor:
+                futures = [ executor.submit(_generateBatchItem, packageStrings[i], i) for i in pendingIndexes ]
+                for i, future in zip(pendingIndexes, futures):
+                    try:
+                        results[i] = future.result()
+                    except BrokenProcessPool:
+                        brokenIndexes.append(i)
+            startedIndexes = set()
+            while not startedQueue.empty():
+                startedIndexes.add(startedQueue.get())
+            isolateIndexes = [ i for i in brokenIndexes if i in startedIndexes ]
+            pendingIndexes = [ i for i in brokenIndexes if i not in startedIndexes ]
+            if not isolateIndexes:
+                # not known which item broke the pool
+                isolateIndexes = pendingIndexes
+                pendingIndexes = []
+            for i in isolateIndexes:
+                try:
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        results[i] = executor.submit(_generateBatchItem, packageStrings[i]).result()
+                except BrokenProcessPool:
+                    results[i] = _makeBatchResult(error='Worker process terminated abruptly')
+        return results
 
 
 class Scaffolds_JSONEncoder(json.JSONEncoder):
@@ -137,3 +190,96 @@ def Scaffolds_decodeJSON(dct):
         #print('Scaffolds_decodeJSON scaffoldType',scaffoldType.getName(), dct)
         return ScaffoldPackage(scaffoldType, dct)
     return dct
+
+
+# queue for recording indexes of batch items started by this worker process
+_batchStartedQueue = None
+
+
+def _initBatchWorker(startedQueue):
+    '''
+    Initialise worker process for Scaffolds.generateBatch().
+    :param startedQueue: Queue to put indexes of started items on.
+    '''
+    global _batchStartedQueue
+    _batchStartedQueue = startedQueue
+
+
+def _resetPeakRss():
+    '''
+    Reset peak resident set size of this process, on Linux only.
+    :return: True if reset, otherwise False.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clearRefs:
+            clearRefs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _getPeakRss():
+    '''
+    :return: Peak resident set size of this process in kilobytes since last reset on Linux,
+    otherwise over its lifetime, or None if unknown.
+    '''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    if not resource:
+        return None
+    peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peakRss //= 1024  # bytes on macOS
+    return peakRss
+
+
+def _makeBatchResult(model=None, annotationGroups=None, elapsedTime=0.0, peakRss=None, error=None):
+    return {
+        'model': model,
+        'annotationGroups': annotationGroups if annotationGroups is not None else [],
+        'time': elapsedTime,
+        'peakRss': peakRss,
+        'error': error
+        }
+
+
+def _generateBatchItem(packageString, itemIndex=None):
+    '''
+    Generate scaffold in a fresh Zinc context. Run in worker process by Scaffolds.generateBatch().
+    :param packageString: JSON-encoded ScaffoldPackage.
+    :param itemIndex: Optional index of item to record as started.
+    :return: Result dict, see Scaffolds.generateBatch().
+    '''
+    if (_batchStartedQueue is not None) and (itemIndex is not None):
+        _batchStartedQueue.put(itemIndex)
+    # worker processes are reused, so the peak is only for this item if reset or exceeded
+    peakRssReset = _resetPeakRss()
+    startPeakRss = None if peakRssReset else _getPeakRss()
+    startTime = time.perf_counter()
+    error = None
+    try:
+        scaffoldPackage = json.loads(packageString, object_hook=Scaffolds_decodeJSON)
+        context = Context('generateBatch')
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        sir = region.createStreaminformationRegion()
+        srm = sir.createStreamresourceMemory()
+        region.write(sir)
+        result, model = srm.getBuffer()
+        if isinstance(model, str):
+            model = bytes(model, 'utf-8')
+        annotationGroups = [ annotationGroup.toDict() for annotationGroup in scaffoldPackage.getAnnotationGroups() ]
+    except Exception:
+        model = None
+        annotationGroups = None
+        error = traceback.format_exc()
+    elapsedTime = time.perf_counter() - startTime
+    peakRss = _getPeakRss()
+    if (not peakRssReset) and (startPeakRss is not None) and (peakRss is not None) and (peakRss <= startPeakRss):
+        peakRss = None  # not exceeding peak of earlier items
+    return _makeBatchResult(model, annotationGroups, elapsedTime, peakRss, error)
@@ -0,0 +1,135 @@
+'''
+Bounding volume hierarchy for finding objects nearest to points
+'''
+from __future__ import division
+import numpy as np
+
+
+class BoundingVolumeHierarchy:
+    '''
+    Binary tree of axis-aligned bounding boxes around objects, e.g. elements, each with
+    points sampled on it. Finds the object with the nearest sample point to query points
+    by descending first to the leaf nearest each point for an initial distance, then
+    visiting only boxes closer than the nearest sample found so far. All query points are
+    processed together over flat numpy arrays, one tree level at a time.
+    '''
+
+    def __init__(self, minimums, maximums, samplePoints, leafSize = 4):
+        '''
+        :param minimums, maximums: Bounding box minimum and maximum coordinates of each
+        of N objects, array-like with shape (N, 3). Boxes must contain the sample points.
+        :param samplePoints: Points sampled on each object, array-like with shape (N, S, 3).
+        :param leafSize: Maximum number of objects in each leaf box.
+        '''
+        self._minimums = np.asarray(minimums, dtype=np.float64)
+        self._maximums = np.asarray(maximums, dtype=np.float64)
+        self._samplePoints = np.asarray(samplePoints, dtype=np.float64)
+        objectsCount = self._minimums.shape[0]
+        assert (objectsCount > 0) and (self._maximums.shape == self._minimums.shape) and \
+            (self._samplePoints.shape[0] == objectsCount), 'BoundingVolumeHierarchy.  Invalid boxes or sample points'
+        self._leafSize = leafSize
+        nodeMinimums = []
+        nodeMaximums = []
+        self._nodeChildren = []
+        self._nodeObjectsRanges = []
+        # objects in order of leaves, so each leaf has a range of them
+        self._objectOrder = np.arange(objectsCount)
+        self._build(0, objectsCount, nodeMinimums, nodeMaximums)
+        self._nodeMinimums = np.array(nodeMinimums)
+        self._nodeMaximums = np.array(nodeMaximums)
+        self._nodeChildren = np.array(self._nodeChildren, dtype=np.int64)
+        self._nodeObjectsRanges = np.array(self._nodeObjectsRanges, dtype=np.int64)
+
+    def _build(self, start, end, nodeMinimums, nodeMaximums):
+        '''
+        Add node for objects in range start:end of object order, splitting at the median
+        of box centres on the longest axis, recursively.
+        :return: Node index.
+        '''
+        node = len(nodeMinimums)
+        objects = self._objectOrder[start:end]
+        nodeMinimums.append(np.min(self._minimums[objects], axis=0))
+        nodeMaximums.append(np.max(self._maximums[objects], axis=0))
+        self._nodeChildren.append([ -1, -1 ])
+        self._nodeObjectsRanges.append([ start, end ])
+        if (end - start) > self._leafSize:
+            centres = self._minimums[objects] + self._maximums[objects]
+            axis = np.argmax(nodeMaximums[node] - nodeMinimums[node])
+            self._objectOrder[start:end] = objects[np.argsort(centres[:, axis], kind='stable')]
+            middle = (start + end)//2
+            self._nodeChildren[node] = [ self._build(start, middle, nodeMinimums, nodeMaximums),
+                                         self._build(middle, end, nodeMinimums, nodeMaximums) ]
+        return node
+
+    def _getBoxDistancesSquared(self, x, nodes):
+        '''
+        :return: Squared distances from points x with shape (P, 3) to boxes of nodes with shape (P,).
+        '''
+        outside = np.maximum(np.maximum(self._nodeMinimums[nodes] - x, x - self._nodeMaximums[nodes]), 0.0)
+        return np.einsum('pc,pc->p', outside, outside)
+
+    def _searchLeaves(self, x, points, nodes, best):
+        '''
+        Update best distance squared, object and sample for points from samples of objects in leaf nodes.
+        :param points, nodes: Arrays of query point indexes and leaf node indexes to search.
+        :param best: Tuple of arrays of distance squared, object index and sample index per query point.
+        '''
+        bestDistancesSquared, bestObjects, bestSamples = best
+        ranges = self._nodeObjectsRanges[nodes]
+        counts = ranges[:, 1] - ranges[:, 0]
+        # expand to pairs of query point and object
+        pairPoints = np.repeat(points, counts)
+        pairOffsets = np.arange(pairPoints.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        pairObjects = self._objectOrder[np.repeat(ranges[:, 0], counts) + pairOffsets]
+        delta = self._samplePoints[pairObjects] - x[pairPoints][:, np.newaxis, :]
+        distancesSquared = np.einsum('psc,psc->ps', delta, delta)
+        samples = np.argmin(distancesSquared, axis=1)
+        pairDistancesSquared = distancesSquared[np.arange(samples.size), samples]
+        # nearest pair for each point, lowest object index on ties
+        order = np.lexsort((pairObjects, pairDistancesSquared, pairPoints))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = pairPoints[order[1:]] != pairPoints[order[:-1]]
+        order = order[first]
+        closer = pairDistancesSquared[order] < bestDistancesSquared[pairPoints[order]]
+        order = order[closer]
+        updatePoints = pairPoints[order]
+        bestDistancesSquared[updatePoints] = pairDistancesSquared[order]
+        bestObjects[updatePoints] = pairObjects[order]
+        bestSamples[updatePoints] = samples[order]
+
+    def findNearestSamples(self, x):
+        '''
+        Find the object and sample point nearest to each of many points.
+        :param x: Query points, array-like with shape (M, 3).
+        :return: Arrays of object indexes, sample indexes and distances to them, each with shape (M,).
+        '''
+        x = np.asarray(x, dtype=np.float64).reshape(-1, 3)
+        pointsCount = x.shape[0]
+        best = (np.full(pointsCount, np.inf), np.full(pointsCount, -1, dtype=np.int64),
+                np.full(pointsCount, -1, dtype=np.int64))
+        # descend to nearest leaf for initial best distance
+        nodes = np.zeros(pointsCount, dtype=np.int64)
+        while True:
+            internal = np.flatnonzero(self._nodeChildren[nodes, 0] >= 0)
+            if internal.size == 0:
+                break
+            children = self._nodeChildren[nodes[internal]]
+            distancesSquared0 = self._getBoxDistancesSquared(x[internal], children[:, 0])
+            distancesSquared1 = self._getBoxDistancesSquared(x[internal], children[:, 1])
+            nodes[internal] = np.where(distancesSquared1 < distancesSquared0, children[:, 1], children[:, 0])
+        self._searchLeaves(x, np.arange(pointsCount), nodes, best)
+        # visit boxes nearer than best sample found so far
+        points = np.arange(pointsCount)
+        nodes = np.zeros(pointsCount, dtype=np.int64)
+        while points.size > 0:
+            nearer = self._getBoxDistancesSquared(x[points], nodes) < best[0][points]
+            points = points[nearer]
+            nodes = nodes[nearer]
+            children = self._nodeChildren[nodes]
+            leaf = children[:, 0] < 0
+            if np.any(leaf):
+                self._searchLeaves(x, points[leaf], nodes[leaf], best)
+            internal = ~leaf
+            points = np.repeat(points[internal], 2)
+            nodes = children[internal].reshape(-1)
+        return best[1], best[2], np.sqrt(best[0])
@@ -13,6 +13,7 @@ from scaffoldmaker.utils.shieldmesh import ShieldMesh, ShieldShape, ShieldRimDer
 from scaffoldmaker.utils.interpolation import sampleCubicHermiteCurves, interpolateSampleCubicHermite, \
     smoothCubicHermiteDerivativesLine, interpolateSampleLinear
 from opencmiss.zinc.node import Node
+from scaffoldmaker.utils.interpolation_np import getPackedOffsets, smoothCubicHermiteDerivativesLinesPacked
 from scaffoldmaker.utils.mirror import Mirror
 from scaffoldmaker.meshtypes.meshtype_1d_path1 import extractPathParametersFromRegion
 
@@ -274,17 +275,26 @@ class CylinderMesh:
         btd1 = self._shield.pd1
         btd2 = self._shield.pd2
         btd3 = self._shield.pd3
+        # pack lines along from all nodes in the base, to smooth at once
+        nodesCountAlong = self._elementsCountAlong + 1
+        columns = []
+        tx = []
+        td2 = []
         for n2 in range(self._elementsCountAcrossMajor + 1):
             for n1 in range(self._elementsCountAcrossMinor + 1):
-                td2 = []
-                tx = []
                 if btx[0][n2][n1]:
-                    for n3 in range(self._elementsCountAlong + 1):
+                    columns.append((n2, n1))
+                    for n3 in range(nodesCountAlong):
                         tx.append(btx[n3][n2][n1])
                         td2.append(btd2[n3][n2][n1])
-                    td2 = smoothCubicHermiteDerivativesLine(tx, td2, fixStartDirection=True)
-                    for n3 in range(self._elementsCountAlong + 1):
-                        btd2[n3][n2][n1] = td2[n3]
+        if not columns:
+            return
+        td2, _ = smoothCubicHermiteDerivativesLinesPacked(tx, td2, getPackedOffsets([nodesCountAlong]*len(columns)),
+                                                          fixStartDirection=True)
+        td2 = td2.tolist()
+        for c, (n2, n1) in enumerate(columns):
+            for n3 in range(nodesCountAlong):
+                btd2[n3][n2][n1] = td2[c*nodesCountAlong + n3]
 
     def setEndsNodes(self):
         """
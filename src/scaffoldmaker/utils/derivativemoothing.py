@@ -3,15 +3,16 @@ Class for globally smoothing field derivatives.
 '''
 from __future__ import division
 import math
-from opencmiss.utils.maths.vectorops import add, magnitude
+import time
+import numpy as np
 from opencmiss.utils.zinc.field import findOrCreateFieldGroup
 from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.element import Element, Elementbasis
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.node import Node
 from opencmiss.zinc.result import RESULT_OK as ZINC_OK
-from scaffoldmaker.utils.interpolation import DerivativeScalingMode, getCubicHermiteArcLength, interpolateHermiteLagrangeDerivative, interpolateLagrangeHermiteDerivative
-from scaffoldmaker.utils.vector import setMagnitude
+from scaffoldmaker.utils import interpolation, interpolation_np
+from scaffoldmaker.utils.interpolation import DerivativeScalingMode
 
 
 class EdgeCurve:
@@ -21,63 +22,28 @@ class EdgeCurve:
 
     def __init__(self, expressions):
         self._expressions = expressions
-        self._arcLength = None
-        self._lastArcLength = 0.0
-        self._parameters = None
-
-    def evaluateArcLength(self, nodes, field, fieldcache):
-        componentsCount = field.getNumberOfComponents()
-        self._parameters = []
-        for expression in self._expressions:
-            sumx = None
-            for term in expression:
-                nodeIdentifier, nodeValueLabel, nodeVersion, scaleFactor = term
-                fieldcache.setNode(nodes.findNodeByIdentifier(nodeIdentifier))
-                result, x = field.getNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, componentsCount)
-                if scaleFactor:
-                    x = [ v*scaleFactor for v in x ]
-                if sumx:
-                    sumx = [ (sumx[c] + x[c]) for c in range(componentsCount) ]
-                else:
-                    sumx = x
-            self._parameters.append(sumx)
-        self._arcLength = getCubicHermiteArcLength(*self._parameters)
-        return self._arcLength
-
-    def getArcLength(self):
-        '''
-        Caller must have called evaluateArcLength!
-        '''
-        return self._arcLength
-
-    def getLastArcLength(self):
-        return self._lastArcLength
-
-    def updateLastArcLength(self):
-        self._lastArcLength = self._arcLength
-
-    def getDelta(self):
-        '''
-        Caller must have called evaluateArcLength!
-        '''
-        x1 = self._parameters[0]
-        x2 = self._parameters[2]
-        componentsCount = len(x1)
-        return [ (x2[c] - x1[c]) for c in range(componentsCount) ]
 
     def getExpression(self, expressionIndex):
         '''
-        Caller must have called evaluateArcLength!
-        :param parameterIndex: 0 = start x, 1 = start d, 2 = end x, 3 = end d
+        :param expressionIndex: 0 = start x, 1 = start d, 2 = end x, 3 = end d
+        :return: List of terms of global node id, value label, version, scale factor or None.
         '''
         return self._expressions[expressionIndex]
 
-    def getParameter(self, parameterIndex):
-        '''
-        Caller must have called evaluateArcLength!
-        :param parameterIndex: 0 = start x, 1 = start d, 2 = end x, 3 = end d
-        '''
-        return self._parameters[parameterIndex]
+
+def _getEdgeArcLengths(edgeParameters):
+    '''
+    Get arc lengths of edge curves as given by interpolation.getCubicHermiteArcLength(),
+    evaluated at once by 4 point Gaussian quadrature unless an arc length tolerance is set.
+    :param edgeParameters: Edge curve x1, d1, x2, d2 with shape (N, 4, C).
+    :return: Arc lengths with shape (N,).
+    '''
+    if interpolation.getArcLengthTolerance():
+        return np.array([ interpolation.getCubicHermiteArcLength(*curveParameters)
+            for curveParameters in edgeParameters.tolist() ])
+    return interpolation_np.getCubicHermiteArcLength(
+        edgeParameters[:, 0], edgeParameters[:, 1], edgeParameters[:, 2], edgeParameters[:, 3])
+
 
 class DerivativeSmoothing:
     '''
@@ -128,6 +94,8 @@ class DerivativeSmoothing:
         self._edgesMap = {}
         # map global nodeid, derivative, version to list of EdgeCurve
         self._derivativeMap = {}
+        # arrays compiled from edges and derivative maps on first smooth
+        self._edgeTable = None
         if selectionGroupName:
             self._selectionGroup = self._fieldmodule.findFieldByName(selectionGroupName).castGroup()
             if not self._selectionGroup.isValid():
@@ -285,105 +253,343 @@ class DerivativeSmoothing:
                 else:
                     self._derivativeMap[derivativeKey] = [ derivativeEdge ]
 
-    def smooth(self, updateDirections=False, maxIterations=10, arcLengthTolerance=1.0E-6):
+    def _buildEdgeTable(self):
+        '''
+        Compile edge and derivative maps into index and scale factor arrays for smoothing
+        in array space over the node parameters they use, each parameter being a node
+        identifier, value label and version. Dict keys:
+            parameterKeys: List of (node identifier, value label, version) for each parameter used.
+            edgesCount: Number of edges.
+            lastArcLengths: Arc lengths of edges at the last iteration.
+            termEdgeExpressions: For each term of all edge expressions: 4*edge index + expression index.
+            termParameters, termScaleFactors: Parameter index and scale factor for each term.
+            middleParameters: Index of each derivative parameter on more than one edge.
+            middleTermDerivatives, middleTermEdges: Index into middleParameters and edge
+            index for each edge the derivative parameter is on.
+            middleTermSigns, middleTermScaleFactors: Sign and magnitude of scale factor of each.
+            middleEdgeCounts: Number of edges each middle derivative is on.
+            boundaryParameters, boundaryEdges, boundaryExpressions, boundaryScaleFactors: For each
+            derivative parameter on one edge, its parameter index, edge index, expression index 1 or 3
+            and scale factor.
+            boundaryBothEnds: For each boundary derivative, whether the other end is a boundary derivative.
+            boundaryWaves: List of arrays of boundary derivative indexes which can be updated together,
+            giving the same result as updating one at a time in order, since each depends on the
+            values set by earlier derivatives on its edge.
+        '''
+        parameterIndexes = {}
+        parameterKeys = []
+
+        def getParameterIndex(parameterKey):
+            parameterIndex = parameterIndexes.get(parameterKey)
+            if parameterIndex is None:
+                parameterIndex = parameterIndexes[parameterKey] = len(parameterKeys)
+                parameterKeys.append(parameterKey)
+            return parameterIndex
+
+        edgeIndexes = {}
+        termEdgeExpressions = []
+        termParameters = []
+        termScaleFactors = []
+        edgeReadParameters = []
+        for edgeIndex, edge in enumerate(self._edgesMap.values()):
+            edgeIndexes[edge] = edgeIndex
+            readParameters = set()
+            for expressionIndex in range(4):
+                for nodeIdentifier, nodeValueLabel, nodeVersion, scaleFactor in edge.getExpression(expressionIndex):
+                    parameterIndex = getParameterIndex((nodeIdentifier, nodeValueLabel, nodeVersion))
+                    termEdgeExpressions.append(4*edgeIndex + expressionIndex)
+                    termParameters.append(parameterIndex)
+                    termScaleFactors.append(scaleFactor if scaleFactor else 1.0)
+                    readParameters.add(parameterIndex)
+            edgeReadParameters.append(readParameters)
+        middleParameters = []
+        middleTermDerivatives = []
+        middleTermEdges = []
+        middleTermSigns = []
+        middleTermScaleFactors = []
+        middleEdgeCounts = []
+        boundaryParameters = []
+        boundaryEdges = []
+        boundaryExpressions = []
+        boundaryScaleFactors = []
+        boundaryBothEnds = []
+        boundaryWaveNumbers = []
+        # wave number of last boundary derivative writing and highest reading each parameter
+        writeWaveNumbers = {}
+        readWaveNumbers = {}
+        for derivativeKey, derivativeEdges in self._derivativeMap.items():
+            parameterIndex = getParameterIndex(derivativeKey)
+            edgeCount = len(derivativeEdges)
+            if edgeCount > 1:
+                for edge, expressionIndex, totalScaleFactor in derivativeEdges:
+                    middleTermDerivatives.append(len(middleParameters))
+                    middleTermEdges.append(edgeIndexes[edge])
+                    middleTermSigns.append(-1.0 if (totalScaleFactor < 0.0) else 1.0)
+                    middleTermScaleFactors.append(math.fabs(totalScaleFactor))
+                middleParameters.append(parameterIndex)
+                middleEdgeCounts.append(edgeCount)
+            else:
+                edge, expressionIndex, totalScaleFactor = derivativeEdges[0]
+                edgeIndex = edgeIndexes[edge]
+                otherExpression = edge.getExpression(3 if (expressionIndex == 1) else 1)
+                bothEndsOnBoundary = False
+                if len(otherExpression) == 1:
+                    otherDerivativeEdges = self._derivativeMap.get(tuple(otherExpression[0][0:3]))
+                    bothEndsOnBoundary = (otherDerivativeEdges is not None) and (len(otherDerivativeEdges) == 1)
+                # must follow earlier derivatives writing parameters read here, and not precede earlier reads of its parameter
+                waveNumber = readWaveNumbers.get(parameterIndex, 0)
+                for readParameterIndex in edgeReadParameters[edgeIndex]:
+                    writeWaveNumber = writeWaveNumbers.get(readParameterIndex)
+                    if writeWaveNumber is not None:
+                        waveNumber = max(waveNumber, writeWaveNumber + 1)
+                writeWaveNumbers[parameterIndex] = waveNumber
+                for readParameterIndex in edgeReadParameters[edgeIndex]:
+                    readWaveNumbers[readParameterIndex] = max(readWaveNumbers.get(readParameterIndex, 0), waveNumber)
+                boundaryParameters.append(parameterIndex)
+                boundaryEdges.append(edgeIndex)
+                boundaryExpressions.append(expressionIndex)
+                boundaryScaleFactors.append(totalScaleFactor)
+                boundaryBothEnds.append(bothEndsOnBoundary)
+                boundaryWaveNumbers.append(waveNumber)
+        boundaryWaveNumbers = np.array(boundaryWaveNumbers, dtype=np.int64)
+        wavesCount = (np.max(boundaryWaveNumbers) + 1) if (boundaryWaveNumbers.size > 0) else 0
+        self._edgeTable = {
+            'parameterKeys': parameterKeys,
+            'edgesCount': len(edgeIndexes),
+            'lastArcLengths': np.zeros(len(edgeIndexes)),
+            'termEdgeExpressions': np.array(termEdgeExpressions, dtype=np.int64),
+            'termParameters': np.array(termParameters, dtype=np.int64),
+            'termScaleFactors': np.array(termScaleFactors, dtype=np.float64),
+            'middleParameters': np.array(middleParameters, dtype=np.int64),
+            'middleTermDerivatives': np.array(middleTermDerivatives, dtype=np.int64),
+            'middleTermEdges': np.array(middleTermEdges, dtype=np.int64),
+            'middleTermSigns': np.array(middleTermSigns, dtype=np.float64),
+            'middleTermScaleFactors': np.array(middleTermScaleFactors, dtype=np.float64),
+            'middleEdgeCounts': np.array(middleEdgeCounts, dtype=np.int64),
+            'boundaryParameters': np.array(boundaryParameters, dtype=np.int64),
+            'boundaryEdges': np.array(boundaryEdges, dtype=np.int64),
+            'boundaryExpressions': np.array(boundaryExpressions, dtype=np.int64),
+            'boundaryScaleFactors': np.array(boundaryScaleFactors, dtype=np.float64),
+            'boundaryBothEnds': np.array(boundaryBothEnds, dtype=bool),
+            'boundaryWaves': [ np.flatnonzero(boundaryWaveNumbers == waveNumber) for waveNumber in range(wavesCount) ]
+        }
+
+    def _extractParameters(self, fieldcache):
+        '''
+        :return: Array of parameters in edge table with shape (parametersCount, componentsCount).
+        '''
+        componentsCount = self._field.getNumberOfComponents()
+        parameterKeys = self._edgeTable['parameterKeys']
+        parameters = np.zeros((len(parameterKeys), componentsCount))
+        lastNodeIdentifier = None
+        # visit parameters in node order to set each node in cache once
+        for parameterIndex in sorted(range(len(parameterKeys)), key=lambda i: parameterKeys[i][0]):
+            nodeIdentifier, nodeValueLabel, nodeVersion = parameterKeys[parameterIndex]
+            if nodeIdentifier != lastNodeIdentifier:
+                fieldcache.setNode(self._nodes.findNodeByIdentifier(nodeIdentifier))
+                lastNodeIdentifier = nodeIdentifier
+            result, x = self._field.getNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, componentsCount)
+            parameters[parameterIndex] = x
+        return parameters
+
+    def _storeParameters(self, fieldcache, parameters, parameterIndexes):
+        '''
+        Set field node parameters from array for parameterIndexes in edge table.
+        '''
+        parameterKeys = self._edgeTable['parameterKeys']
+        lastNodeIdentifier = None
+        for parameterIndex in sorted(parameterIndexes, key=lambda i: parameterKeys[i][0]):
+            nodeIdentifier, nodeValueLabel, nodeVersion = parameterKeys[parameterIndex]
+            if nodeIdentifier != lastNodeIdentifier:
+                fieldcache.setNode(self._nodes.findNodeByIdentifier(nodeIdentifier))
+                lastNodeIdentifier = nodeIdentifier
+            self._field.setNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, parameters[parameterIndex].tolist())
+
+    def _evaluateEdgeParameters(self, parameters):
+        '''
+        :return: Array of x1, d1, x2, d2 of all edges from parameters, shape (edgesCount, 4, componentsCount).
         '''
+        table = self._edgeTable
+        edgeParameters = np.zeros((4*table['edgesCount'], parameters.shape[1]))
+        # unbuffered sum of terms in order
+        np.add.at(edgeParameters, table['termEdgeExpressions'],
+                  parameters[table['termParameters']]*table['termScaleFactors'][:, np.newaxis])
+        return edgeParameters.reshape(-1, 4, parameters.shape[1])
+
+    @staticmethod
+    def _getMagnitudes(x):
+        '''
+        :return: Magnitudes of vectors x, summing squares of components in order as vectorops.magnitude() does.
+        '''
+        magnitudeSquared = x[:, 0]*x[:, 0]
+        for c in range(1, x.shape[1]):
+            magnitudeSquared = magnitudeSquared + x[:, c]*x[:, c]
+        return np.sqrt(magnitudeSquared)
+
+    @classmethod
+    def _setMagnitudes(cls, x, mags):
+        '''
+        :return: Vectors x scaled to magnitudes mags, with same arithmetic as vector.setMagnitude().
+        '''
+        return x*(mags/cls._getMagnitudes(x))[:, np.newaxis]
+
+    def smooth(self, updateDirections=False, maxIterations=10, arcLengthTolerance=1.0E-6,
+               progressCallback=None, timeLimit=None):
+        '''
+        Iterates in array space over node parameters extracted once from the field, and
+        stores the smoothed derivatives in the field at the end.
         :param maxIterations: Maximum iterations before stopping if not converging.
         :param arcLengthTolerance: Ratio of difference in arc length from last iteration
         divided by current arc length under which convergence is achieved. Required to
         be met by every element edge.
+        :param progressCallback: Optional function called after evaluating the residual of
+        each iterate including the last as progressCallback(iteration, residual). Return
+        True to stop early.
+        :param timeLimit: Optional time in seconds after which smoothing stops early.
+        On stopping early, the iterate with the lowest residual is stored.
+        :return: Dict with keys:
+            converged: True if arc length tolerance met, or nothing to smooth.
+            stopReason: One of 'converged', 'maxIterations', 'timeLimit', 'callback'.
+            iterations: Number of smoothing iterations performed.
+            residuals: List of maximum relative arc length change of each iterate.
+            bestIteration: Iteration of iterate stored in field.
+            edgesCount, derivativesCount: Numbers of element edges and node derivatives.
+            setupTime, iterationTime, storeTime, wallTime: Elapsed times in seconds.
         '''
+        startTime = time.perf_counter()
+        result = {
+            'converged': True,
+            'stopReason': 'converged',
+            'iterations': 0,
+            'residuals': [],
+            'bestIteration': 0,
+            'edgesCount': 0,
+            'derivativesCount': len(self._derivativeMap),
+            'setupTime': 0.0,
+            'iterationTime': 0.0,
+            'storeTime': 0.0,
+            'wallTime': 0.0
+        }
         if not self._derivativeMap:
-            return  # no nodes being smoothed
-        componentsCount = self._field.getNumberOfComponents()
+            return result  # no nodes being smoothed
+        if self._edgeTable is None:
+            self._buildEdgeTable()
+        table = self._edgeTable
+        result['edgesCount'] = table['edgesCount']
+        arithmeticMean = self._scalingMode == DerivativeScalingMode.ARITHMETIC_MEAN
+        parameterKeys = table['parameterKeys']
+        middleParameters = table['middleParameters']
+        middleTermDerivatives = table['middleTermDerivatives']
+        middleTermEdges = table['middleTermEdges']
+        middleTermScaleFactors = table['middleTermScaleFactors']
+        middleEdgeCounts = table['middleEdgeCounts']
         with ChangeManager(self._fieldmodule):
             fieldcache = self._fieldmodule.createFieldcache()
+            parameters = self._extractParameters(fieldcache)
+            # keep last arc lengths between calls
+            lastArcLengths = table['lastArcLengths']
+            residuals = result['residuals']
+            bestResidual = None
+            iterationStartTime = time.perf_counter()
+            result['setupTime'] = iterationStartTime - startTime
             for iter in range(maxIterations + 1):
-                converged = True
-                for edge in self._edgesMap.values():
-                    lastArcLength = edge.getLastArcLength()
-                    arcLength = edge.evaluateArcLength(self._nodes, self._field, fieldcache)
-                    edge.updateLastArcLength()
-                    if (math.fabs(arcLength - lastArcLength)/arcLength) > arcLengthTolerance:
-                        converged = False
+                edgeParameters = self._evaluateEdgeParameters(parameters)
+                arcLengths = _getEdgeArcLengths(edgeParameters)
+                relativeChanges = np.fabs(arcLengths - lastArcLengths)/arcLengths
+                converged = not np.any(relativeChanges > arcLengthTolerance)
+                residual = float(np.max(relativeChanges))
+                residuals.append(residual)
+                lastArcLengths = table['lastArcLengths'] = arcLengths
+                result['iterations'] = iter
+                if (bestResidual is None) or (residual < bestResidual):
+                    bestResidual = residual
+                    bestIteration = iter
+                # call for every iterate, including the last
+                callbackStop = bool(progressCallback and progressCallback(iter, residual))
+                stopReason = None
                 if converged:
                     print('Derivative smoothing: Converged after', iter, 'iterations.')
-                    break
+                    stopReason = 'converged'
                 elif (iter == maxIterations):
                     print('Derivative smoothing: Stopping after', maxIterations, 'iterations without converging.')
+                    stopReason = 'maxIterations'
+                elif callbackStop:
+                    print('Derivative smoothing: Stopped by callback after', iter, 'iterations.')
+                    stopReason = 'callback'
+                elif (timeLimit is not None) and ((time.perf_counter() - startTime) > timeLimit):
+                    print('Derivative smoothing: Stopping after', iter, 'iterations at time limit.')
+                    stopReason = 'timeLimit'
+                if stopReason:
+                    result['converged'] = converged
+                    result['stopReason'] = stopReason
+                    if (stopReason in ('callback', 'timeLimit')) and (bestIteration < iter):
+                        parameters = bestParameters
+                        table['lastArcLengths'] = bestArcLengths
+                    else:
+                        bestIteration = iter
+                    result['bestIteration'] = bestIteration
                     break
-                for derivativeKey, derivativeEdges in self._derivativeMap.items():
-                    edgeCount = len(derivativeEdges)
-                    if edgeCount > 1:
-                        nodeIdentifier, nodeValueLabel, nodeVersion = derivativeKey
-                        fieldcache.setNode(self._nodes.findNodeByIdentifier(nodeIdentifier))
-                        if updateDirections:
-                            x = [ 0.0 for _ in range(componentsCount) ]
-                        else:
-                            result, x = self._field.getNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, componentsCount)
-                        mag = 0.0
-                        for derivativeEdge in derivativeEdges:
-                            edge, expressionIndex, totalScaleFactor = derivativeEdge
-                            arcLength = edge.getArcLength()
-                            if updateDirections:
-                                delta = edge.getDelta()
-                                if totalScaleFactor < 0.0:
-                                    delta = [ -d for d in delta ]
-                                for c in range(componentsCount):
-                                    x[c] += delta[c] / arcLength
-                            if self._scalingMode == DerivativeScalingMode.ARITHMETIC_MEAN:
-                                mag += arcLength/math.fabs(totalScaleFactor)
-                            else: # self._scalingMode == DerivativeScalingMode.HARMONIC_MEAN
-                                mag += math.fabs(totalScaleFactor)/arcLength
-                        if self._scalingMode == DerivativeScalingMode.ARITHMETIC_MEAN:
-                            mag /= edgeCount
-                        else: # self._scalingMode == DerivativeScalingMode.HARMONIC_MEAN
-                            mag = edgeCount/mag
-                        if (mag <= 0.0):
-                            print('Node', nodeIdentifier, 'label', label, 'version', version, 'has negative mag', mag)
-                        x = setMagnitude(x, mag)
-                        result = self._field.setNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, x)
-                for derivativeKey, derivativeEdges in self._derivativeMap.items():
-                    edgeCount = len(derivativeEdges)
-                    if edgeCount == 1:
-                        # boundary smoothing over single edge
-                        nodeIdentifier, nodeValueLabel, nodeVersion = derivativeKey
-                        edge, expressionIndex, totalScaleFactor = derivativeEdges[0]
-                        # re-evaluate arc length so parameters are up-to-date for other end
-                        arcLength = edge.evaluateArcLength(self._nodes, self._field, fieldcache)
-                        fieldcache.setNode(self._nodes.findNodeByIdentifier(nodeIdentifier))  # since changed by evaluateArcLength
-                        otherExpressionIndex = 3 if (expressionIndex == 1) else 1
-                        otherd = edge.getParameter(otherExpressionIndex)
-                        if updateDirections:
-                            thisx = edge.getParameter(expressionIndex - 1)
-                            otherx = edge.getParameter(otherExpressionIndex - 1)
-                            bothEndsOnBoundary = False
-                            otherExpression = edge.getExpression(otherExpressionIndex)
-                            if len(otherExpression) == 1:
-                                otherNodeIdentifier, otherValueLabel, otherNodeVersion, otherTotalScaleFactor = otherExpression[0]
-                                otherDerivativeKey = (otherNodeIdentifier, otherValueLabel, otherNodeVersion)
-                                otherDerivativeEdges = self._derivativeMap.get(otherDerivativeKey)
-                                bothEndsOnBoundary = (otherDerivativeEdges is not None) and (len(otherDerivativeEdges) == 1)
-                            if bothEndsOnBoundary:
-                                if expressionIndex == 1:
-                                    x = [ (otherx[c] - thisx[c]) for c in range(componentsCount) ]
-                                else:
-                                    x = [ (thisx[c] - otherx[c]) for c in range(componentsCount) ]
-                            else:
-                                if expressionIndex == 1:
-                                    x = interpolateLagrangeHermiteDerivative(thisx, otherx, otherd, 0.0)
-                                else:
-                                    x = interpolateHermiteLagrangeDerivative(otherx, otherd, thisx, 1.0)
-                            x = [ d/totalScaleFactor for d in x ]
-                        else:
-                            result, x = self._field.getNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, componentsCount)
-                        othermag = magnitude(otherd)
-                        mag = (2.0*arcLength - othermag)/math.fabs(totalScaleFactor)
-                        if (mag <= 0.0):
-                            print('Derivative smoothing: Node', nodeIdentifier, 'label', nodeValueLabel, 'version', nodeVersion, 'has negative magnitude', mag)
-                        x = setMagnitude(x, mag)
-                        result = self._field.setNodeParameters(fieldcache, -1, nodeValueLabel, nodeVersion, x)
+                if bestIteration == iter:
+                    # copy best iterate before changing in place, only needed if stopping early
+                    if progressCallback or (timeLimit is not None):
+                        bestParameters = np.copy(parameters)
+                        bestArcLengths = arcLengths
+                if middleParameters.size > 0:
+                    if updateDirections:
+                        x = np.zeros((middleParameters.size, parameters.shape[1]))
+                        deltas = edgeParameters[middleTermEdges, 2] - edgeParameters[middleTermEdges, 0]
+                        deltas *= table['middleTermSigns'][:, np.newaxis]
+                        np.add.at(x, middleTermDerivatives, deltas/arcLengths[middleTermEdges][:, np.newaxis])
+                    else:
+                        x = parameters[middleParameters]
+                    mags = np.zeros(middleParameters.size)
+                    if arithmeticMean:
+                        np.add.at(mags, middleTermDerivatives, arcLengths[middleTermEdges]/middleTermScaleFactors)
+                        mags /= middleEdgeCounts
+                    else:
+                        np.add.at(mags, middleTermDerivatives, middleTermScaleFactors/arcLengths[middleTermEdges])
+                        mags = middleEdgeCounts/mags
+                    for m in np.flatnonzero(mags <= 0.0).tolist():
+                        nodeIdentifier, nodeValueLabel, nodeVersion = parameterKeys[middleParameters[m]]
+                        print('Derivative smoothing: Node', nodeIdentifier, 'label', nodeValueLabel, 'version', nodeVersion, 'has negative magnitude', mags[m])
+                    parameters[middleParameters] = self._setMagnitudes(x, mags)
+                for wave in table['boundaryWaves']:
+                    # re-evaluate edges so parameters are up-to-date for other end
+                    edgeParameters = self._evaluateEdgeParameters(parameters)
+                    edges = table['boundaryEdges'][wave]
+                    arcLengths = _getEdgeArcLengths(edgeParameters[edges])
+                    expressionIndexes = table['boundaryExpressions'][wave]
+                    otherExpressionIndexes = 4 - expressionIndexes
+                    otherd = edgeParameters[edges, otherExpressionIndexes]
+                    scaleFactors = table['boundaryScaleFactors'][wave]
+                    boundaryParameters = table['boundaryParameters'][wave]
+                    if updateDirections:
+                        thisx = edgeParameters[edges, expressionIndexes - 1]
+                        otherx = edgeParameters[edges, otherExpressionIndexes - 1]
+                        start = (expressionIndexes == 1)[:, np.newaxis]
+                        bothEndsOnBoundary = table['boundaryBothEnds'][wave][:, np.newaxis]
+                        x = np.where(bothEndsOnBoundary,
+                            np.where(start, otherx - thisx, thisx - otherx),
+                            # as interpolateLagrangeHermiteDerivative() at start, interpolateHermiteLagrangeDerivative() at end
+                            np.where(start, thisx*-2.0 + otherx*2.0 + otherd*-1.0, otherx*-2.0 + otherd*-1.0 + thisx*2.0))
+                        x = x/scaleFactors[:, np.newaxis]
+                    else:
+                        x = parameters[boundaryParameters]
+                    mags = (2.0*arcLengths - self._getMagnitudes(otherd))/np.fabs(scaleFactors)
+                    for b in np.flatnonzero(mags <= 0.0).tolist():
+                        nodeIdentifier, nodeValueLabel, nodeVersion = parameterKeys[boundaryParameters[b]]
+                        print('Derivative smoothing: Node', nodeIdentifier, 'label', nodeValueLabel, 'version', nodeVersion, 'has negative magnitude', mags[b])
+                    parameters[boundaryParameters] = self._setMagnitudes(x, mags)
+            storeStartTime = time.perf_counter()
+            result['iterationTime'] = storeStartTime - iterationStartTime
+            self._storeParameters(fieldcache, parameters,
+                np.concatenate((middleParameters, table['boundaryParameters'])).tolist())
             # record modified nodes while ChangeManager is in effect
             if self._editNodesetGroup:
                 for derivativeKey in self._derivativeMap:
                     self._editNodesetGroup.addNode((self._nodes.findNodeByIdentifier(derivativeKey[0])))
             del fieldcache
+        endTime = time.perf_counter()
+        result['storeTime'] = endTime - storeStartTime
+        result['wallTime'] = endTime - startTime
+        return result
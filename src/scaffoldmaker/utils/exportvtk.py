@@ -1,30 +1,55 @@
 '''
-Class for exporting a Scaffold from Zinc to legacy vtk text format.
+Class for exporting a Scaffold from Zinc to legacy vtk text or binary, or VTK XML unstructured grid format.
 '''
 
+import base64
+from enum import Enum
 import io
+import itertools
 import os
 from sys import version_info
+from xml.sax.saxutils import quoteattr
+import zlib
+import numpy as np
 from opencmiss.utils.zinc.finiteelement import getElementNodeIdentifiersBasisOrder
 from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.result import RESULT_OK
+from scaffoldmaker.utils import interpolation_np
 
 class ExportVtk:
     '''
-    Class for exporting a Scaffold from Zinc to legacy vtk text format.
-    Limited to writing only 3-D hexahedral elements. Assumes all nodes have field defined.
+    Class for exporting a Scaffold from Zinc to legacy vtk text or binary, or VTK XML unstructured grid format.
+    Writes elements of the highest dimension in the model as hexahedra, quadrilaterals or
+    lines, or as wedges, pyramids or triangles where corner nodes are collapsed in binary and
+    VTU formats. Can also write lower dimensional annotation groups to a multiblock file.
+    Assumes all nodes have field defined.
     '''
 
-    def __init__(self, region, description, annotationGroups = None):
+    class Format(Enum):
+        ASCII = 1  # legacy vtk text
+        BINARY = 2  # legacy vtk with big-endian binary data
+        VTU_RAW = 3  # VTK XML unstructured grid with raw appended data
+        VTU_BASE64_ZLIB = 4  # VTK XML unstructured grid with zlib-compressed, base64-encoded inline data
+
+    # uncompressed size of blocks compressed separately in VTU output, as written by VTK
+    _compressionBlockSize = 32768
+
+    def __init__(self, region, description, annotationGroups = None, lagrangeOrder = None):
         '''
         :param region: Region containing finite element model to export.
         :param description: Single line text description up to 256 characters.
         :param annotationGroups: Optional list of AnnotationGroup for model.
+        :param lagrangeOrder: Optional order >= 1 to export elements as VTK Lagrange hexahedra,
+        quadrilaterals or curves with points sampled from the coordinates field at that order
+        in each xi direction, instead of linear cells from the corner nodes. Order 3 exactly
+        reproduces tricubic Hermite elements. Not supported for ASCII format.
         '''
+        assert (lagrangeOrder is None) or (lagrangeOrder >= 1), 'ExportVtk.  Invalid Lagrange order'
+        self._lagrangeOrder = lagrangeOrder
         self._region = region
         self._fieldmodule = self._region.getFieldmodule()
-        for dimension in range(3, 1, -1):
+        for dimension in range(3, 0, -1):
             self._mesh = self._fieldmodule.findMeshByDimension(dimension)
             if self._mesh.getSize() > 0:
                 break
@@ -75,15 +100,10 @@ class ExportVtk:
                 index += 1
             node = nodeIter.next()
 
-        # following assumes all hex (3-D) or all quad (2-D) elements
-        if self._mesh.getDimension() == 2:
-            localNodeCount = 4
-            vtkIndexing = [ 0, 1, 3, 2 ]
-            cellTypeString = '9'
-        else:
-            localNodeCount = 8
-            vtkIndexing = [ 0, 1, 3, 2, 4, 5, 7, 6 ]
-            cellTypeString = '12'
+        # following assumes all hex (3-D), quad (2-D) or line (1-D) elements
+        cellType, vtkIndexing = self._getCellTypeAndIndexing(self._mesh.getDimension())
+        localNodeCount = len(vtkIndexing)
+        cellTypeString = str(cellType)
         localNodeCountStr = str(localNodeCount)
         cellCount = self._mesh.getSize()
         cellListSize = (1 + localNodeCount)*cellCount
@@ -144,6 +164,688 @@ class ExportVtk:
                 outstream.write('\n')
 
 
+    @staticmethod
+    def _getCellTypeAndIndexing(dimension):
+        '''
+        Get VTK cell type and corner nodes in VTK order for uncollapsed line (1-D), quad (2-D)
+        or hex (3-D) elements.
+        :param dimension: Element dimension.
+        :return: VTK cell type number, list of basis node indexes in vtk order.
+        '''
+        if dimension == 1:
+            return 3, [ 0, 1 ]
+        if dimension == 2:
+            return 9, [ 0, 1, 3, 2 ]
+        return 12, [ 0, 1, 3, 2, 4, 5, 7, 6 ]
+
+    @staticmethod
+    def _getCornerRotations(dimension):
+        '''
+        :return: List of permutations of corners of square or cube for each of its rotations,
+        giving the original corner at each rotated corner, with corners varying fastest in xi1.
+        Starts with the identity.
+        '''
+        corners = np.indices((2,)*dimension)[::-1].reshape(dimension, -1).T*2 - 1
+        cornerWeights = 2**np.arange(dimension)
+        rotations = []
+        for axes in itertools.permutations(range(dimension)):
+            for signs in itertools.product((1, -1), repeat=dimension):
+                matrix = np.zeros((dimension, dimension), dtype=np.int64)
+                matrix[range(dimension), axes] = signs
+                if np.linalg.det(matrix) > 0.0:
+                    rotated = (corners @ matrix.T + 1)//2
+                    rotations.append((rotated @ cornerWeights).tolist())
+        return rotations
+
+    # map from (dimension, pattern of equal corners) to VTK cell type and corner indexes in VTK order
+    _cellShapes = {}
+
+    @classmethod
+    def _getCellShape(cls, cornerIdentifiers, dimension):
+        '''
+        Get VTK cell for element from identifiers of its corner nodes or points, converting
+        hexes with two parallel collapsed edges to wedges, hexes with a collapsed face to
+        pyramids, and quads with a collapsed edge to triangles. Assumes elements are
+        right-handed, as for uncollapsed cells. Other collapsed elements are output as
+        degenerate hexes or quads.
+        :param cornerIdentifiers: List of identifiers of 2**dimension element corners, varying fastest in xi1.
+        :param dimension: Element dimension 1, 2 or 3.
+        :return: VTK cell type number, list of corner indexes in vtk order.
+        '''
+        # number each corner by the first corner with the same identifier
+        pattern = tuple(cornerIdentifiers.index(identifier) for identifier in cornerIdentifiers)
+        key = (dimension, pattern)
+        shape = cls._cellShapes.get(key)
+        if shape:
+            return shape
+        shape = cls._getCellTypeAndIndexing(dimension)
+        distinctCount = len(set(pattern))
+        if (dimension > 1) and (distinctCount < len(pattern)):
+            for rotation in cls._getCornerRotations(dimension):
+                c = [ pattern[corner] for corner in rotation ]
+                if dimension == 2:
+                    if (distinctCount == 3) and (c[2] == c[3]):
+                        shape = (5, [ rotation[0], rotation[1], rotation[2] ])
+                        break
+                elif distinctCount == 6:
+                    if (c[2] == c[3]) and (c[6] == c[7]):
+                        # VTK wedge triangle 0, 1, 2 is ordered to point away from 3, 4, 5
+                        shape = (13, [ rotation[corner] for corner in (0, 2, 1, 4, 6, 5) ])
+                        break
+                elif distinctCount == 5:
+                    if c[4] == c[5] == c[6] == c[7]:
+                        shape = (14, [ rotation[corner] for corner in (0, 1, 3, 2, 4) ])
+                        break
+        cls._cellShapes[key] = shape
+        return shape
+
+    @staticmethod
+    def _getElements(mesh):
+        '''
+        Generator of elements of mesh or mesh group.
+        '''
+        elementIter = mesh.createElementiterator()
+        element = elementIter.next()
+        while element.isValid():
+            yield element
+            element = elementIter.next()
+
+    def _getElementsCorners(self, mesh):
+        '''
+        Generator of elements of mesh with identifiers of their corner nodes, varying fastest in xi1.
+        '''
+        cornersCount = 2**mesh.getDimension()
+        for element in self._getElements(mesh):
+            eft = element.getElementfieldtemplate(self._coordinates, -1)  # assumes all components same
+            nodeIdentifiersBasisOrder = getElementNodeIdentifiersBasisOrder(element, eft)
+            yield element, list(nodeIdentifiersBasisOrder[:cornersCount])
+
+    def _getAnnotationGroups(self):
+        '''
+        Use cell data for annotation groups containing elements of mesh dimension,
+        and point data for lower dimensional annotation groups.
+        :return: List of (safeName, MeshGroup) for cell groups, list of (safeName, NodesetGroup) for point groups.
+        '''
+        cellGroups = []
+        pointGroups = []
+        for annotationGroup in self._annotationGroups:
+            safeName = annotationGroup.getName().replace(' ', '_')
+            if annotationGroup.hasMeshGroup(self._mesh):
+                cellGroups.append((safeName, annotationGroup.getMeshGroup(self._mesh)))
+            elif annotationGroup.hasNodesetGroup(self._nodes):
+                pointGroups.append((safeName, annotationGroup.getNodesetGroup(self._nodes)))
+        return cellGroups, pointGroups
+
+    def _getModelArrays(self):
+        '''
+        Gather points, cells and annotation group membership into arrays for bulk output,
+        from Lagrange samples of elements if Lagrange order is set.
+        :return: Dict with keys:
+            points: Float64 array of point coordinates with shape (pointCount, 3).
+            connectivity: Int64 array of point indexes of all cells in vtk order.
+            cellSizes: Array of numbers of points in each cell.
+            cellTypes: Array of VTK cell type numbers of each cell.
+            cellGroups, pointGroups: Lists of (safeName, int32 array with 1 for cells or points in group, else 0).
+        '''
+        if self._lagrangeOrder:
+            return self._getSampledModelArrays(self._mesh, self._lagrangeOrder, lagrangeCells=True, withGroups=True)
+        source = self._getNodesStreamSource(65536)
+        points = []
+        pointGroupFlags = []
+        for chunkPoints, groupFlags in source['pointChunks']:
+            points.append(np.copy(chunkPoints))
+            pointGroupFlags.append(np.copy(groupFlags))
+        connectivity = []
+        cellSizes = []
+        cellTypes = []
+        cellGroupFlags = []
+        for chunkConnectivity, chunkCellSizes, chunkCellTypes, groupFlags in source['cellChunks']:
+            connectivity.append(np.copy(chunkConnectivity))
+            cellSizes.append(np.copy(chunkCellSizes))
+            cellTypes.append(np.copy(chunkCellTypes))
+            cellGroupFlags.append(np.copy(groupFlags))
+        pointGroupFlags = np.concatenate(pointGroupFlags, axis=1) if pointGroupFlags else \
+            np.zeros((len(source['pointGroupNames']), 0), dtype=bool)
+        cellGroupFlags = np.concatenate(cellGroupFlags, axis=1) if cellGroupFlags else \
+            np.zeros((len(source['cellGroupNames']), 0), dtype=bool)
+        return {
+            'points': np.concatenate(points) if points else np.zeros((0, 3)),
+            'connectivity': np.concatenate(connectivity) if connectivity else np.zeros(0, dtype=np.int64),
+            'cellSizes': np.concatenate(cellSizes) if cellSizes else np.zeros(0, dtype=np.int32),
+            'cellTypes': np.concatenate(cellTypes) if cellTypes else np.zeros(0, dtype=np.uint8),
+            'cellGroups': [ (safeName, flags.astype(np.int32)) for safeName, flags in zip(source['cellGroupNames'], cellGroupFlags) ],
+            'pointGroups': [ (safeName, flags.astype(np.int32)) for safeName, flags in zip(source['pointGroupNames'], pointGroupFlags) ]
+        }
+
+    @staticmethod
+    def _getLagrangePointOrder(order, dimension):
+        '''
+        Get order of points in VTK Lagrange curve, quadrilateral or hexahedron: corners, edges,
+        faces then interior. Hexahedron edges are in the order of VTK 9.0, which later versions
+        convert from on reading files with the legacy and XML versions written here.
+        :param order: Lagrange order >= 1, the same in all directions.
+        :param dimension: 1, 2 or 3.
+        :return: Int64 array of indexes of points in grid of (order + 1)**dimension points
+        varying fastest in xi1, in VTK cell order.
+        '''
+        p = order
+        pointsCount1 = p + 1
+        if dimension == 1:
+            return np.array([ 0, p ] + list(range(1, p)), dtype=np.int64)
+        ijk = np.indices((pointsCount1,)*dimension)[::-1].reshape(dimension, -1)
+        i, j = ijk[0], ijk[1]
+        k = ijk[2] if (dimension == 3) else np.zeros_like(i)
+        ibdy = (i == 0) | (i == p)
+        jbdy = (j == 0) | (j == p)
+        kbdy = (k == 0) | (k == p)
+        if dimension == 2:
+            kbdy[:] = True
+        vtkIndexes = np.zeros(i.size, dtype=np.int64)
+        m = p - 1  # number of points inside each edge
+        # corners
+        corner = ibdy & jbdy & kbdy
+        vtkIndexes[corner] = (np.where(i > 0, np.where(j > 0, 2, 1), np.where(j > 0, 3, 0)) + np.where(k > 0, 4, 0))[corner]
+        cornersCount = 8 if (dimension == 3) else 4
+        # edges
+        kEdgeOffset = 4*m if (dimension == 3) else 2*m
+        edge = (ibdy.astype(int) + jbdy.astype(int) + kbdy.astype(int)) == 2
+        onI = edge & ~ibdy
+        vtkIndexes[onI] = (cornersCount + (i - 1) + np.where(j > 0, 2*m, 0) + np.where(k > 0, kEdgeOffset, 0))[onI]
+        onJ = edge & ~jbdy
+        vtkIndexes[onJ] = (cornersCount + (j - 1) + np.where(i > 0, m, 3*m) + np.where(k > 0, kEdgeOffset, 0))[onJ]
+        offset = cornersCount + 2*kEdgeOffset
+        if dimension == 3:
+            onK = edge & ~kbdy
+            vtkIndexes[onK] = (offset + (k - 1) + m*np.where(i > 0, np.where(j > 0, 3, 1), np.where(j > 0, 2, 0)))[onK]
+            offset += 4*m
+            # faces
+            face = (ibdy.astype(int) + jbdy.astype(int) + kbdy.astype(int)) == 1
+            onIFace = face & ibdy
+            vtkIndexes[onIFace] = (offset + (j - 1) + m*(k - 1) + np.where(i > 0, m*m, 0))[onIFace]
+            offset += 2*m*m
+            onJFace = face & jbdy
+            vtkIndexes[onJFace] = (offset + (i - 1) + m*(k - 1) + np.where(j > 0, m*m, 0))[onJFace]
+            offset += 2*m*m
+            onKFace = face & kbdy
+            vtkIndexes[onKFace] = (offset + (i - 1) + m*(j - 1) + np.where(k > 0, m*m, 0))[onKFace]
+            offset += 2*m*m
+            interior = ~(ibdy | jbdy | kbdy)
+            vtkIndexes[interior] = (offset + (i - 1) + m*((j - 1) + m*(k - 1)))[interior]
+        else:
+            interior = ~(ibdy | jbdy)
+            vtkIndexes[interior] = (offset + (i - 1) + m*(j - 1))[interior]
+        return np.argsort(vtkIndexes)
+
+    def _getSampledModelArrays(self, mesh, order, lagrangeCells, withGroups):
+        '''
+        Sample coordinates over elements of mesh at order for VTK Lagrange or linear cells.
+        Each element is evaluated as cubic Hermite in each xi direction from the coordinates
+        and their xi derivatives, including cross derivatives, at its corners, which is exact
+        for all elements up to cubic in each xi direction. Sample points are then evaluated for
+        all elements together. Coincident sample points on element boundaries are merged.
+        Element node identifiers are not needed, so mesh can be a group of faces or lines.
+        :param mesh: Zinc mesh or mesh group to sample.
+        :param order: Number of sample intervals in each xi direction.
+        :param lagrangeCells: True to output Lagrange cells, False to output linear cells when order is 1,
+        converting collapsed elements to wedges, pyramids or triangles.
+        :param withGroups: True to get annotation groups of exported mesh, with point groups containing
+        the corner points of nodes in them. Requires mesh to be the exported mesh.
+        :return: Model arrays as for _getModelArrays().
+        '''
+        dimension = mesh.getDimension()
+        cornersCount = 2**dimension
+        coordinatesCount = self._coordinates.getNumberOfComponents()
+        # xi derivatives only needed within elements
+        derivativesCount = 2**dimension if (order > 1) else 1
+        corners = np.indices((2,)*dimension)[::-1].reshape(dimension, -1).T
+        # weights of each sample point for corner derivatives, varying fastest over derivative then corner
+        xi = np.linspace(0.0, 1.0, order + 1)
+        basis = interpolation_np.getCubicHermiteBasis(xi)
+        samples = np.indices((order + 1,)*dimension)[::-1].reshape(dimension, -1).T
+        weights = np.ones((samples.shape[0], cornersCount, derivativesCount))
+        for c in range(cornersCount):
+            for d in range(derivativesCount):
+                for direction in range(dimension):
+                    weights[:, c, d] *= basis[samples[:, direction], 2*corners[c, direction] + ((d >> direction) & 1)]
+        weights = weights.reshape(samples.shape[0], -1)
+        cornerSampleIndexes = [ np.ravel_multi_index(tuple(corner[::-1]*order), (order + 1,)*dimension) for corner in corners ]
+        elementIdentifiers = []
+        cornerNodeIdentifiers = []
+        cornerParameters = []
+        cache = self._fieldmodule.createFieldcache()
+        with ChangeManager(self._fieldmodule):
+            derivativeFields = [ self._coordinates ]
+            for d in range(1, derivativesCount):
+                field = self._coordinates
+                for direction in range(dimension):
+                    if (d >> direction) & 1:
+                        field = self._fieldmodule.createFieldDerivative(field, direction + 1)
+                derivativeFields.append(field)
+            cornerField = self._fieldmodule.createFieldConcatenate(derivativeFields) if (derivativesCount > 1) else self._coordinates
+            componentsCount = derivativesCount*coordinatesCount
+            if withGroups:
+                elementsCorners = self._getElementsCorners(mesh)
+            else:
+                elementsCorners = ((element, None) for element in self._getElements(mesh))
+            for element, elementCornerNodeIdentifiers in elementsCorners:
+                if withGroups:
+                    cornerNodeIdentifiers.append(elementCornerNodeIdentifiers)
+                elementIdentifiers.append(element.getIdentifier())
+                for corner in corners:
+                    cache.setMeshLocation(element, corner.tolist())
+                    result, parameters = cornerField.evaluateReal(cache, componentsCount)
+                    if result != RESULT_OK:
+                        print("Coordinates not found for element", element.getIdentifier())
+                        parameters = [ 0.0 ]*componentsCount
+                    cornerParameters.append(parameters)
+            del cornerField
+            del derivativeFields
+        elementsCount = len(elementIdentifiers)
+        parameters = np.zeros((elementsCount, cornersCount*derivativesCount, 3))
+        if elementsCount:
+            parameters[:, :, :min(coordinatesCount, 3)] = \
+                np.array(cornerParameters, dtype=np.float64).reshape(elementsCount, -1, coordinatesCount)[:, :, :3]
+        points = np.einsum('sp,epc->esc', weights, parameters).reshape(-1, 3)
+        # merge points closer than tolerance relative to model size, keeping first occurrence order
+        tolerance = 1.0E-8*max(np.max(np.ptp(points, axis=0)) if points.size else 0.0, 1.0E-300)
+        keys = np.round(points/tolerance)
+        uniqueKeys, firstIndexes, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        firstOrder = np.argsort(firstIndexes)
+        newIndexes = np.empty(firstOrder.size, dtype=np.int64)
+        newIndexes[firstOrder] = np.arange(firstOrder.size)
+        pointIndexes = newIndexes[inverse.reshape(-1)].reshape(elementsCount, -1)
+        points = points[firstIndexes[firstOrder]]
+        if lagrangeCells:
+            connectivity = pointIndexes[:, self._getLagrangePointOrder(order, dimension)].reshape(-1)
+            cellSizes = np.full(elementsCount, pointIndexes.shape[1], dtype=np.int64)
+            cellTypes = np.full(elementsCount, (68, 70, 72)[dimension - 1], dtype=np.uint8)
+        else:
+            assert order == 1, 'ExportVtk.  Linear cells require order 1'
+            connectivity = []
+            cellSizes = np.zeros(elementsCount, dtype=np.int64)
+            cellTypes = np.zeros(elementsCount, dtype=np.uint8)
+            for e, cellPointIndexes in enumerate(pointIndexes.tolist()):
+                cellType, cornerIndexes = self._getCellShape(cellPointIndexes, dimension)
+                connectivity += [ cellPointIndexes[corner] for corner in cornerIndexes ]
+                cellSizes[e] = len(cornerIndexes)
+                cellTypes[e] = cellType
+            connectivity = np.array(connectivity, dtype=np.int64)
+        cellGroups = []
+        pointGroups = []
+        if withGroups:
+            cornerPointIndexes = pointIndexes[:, cornerSampleIndexes]
+            cornerNodeIdentifiers = np.array(cornerNodeIdentifiers, dtype=np.int64).reshape(elementsCount, cornersCount)
+            elementIdentifiers = np.array(elementIdentifiers, dtype=np.int64)
+            for safeName, meshGroup in self._getAnnotationGroups()[0]:
+                identifiers = self._getGroupIdentifiers(meshGroup.createElementiterator())
+                cellGroups.append((safeName, np.isin(elementIdentifiers, identifiers).astype(np.int32)))
+            for safeName, nodesetGroup in self._getAnnotationGroups()[1]:
+                identifiers = self._getGroupIdentifiers(nodesetGroup.createNodeiterator())
+                values = np.zeros(points.shape[0], dtype=np.int32)
+                values[cornerPointIndexes[np.isin(cornerNodeIdentifiers, identifiers)]] = 1
+                pointGroups.append((safeName, values))
+        return {
+            'points': points,
+            'connectivity': connectivity,
+            'cellSizes': cellSizes,
+            'cellTypes': cellTypes,
+            'cellGroups': cellGroups,
+            'pointGroups': pointGroups
+        }
+
+    @staticmethod
+    def _getGroupIdentifiers(iterator):
+        '''
+        :param iterator: Zinc element or node iterator.
+        :return: Int64 array of identifiers of objects from iterator.
+        '''
+        identifiers = []
+        item = iterator.next()
+        while item.isValid():
+            identifiers.append(item.getIdentifier())
+            item = iterator.next()
+        return np.array(identifiers, dtype=np.int64)
+
+    @classmethod
+    def _encodeBase64Zlib(cls, data):
+        '''
+        Compress data in blocks with zlib and base64 encode with header, as read by vtkZLibDataCompressor.
+        :param data: Bytes to encode.
+        :return: Encoded bytes.
+        '''
+        blockSize = cls._compressionBlockSize
+        blocks = [ zlib.compress(data[start:start + blockSize]) for start in range(0, len(data), blockSize) ]
+        lastBlockSize = len(data) % blockSize
+        header = np.array([ len(blocks), blockSize, lastBlockSize ] + [ len(block) for block in blocks ], dtype='<u8')
+        return base64.b64encode(header.tobytes()) + base64.b64encode(b''.join(blocks))
+
+    def _getVtuLines(self, pointCount, cellCount, pointGroupNames, cellGroupNames, contents, compressed):
+        '''
+        Get lines of VTK XML unstructured grid file up to the end of the UnstructuredGrid element.
+        Data arrays are in order points, connectivity, offsets, types, point groups then cell groups.
+        :param pointGroupNames, cellGroupNames: Names of point and cell annotation group data arrays.
+        :param contents: List of encoded data text if compressed, otherwise offset into appended data, for each data array.
+        :param compressed: True if data is zlib-compressed and base64-encoded inline, False if raw appended.
+        :return: List of lines.
+        '''
+        # data array type, name, number of components in order of contents
+        dataArrays = [ ('Float64', None, 3), ('Int64', 'connectivity', 1), ('Int64', 'offsets', 1), ('UInt8', 'types', 1) ] + \
+            [ ('Int32', name, 1) for name in (pointGroupNames + cellGroupNames) ]
+        lines = []
+
+        def addDataArray(index, indent):
+            typeName, name, numberOfComponents = dataArrays[index]
+            attributes = 'type="' + typeName + '"'
+            if name:
+                attributes += ' Name=' + quoteattr(name)
+            if numberOfComponents > 1:
+                attributes += ' NumberOfComponents="' + str(numberOfComponents) + '"'
+            if compressed:
+                lines.append(indent + '<DataArray ' + attributes + ' format="binary">')
+                lines.append(indent + '  ' + contents[index])
+                lines.append(indent + '</DataArray>')
+            else:
+                lines.append(indent + '<DataArray ' + attributes + ' format="appended" offset="' + str(contents[index]) + '"/>')
+
+        lines.append('<?xml version="1.0"?>')
+        # description in comment, with double hyphens which are invalid in XML comments removed
+        lines.append('<!-- ' + self._description.replace('--', '- -') + ' -->')
+        lines.append('<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64"' +
+                     (' compressor="vtkZLibDataCompressor"' if compressed else '') + '>')
+        lines.append('  <UnstructuredGrid>')
+        lines.append('    <Piece NumberOfPoints="' + str(pointCount) + '" NumberOfCells="' + str(cellCount) + '">')
+        pointGroupsCount = len(pointGroupNames)
+        for section, indexes in (('PointData', range(4, 4 + pointGroupsCount)),
+                                 ('CellData', range(4 + pointGroupsCount, len(dataArrays)))):
+            if indexes:
+                lines.append('      <' + section + '>')
+                for index in indexes:
+                    addDataArray(index, '        ')
+                lines.append('      </' + section + '>')
+        lines.append('      <Points>')
+        addDataArray(0, '        ')
+        lines.append('      </Points>')
+        lines.append('      <Cells>')
+        for index in range(1, 4):
+            addDataArray(index, '        ')
+        lines.append('      </Cells>')
+        lines.append('    </Piece>')
+        lines.append('  </UnstructuredGrid>')
+        return lines
+
+    def _writeVtuCompressed(self, outstream, arrays):
+        '''
+        Write VTK XML unstructured grid format with zlib-compressed, base64-encoded inline data.
+        :param outstream: Binary output stream.
+        :param arrays: Model arrays from _getModelArrays().
+        '''
+        data = [
+            arrays['points'].astype('<f8'),
+            arrays['connectivity'].astype('<i8'),
+            np.cumsum(arrays['cellSizes'], dtype='<i8'),
+            arrays['cellTypes'].astype('u1') ] + \
+            [ values.astype('<i4') for safeName, values in (arrays['pointGroups'] + arrays['cellGroups']) ]
+        contents = [ self._encodeBase64Zlib(values.tobytes()).decode() for values in data ]
+        lines = self._getVtuLines(arrays['points'].shape[0], arrays['cellTypes'].shape[0],
+            [ safeName for safeName, values in arrays['pointGroups'] ],
+            [ safeName for safeName, values in arrays['cellGroups'] ], contents, compressed=True)
+        lines.append('</VTKFile>\n')
+        outstream.write('\n'.join(lines).encode())
+
+    @staticmethod
+    def _writeChunks(outstream, count, chunkSize, getChunk):
+        '''
+        Write array of count items in chunks of at most chunkSize items.
+        :param getChunk: Function getChunk(start, end) returning array of items in range start:end.
+        '''
+        for start in range(0, count, chunkSize):
+            outstream.write(getChunk(start, min(start + chunkSize, count)).tobytes())
+
+    def _getNodesStreamSource(self, chunkSize):
+        '''
+        Get source of points from nodes and cells from element corner nodes, evaluated on demand
+        in a single sweep over nodes, after a single sweep over elements getting their corner
+        nodes, VTK cell shapes which may be collapsed, and group membership. Memory used is not
+        fixed but proportional to the numbers of nodes and elements: 8 bytes per node identifier,
+        and per element 4 bytes per corner node identifier, 4 bytes for shape and 1 byte per
+        cell group. Point coordinates are not held.
+        :param chunkSize: Maximum number of points or cells in each chunk.
+        :return: Dict with keys:
+            pointCount, cellCount, connectivitySize: Numbers of points, cells and point indexes in cells.
+            pointGroupNames, cellGroupNames: Names of point and cell annotation groups.
+            pointChunks: Iterator over (points with shape (n, 3), bool array of membership of points in each
+            point group with shape (pointGroupsCount, n)), valid until next chunk.
+            cellChunks: Iterator over (point indexes of cells in vtk order, numbers of points in each cell,
+            VTK cell types, bool array of membership of cells in each cell group with shape
+            (cellGroupsCount, n)), valid until next chunk. Must be iterated after pointChunks.
+        '''
+        dimension = self._mesh.getDimension()
+        pointCount = self._nodes.getSize()
+        if self._markerNodes:
+            pointCount -= self._markerNodes.getSize()
+        cellGroups, pointGroups = self._getAnnotationGroups()
+        nodeIdentifiers = np.zeros(pointCount, dtype=np.int64)
+        cellCount = self._mesh.getSize()
+        cornersCount = 2**dimension
+        # Zinc identifiers are 32-bit
+        cellCornerIdentifiers = np.zeros((cellCount, cornersCount), dtype=np.int32)
+        # distinct (VTK cell type, corner indexes) and index of shape of each cell
+        shapes = []
+        shapeIndexesMap = {}
+        cellShapeIndexes = np.zeros(cellCount, dtype=np.int32)
+        cellGroupFlags = np.zeros((len(cellGroups), cellCount), dtype=bool)
+        for e, (element, cornerIdentifiers) in enumerate(self._getElementsCorners(self._mesh)):
+            cellCornerIdentifiers[e] = cornerIdentifiers
+            shape = self._getCellShape(cornerIdentifiers, dimension)
+            shapeKey = (shape[0], tuple(shape[1]))
+            shapeIndex = shapeIndexesMap.get(shapeKey)
+            if shapeIndex is None:
+                shapeIndex = shapeIndexesMap[shapeKey] = len(shapes)
+                shapes.append(shape)
+            cellShapeIndexes[e] = shapeIndex
+            for g, (safeName, meshGroup) in enumerate(cellGroups):
+                cellGroupFlags[g, e] = meshGroup.containsElement(element)
+        shapeCellTypes = np.array([ cellType for cellType, cornerIndexes in shapes ], dtype=np.uint8)
+        shapeCellSizes = np.array([ len(cornerIndexes) for cellType, cornerIndexes in shapes ], dtype=np.int32)
+        # corner indexes of each shape padded with -1
+        shapeCornerIndexes = np.full((len(shapes), cornersCount), -1, dtype=np.int64)
+        for shapeIndex, (cellType, cornerIndexes) in enumerate(shapes):
+            shapeCornerIndexes[shapeIndex, :len(cornerIndexes)] = cornerIndexes
+        connectivitySize = int(np.sum(shapeCellSizes[cellShapeIndexes], dtype=np.int64))
+
+        def getPointChunks():
+            coordinatesCount = self._coordinates.getNumberOfComponents()
+            cache = self._fieldmodule.createFieldcache()
+            points = np.zeros((chunkSize, 3))
+            groupFlags = np.zeros((len(pointGroups), chunkSize), dtype=bool)
+            index = 0
+            chunkIndex = 0
+            # exclude marker nodes from output
+            nodeIter = self._nodes.createNodeiterator()
+            node = nodeIter.next()
+            while node.isValid():
+                if not (self._markerNodes and self._markerNodes.containsNode(node)):
+                    nodeIdentifiers[index] = node.getIdentifier()
+                    cache.setNode(node)
+                    result, x = self._coordinates.evaluateReal(cache, coordinatesCount)
+                    if result != RESULT_OK:
+                        print("Coordinates not found for node", node.getIdentifier())
+                        x = [ 0.0 ]*coordinatesCount
+                    points[chunkIndex, :min(coordinatesCount, 3)] = x[:3]
+                    for g, (safeName, nodesetGroup) in enumerate(pointGroups):
+                        groupFlags[g, chunkIndex] = nodesetGroup.containsNode(node)
+                    index += 1
+                    chunkIndex += 1
+                    if chunkIndex == chunkSize:
+                        yield points, groupFlags
+                        chunkIndex = 0
+                node = nodeIter.next()
+            if chunkIndex > 0:
+                yield points[:chunkIndex], groupFlags[:, :chunkIndex]
+
+        def getCellChunks():
+            # node iterator normally returns nodes in order of identifier
+            nodeOrder = None if np.all(nodeIdentifiers[1:] > nodeIdentifiers[:-1]) else np.argsort(nodeIdentifiers)
+            for start in range(0, cellCount, chunkSize):
+                end = min(start + chunkSize, cellCount)
+                chunkShapeIndexes = cellShapeIndexes[start:end]
+                cornerIndexes = shapeCornerIndexes[chunkShapeIndexes]
+                used = cornerIndexes >= 0
+                # boolean indexing gathers used corners of each cell in turn
+                cellNodeIdentifiers = np.take_along_axis(
+                    cellCornerIdentifiers[start:end], np.where(used, cornerIndexes, 0), axis=1)[used]
+                cellIndexes = np.searchsorted(nodeIdentifiers, cellNodeIdentifiers, sorter=nodeOrder)
+                if nodeOrder is not None:
+                    cellIndexes = nodeOrder[cellIndexes]
+                yield cellIndexes, shapeCellSizes[chunkShapeIndexes], shapeCellTypes[chunkShapeIndexes], \
+                    cellGroupFlags[:, start:end]
+
+        return {
+            'pointCount': pointCount,
+            'cellCount': cellCount,
+            'connectivitySize': connectivitySize,
+            'pointGroupNames': [ safeName for safeName, nodesetGroup in pointGroups ],
+            'cellGroupNames': [ safeName for safeName, meshGroup in cellGroups ],
+            'pointChunks': getPointChunks(),
+            'cellChunks': getCellChunks()
+        }
+
+    @staticmethod
+    def _getArraysStreamSource(arrays, chunkSize):
+        '''
+        Get source of points and cells in chunks from model arrays.
+        :param arrays: Model arrays as returned by _getModelArrays().
+        :param chunkSize: Maximum number of points or cells in each chunk.
+        :return: Dict as for _getNodesStreamSource().
+        '''
+        points = arrays['points']
+        connectivity = arrays['connectivity']
+        cellSizes = arrays['cellSizes']
+        cellTypes = arrays['cellTypes']
+        cellCount = cellTypes.shape[0]
+        cellOffsets = np.zeros(cellCount + 1, dtype=np.int64)
+        np.cumsum(cellSizes, out=cellOffsets[1:])
+        pointGroupFlags = np.array([ values for safeName, values in arrays['pointGroups'] ], dtype=bool).reshape(-1, points.shape[0])
+        cellGroupFlags = np.array([ values for safeName, values in arrays['cellGroups'] ], dtype=bool).reshape(-1, cellCount)
+        return {
+            'pointCount': points.shape[0],
+            'cellCount': cellCount,
+            'connectivitySize': connectivity.shape[0],
+            'pointGroupNames': [ safeName for safeName, values in arrays['pointGroups'] ],
+            'cellGroupNames': [ safeName for safeName, values in arrays['cellGroups'] ],
+            'pointChunks': ((points[start:start + chunkSize], pointGroupFlags[:, start:start + chunkSize])
+                            for start in range(0, points.shape[0], chunkSize)),
+            'cellChunks': ((connectivity[cellOffsets[start]:cellOffsets[min(start + chunkSize, cellCount)]],
+                            cellSizes[start:start + chunkSize], cellTypes[start:start + chunkSize],
+                            cellGroupFlags[:, start:start + chunkSize])
+                           for start in range(0, cellCount, chunkSize))
+        }
+
+    def _writeStream(self, outstream, fileFormat, source, chunkSize):
+        '''
+        Write legacy vtk binary or VTU raw appended format, writing point coordinates and
+        cell connectivity in chunks from source as they are evaluated. Membership of all
+        annotation groups is recorded from the same chunks as bits per point or cell, and cell
+        types and sizes per cell, adding 5 bytes per cell to the memory used by the source.
+        Only point coordinates and connectivity are not held for the whole model.
+        :param outstream: Binary output stream.
+        :param fileFormat: ExportVtk.Format.BINARY or VTU_RAW.
+        :param source: Source of points and cells in chunks from _getNodesStreamSource() or
+        _getArraysStreamSource() with the same chunkSize.
+        :param chunkSize: Maximum number of points or cells in each write, a multiple of 8.
+        '''
+        legacy = fileFormat == self.Format.BINARY
+        pointCount = source['pointCount']
+        cellCount = source['cellCount']
+        connectivitySize = source['connectivitySize']
+        pointGroupNames = source['pointGroupNames']
+        cellGroupNames = source['cellGroupNames']
+        pointGroupBits = np.zeros((len(pointGroupNames), (pointCount + 7)//8), dtype=np.uint8)
+        cellGroupBits = np.zeros((len(cellGroupNames), (cellCount + 7)//8), dtype=np.uint8)
+        cellSizes = np.zeros(cellCount, dtype=np.int32)
+        cellTypes = np.zeros(cellCount, dtype=np.uint8)
+        if legacy:
+            outstream.write(('# vtk DataFile Version 2.0\n' + self._description + '\n' + 'BINARY\n' +
+                             'DATASET UNSTRUCTURED_GRID\n' + 'POINTS ' + str(pointCount) + ' double\n').encode())
+        else:
+            sizes = [ 24*pointCount, 8*connectivitySize, 8*cellCount, cellCount ] + \
+                [ 4*pointCount ]*len(pointGroupNames) + [ 4*cellCount ]*len(cellGroupNames)
+            contents = np.cumsum([ 0 ] + [ (8 + size) for size in sizes[:-1] ]).tolist()
+            lines = self._getVtuLines(pointCount, cellCount, pointGroupNames, cellGroupNames, contents, compressed=False)
+            lines.append('  <AppendedData encoding="raw">')
+            outstream.write(('\n'.join(lines) + '\n    _').encode())
+            outstream.write(np.array([ sizes[0] ], dtype='<u8').tobytes())
+
+        index = 0
+        for points, groupFlags in source['pointChunks']:
+            outstream.write(points.astype('>f8' if legacy else '<f8').tobytes())
+            pointGroupBits[:, index//8:(index + points.shape[0] + 7)//8] = np.packbits(groupFlags, axis=1)
+            index += points.shape[0]
+        assert index == pointCount, 'ExportVtk.write:  Invalid number of points'
+
+        if legacy:
+            outstream.write(('\nCELLS ' + str(cellCount) + ' ' + str(cellCount + connectivitySize) + '\n').encode())
+        else:
+            outstream.write(np.array([ sizes[1] ], dtype='<u8').tobytes())
+        index = 0
+        for cellIndexes, chunkCellSizes, chunkCellTypes, groupFlags in source['cellChunks']:
+            count = chunkCellSizes.shape[0]
+            if legacy:
+                # each cell is preceded by its number of points
+                cells = np.empty(count + cellIndexes.shape[0], dtype='>i4')
+                sizePositions = np.arange(count) + np.cumsum(chunkCellSizes, dtype=np.int64) - chunkCellSizes
+                isIndex = np.ones(cells.shape[0], dtype=bool)
+                isIndex[sizePositions] = False
+                cells[sizePositions] = chunkCellSizes
+                cells[isIndex] = cellIndexes
+                outstream.write(cells.tobytes())
+            else:
+                outstream.write(cellIndexes.astype('<i8').tobytes())
+            cellSizes[index:index + count] = chunkCellSizes
+            cellTypes[index:index + count] = chunkCellTypes
+            cellGroupBits[:, index//8:(index + count + 7)//8] = np.packbits(groupFlags, axis=1)
+            index += count
+        assert index == cellCount, 'ExportVtk.write:  Invalid number of cells'
+
+        def getGroupChunkFunction(bits, dtype):
+            return lambda start, end: np.unpackbits(bits[start//8:(end + 7)//8], count=end - start).astype(dtype)
+
+        if legacy:
+            outstream.write(('\nCELL_TYPES ' + str(cellCount) + '\n').encode())
+            self._writeChunks(outstream, cellCount, chunkSize, lambda start, end: cellTypes[start:end].astype('>i4'))
+            outstream.write(b'\n')
+            for dataType, count, groupNames, groupBits in (('CELL_DATA ', cellCount, cellGroupNames, cellGroupBits),
+                                                           ('POINT_DATA ', pointCount, pointGroupNames, pointGroupBits)):
+                if groupNames:
+                    outstream.write((dataType + str(count) + '\n').encode())
+                    for safeName, bits in zip(groupNames, groupBits):
+                        outstream.write(('SCALARS ' + safeName + ' int 1\nLOOKUP_TABLE default\n').encode())
+                        self._writeChunks(outstream, count, chunkSize, getGroupChunkFunction(bits, '>i4'))
+                        outstream.write(b'\n')
+        else:
+            outstream.write(np.array([ sizes[2] ], dtype='<u8').tobytes())
+            offset = 0
+            for start in range(0, cellCount, chunkSize):
+                offsets = offset + np.cumsum(cellSizes[start:start + chunkSize], dtype='<i8')
+                outstream.write(offsets.tobytes())
+                offset = offsets[-1]
+            outstream.write(np.array([ sizes[3] ], dtype='<u8').tobytes())
+            outstream.write(cellTypes.tobytes())
+            for count, groupBits in ((pointCount, pointGroupBits), (cellCount, cellGroupBits)):
+                for bits in groupBits:
+                    outstream.write(np.array([ 4*count ], dtype='<u8').tobytes())
+                    self._writeChunks(outstream, count, chunkSize, getGroupChunkFunction(bits, '<i4'))
+            outstream.write(b'\n  </AppendedData>\n</VTKFile>\n')
+
+    def _writeArrays(self, outstream, arrays, fileFormat, chunkSize):
+        '''
+        Write model arrays in binary or VTU format.
+        '''
+        if fileFormat == self.Format.VTU_BASE64_ZLIB:
+            self._writeVtuCompressed(outstream, arrays)
+        else:
+            self._writeStream(outstream, fileFormat, self._getArraysStreamSource(arrays, chunkSize), chunkSize)
+
     def _writeMarkers(self, outstream):
         coordinatesCount = self._coordinates.getNumberOfComponents()
         cache = self._fieldmodule.createFieldcache()
@@ -164,13 +866,105 @@ class ExportVtk:
                 del markerCoordinates
 
 
-    def writeFile(self, filename):
+    def write(self, outstream, fileFormat=Format.ASCII, chunkSize=65536):
         '''
-        Export to legacy vtk file/
+        Export model to stream, excluding markers. Without Lagrange order, BINARY and VTU_RAW
+        formats are written in one pass over elements getting their cells, then one pass
+        over nodes streaming point coordinates. Memory used is not fixed but grows with the
+        numbers of nodes and elements, by about 8 bytes per node and 4*(2**dimension) + 9
+        bytes per element, which is far less than holding coordinates and connectivity
+        as other formats do.
+        :param outstream: Text stream for ASCII format, otherwise binary stream.
+        :param fileFormat: ExportVtk.Format to write.
+        :param chunkSize: Number of points or cells in each write when streaming.
         '''
-        with open(filename, 'w') as outstream:
+        if fileFormat == self.Format.ASCII:
+            assert not self._lagrangeOrder, 'ExportVtk.write:  Lagrange cells not supported for ASCII format'
             self._write(outstream)
+            return
+        if version_info.major > 2:
+            assert isinstance(outstream, (io.BufferedIOBase, io.RawIOBase)), 'ExportVtk.write:  Invalid outstream argument'
+        # chunks start on whole bytes of group bits
+        chunkSize = max(8, 8*((chunkSize + 7)//8))
+        if (fileFormat == self.Format.VTU_BASE64_ZLIB) or self._lagrangeOrder:
+            self._writeArrays(outstream, self._getModelArrays(), fileFormat, chunkSize)
+        else:
+            self._writeStream(outstream, fileFormat, self._getNodesStreamSource(chunkSize), chunkSize)
+
+    def _writeMarkersFile(self, filename):
+        '''
+        Write markers to csv file with _marker appended to filename without extension, if any.
+        '''
         if self._markerNodes and (self._markerNodes.getSize() > 0):
             markerFilename = os.path.splitext(filename)[0] + "_marker.csv"
             with open(markerFilename, 'w') as outstream:
                 self._writeMarkers(outstream)
+
+    def writeFile(self, filename, fileFormat=Format.ASCII):
+        '''
+        Export to legacy vtk or VTK XML unstructured grid file. Markers are written to a
+        separate csv file with _marker appended to the file name without extension.
+        :param filename: Name of file to write; use extension .vtk for legacy and .vtu for VTU formats.
+        :param fileFormat: ExportVtk.Format to write.
+        '''
+        with open(filename, 'w' if (fileFormat == self.Format.ASCII) else 'wb') as outstream:
+            self.write(outstream, fileFormat)
+        self._writeMarkersFile(filename)
+
+    def writeMultiBlockFile(self, filename, fileFormat=Format.VTU_RAW, chunkSize=65536):
+        '''
+        Export to VTK XML multiblock file referencing a VTU file for the mesh of highest
+        dimension, then VTU files for each annotation group whose highest dimension is lower,
+        e.g. face groups, in a block for each lower dimension. Points of group blocks are
+        sampled from their elements, as for Lagrange cells if Lagrange order is set.
+        VTU files are written in a directory with the name of the multiblock file without
+        extension. Markers are written to a separate csv file as for writeFile().
+        :param filename: Name of multiblock file to write, with extension .vtm.
+        :param fileFormat: ExportVtk.Format.VTU_RAW or VTU_BASE64_ZLIB.
+        :param chunkSize: Number of points or cells in each write when streaming.
+        '''
+        assert fileFormat in (self.Format.VTU_RAW, self.Format.VTU_BASE64_ZLIB), \
+            'ExportVtk.writeMultiBlockFile:  Invalid format'
+        baseName = os.path.splitext(filename)[0]
+        directoryName = os.path.basename(baseName)
+        os.makedirs(baseName, exist_ok=True)
+        blockFileNames = []
+
+        def writeBlockFile(arrays=None):
+            blockFileName = directoryName + '_' + str(len(blockFileNames)) + '.vtu'
+            with open(os.path.join(baseName, blockFileName), 'wb') as outstream:
+                if arrays is None:
+                    self.write(outstream, fileFormat, chunkSize)
+                else:
+                    self._writeArrays(outstream, arrays, fileFormat, max(8, 8*((chunkSize + 7)//8)))
+            blockFileNames.append(blockFileName)
+            return quoteattr(directoryName + '/' + blockFileName)
+
+        lines = []
+        lines.append('<?xml version="1.0"?>')
+        lines.append('<!-- ' + self._description.replace('--', '- -') + ' -->')
+        lines.append('<VTKFile type="vtkMultiBlockDataSet" version="1.0" byte_order="LittleEndian" header_type="UInt64">')
+        lines.append('  <vtkMultiBlockDataSet>')
+        meshDimension = self._mesh.getDimension()
+        lines.append('    <DataSet index="0" name=' + quoteattr('mesh' + str(meshDimension) + 'd') +
+                     ' file=' + writeBlockFile() + '/>')
+        blockIndex = 1
+        for dimension in range(meshDimension - 1, 0, -1):
+            mesh = self._fieldmodule.findMeshByDimension(dimension)
+            blockAnnotationGroups = [ annotationGroup for annotationGroup in self._annotationGroups
+                                      if (annotationGroup.getDimension() == dimension) and annotationGroup.hasMeshGroup(mesh) ]
+            if not blockAnnotationGroups:
+                continue
+            lines.append('    <Block index="' + str(blockIndex) + '" name=' + quoteattr('groups' + str(dimension) + 'd') + '>')
+            for dataSetIndex, annotationGroup in enumerate(blockAnnotationGroups):
+                arrays = self._getSampledModelArrays(annotationGroup.getMeshGroup(mesh), self._lagrangeOrder or 1,
+                    lagrangeCells=bool(self._lagrangeOrder), withGroups=False)
+                lines.append('      <DataSet index="' + str(dataSetIndex) + '" name=' +
+                             quoteattr(annotationGroup.getName()) + ' file=' + writeBlockFile(arrays) + '/>')
+            lines.append('    </Block>')
+            blockIndex += 1
+        lines.append('  </vtkMultiBlockDataSet>')
+        lines.append('</VTKFile>\n')
+        with open(filename, 'w') as outstream:
+            outstream.write('\n'.join(lines))
+        self._writeMarkersFile(filename)
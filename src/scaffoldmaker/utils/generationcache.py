@@ -0,0 +1,170 @@
+'''
+Cache of intermediate results of Scaffold_base.generateMesh() stages, so that
+regenerating after changing only some options re-runs only the stages they affect.
+'''
+import hashlib
+import json
+from opencmiss.zinc.context import Context
+from opencmiss.zinc.field import FieldGroup
+from scaffoldmaker.annotation.annotationgroup import AnnotationGroup
+
+
+def _encodeOption(obj):
+    '''
+    JSON default function encoding ScaffoldPackage and bytes option values.
+    '''
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    toDict = getattr(obj, 'toDict', None)
+    if toDict:
+        return toDict()
+    raise TypeError('GenerationCache cannot encode option value of type ' + type(obj).__name__)
+
+
+def writeRegionToBytes(region):
+    '''
+    :return: Zinc model file for region contents as bytes.
+    '''
+    sir = region.createStreaminformationRegion()
+    srm = sir.createStreamresourceMemory()
+    region.write(sir)
+    result, buffer = srm.getBuffer()
+    if isinstance(buffer, str):
+        buffer = bytes(buffer, 'utf-8')
+    return buffer
+
+
+def readRegionFromBytes(region, buffer, terms, addSubelements=False):
+    '''
+    Read Zinc model file bytes into region and make annotation groups for terms.
+    :param terms: List of annotation group terms.
+    :param addSubelements: Set to True if groups have had subelements added.
+    :return: List of AnnotationGroup.
+    '''
+    sir = region.createStreaminformationRegion()
+    sir.createStreamresourceMemoryBuffer(buffer)
+    region.read(sir)
+    annotationGroups = []
+    for term in terms:
+        annotationGroup = AnnotationGroup(region, term)
+        if addSubelements:
+            annotationGroup.getGroup().setSubelementHandlingMode(FieldGroup.SUBELEMENT_HANDLING_MODE_FULL)
+        annotationGroups.append(annotationGroup)
+    return annotationGroups
+
+
+class GenerationCache:
+    '''
+    Holds the results of the last call to Scaffold_base.generateMesh() using it for each
+    generation stage: the base mesh region and annotation groups, the refined model, and the
+    final model after faces, subelements and face annotations are defined. Each stage is
+    keyed by a hash of the scaffold type and the options it depends on, as given by
+    Scaffold_base.getOptionGenerationStage(), plus the key of the stage before it.
+    Pass to Scaffold_base.generateMesh() or enable with ScaffoldPackage.setGenerationCacheEnabled().
+    '''
+
+    def __init__(self):
+        # private context owning base mesh region, which is kept for refinement
+        self._context = Context('GenerationCache')
+        self._baseKey = None
+        self._baseRegion = None
+        self._baseAnnotationGroups = None
+        self._baseModel = None
+        self._refineKey = None
+        self._refineModel = None
+        self._refineTerms = None
+        self._finalKey = None
+        self._finalModel = None
+        self._finalTerms = None
+        self._stageRunCounts = { 'base': 0, 'refine': 0, 'final': 0 }
+
+    @staticmethod
+    def getStageKey(scaffoldType, options, stages, previousKey=None):
+        '''
+        :param scaffoldType: Scaffold type class derived from Scaffold_base.
+        :param options: Dict containing options.
+        :param stages: Stage names whose options are included in the key, or None for all options.
+        :param previousKey: Key of previous stage the stage depends on, or None.
+        :return: Hash of options used by stages.
+        '''
+        stageOptions = { name: value for name, value in options.items()
+                         if (stages is None) or (scaffoldType.getOptionGenerationStage(name) in stages) }
+        jsonString = json.dumps([ scaffoldType.getName(), previousKey, stageOptions ], default=_encodeOption, sort_keys=True)
+        return hashlib.sha256(jsonString.encode('utf-8')).hexdigest()
+
+    def getStageRunCounts(self):
+        '''
+        :return: Dict stage name -> number of times stage was run rather than reused.
+        '''
+        return dict(self._stageRunCounts)
+
+    def clear(self):
+        '''
+        Discard all cached stages.
+        '''
+        self._baseKey = self._refineKey = self._finalKey = None
+        self._baseRegion = self._baseAnnotationGroups = self._baseModel = None
+        self._refineModel = self._refineTerms = None
+        self._finalModel = self._finalTerms = None
+
+    def getFinal(self, key, region):
+        '''
+        If final model for key is cached, read it into region.
+        :return: List of AnnotationGroup, or None if not cached.
+        '''
+        if key != self._finalKey:
+            return None
+        return readRegionFromBytes(region, self._finalModel, self._finalTerms, addSubelements=True)
+
+    def setFinal(self, key, region, annotationGroups):
+        self._finalKey = key
+        self._finalModel = writeRegionToBytes(region)
+        self._finalTerms = [ annotationGroup.getTerm() for annotationGroup in annotationGroups ]
+        self._stageRunCounts['final'] += 1
+
+    def getBase(self, key):
+        '''
+        :return: Cached base region and list of AnnotationGroup for key, or None, None.
+        '''
+        if key != self._baseKey:
+            return None, None
+        return self._baseRegion, self._baseAnnotationGroups
+
+    def createBaseRegion(self, key):
+        '''
+        Discard the cached base mesh and all later stages and create new empty base region for key.
+        Caller must generate the base mesh in it and call setBaseAnnotationGroups().
+        :return: Zinc region.
+        '''
+        self.clear()
+        self._baseKey = key
+        self._baseRegion = self._context.createRegion()
+        return self._baseRegion
+
+    def setBaseAnnotationGroups(self, annotationGroups):
+        self._baseAnnotationGroups = annotationGroups
+        self._stageRunCounts['base'] += 1
+
+    def readBase(self, region):
+        '''
+        Read copy of cached base mesh into region.
+        :return: List of AnnotationGroup for region.
+        '''
+        if self._baseModel is None:
+            self._baseModel = writeRegionToBytes(self._baseRegion)
+        return readRegionFromBytes(region, self._baseModel, [ annotationGroup.getTerm() for annotationGroup in self._baseAnnotationGroups ])
+
+    def getRefine(self, key, region):
+        '''
+        If refined model for key is cached, read it into region.
+        :return: List of AnnotationGroup, or None if not cached.
+        '''
+        if key != self._refineKey:
+            return None
+        return readRegionFromBytes(region, self._refineModel, self._refineTerms)
+
+    def setRefine(self, key, region, annotationGroups):
+        self._refineKey = key
+        self._refineModel = writeRegionToBytes(region)
+        self._refineTerms = [ annotationGroup.getTerm() for annotationGroup in annotationGroups ]
+        self._stageRunCounts['refine'] += 1
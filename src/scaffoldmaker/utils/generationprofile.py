@@ -0,0 +1,152 @@
+'''
+Profiling of scaffold generation stages: wall and CPU time, model sizes and memory.
+'''
+import contextlib
+import json
+import time
+import tracemalloc
+from opencmiss.zinc.field import Field
+
+
+class GenerationProfile:
+    '''
+    Records statistics for each stage of scaffold generation, in order of completion.
+    Pass to Scaffold_base.generateMesh() or ScaffoldPackage.generate() as profile.
+    Stages may be nested, e.g. generateBaseMesh within generateMesh; each record
+    gives its depth of nesting.
+    '''
+
+    def __init__(self, traceMemory=False, logFile=None):
+        '''
+        :param traceMemory: Set to True to record peak Python memory allocated in each stage
+        with tracemalloc. Note this slows generation and does not see memory allocated by Zinc.
+        :param logFile: Optional file name or text stream to append each stage record to as a
+        JSON object on a single line, when the stage completes.
+        '''
+        self._traceMemory = traceMemory
+        self._logFile = logFile
+        self._records = []
+        self._depth = 0
+        # peak traced memory so far in each enclosing stage, as tracemalloc has one peak
+        self._memoryPeaks = []
+
+    @contextlib.contextmanager
+    def stage(self, name, region=None):
+        '''
+        Context manager recording statistics for the enclosed stage.
+        :param name: Name of stage, e.g. 'generateBaseMesh'.
+        :param region: Optional Zinc region to count nodes and elements in at end of stage.
+        '''
+        startedTracing = False
+        if self._traceMemory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                startedTracing = True
+            if self._memoryPeaks:
+                self._memoryPeaks[-1] = max(self._memoryPeaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            startMemory = tracemalloc.get_traced_memory()[0]
+            self._memoryPeaks.append(startMemory)
+        self._depth += 1
+        startWallTime = time.perf_counter()
+        startCpuTime = time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'depth': self._depth - 1,
+                'wallTime': time.perf_counter() - startWallTime,
+                'cpuTime': time.process_time() - startCpuTime
+            }
+            self._depth -= 1
+            if self._traceMemory:
+                memoryPeak = max(self._memoryPeaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['memoryPeak'] = memoryPeak - startMemory
+                if self._memoryPeaks:
+                    self._memoryPeaks[-1] = max(self._memoryPeaks[-1], memoryPeak)
+                tracemalloc.reset_peak()
+                if startedTracing:
+                    tracemalloc.stop()
+            if region:
+                record.update(getRegionSizes(region))
+            self._records.append(record)
+            if self._logFile:
+                self._writeLog(record)
+
+    def _writeLog(self, record):
+        line = json.dumps(record) + '\n'
+        if isinstance(self._logFile, str):
+            with open(self._logFile, 'a') as f:
+                f.write(line)
+        else:
+            self._logFile.write(line)
+
+    def getRecords(self):
+        '''
+        :return: List of dicts for each stage in order of completion, with keys:
+            stage: Stage name.
+            depth: Depth of nesting of stage, starting at 0.
+            wallTime, cpuTime: Elapsed wall and process CPU time in seconds.
+            memoryPeak: If tracing memory, peak Python memory allocated above that at start, in bytes.
+            nodes, elements1d, elements2d, elements3d: If region supplied, sizes at end of stage.
+        '''
+        return self._records
+
+    def getStageRecord(self, name):
+        '''
+        :return: Record for last completed stage with name, or None if none.
+        '''
+        for record in reversed(self._records):
+            if record['stage'] == name:
+                return record
+        return None
+
+    def clear(self):
+        self._records = []
+
+    def __str__(self):
+        '''
+        :return: Report of stages in order of starting, indented by depth.
+        '''
+        lines = [ '{:40} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'wall (s)', 'cpu (s)', 'nodes', 'elements') ]
+        for record in self._getRecordsInStartOrder():
+            # report elements of highest dimension
+            elementsCount = ''
+            for dimension in range(1, 4):
+                elementsCount = record.get('elements' + str(dimension) + 'd', 0) or elementsCount
+            lines.append('{:40} {:10.3f} {:10.3f} {:>10} {:>10}'.format('  '*record['depth'] + record['stage'],
+                record['wallTime'], record['cpuTime'], record.get('nodes', ''), elementsCount))
+        return '\n'.join(lines)
+
+    def _getRecordsInStartOrder(self):
+        # list of (record, list of record and descendants) not yet claimed by a parent stage
+        pending = []
+        for record in self._records:
+            # preceding unclaimed records deeper than this one are its children
+            descendants = []
+            while pending and (pending[-1][0]['depth'] > record['depth']):
+                descendants = pending.pop()[1] + descendants
+            pending.append((record, [ record ] + descendants))
+        return [ record for subtreeRecords in pending for record in subtreeRecords[1] ]
+
+
+def getRegionSizes(region):
+    '''
+    :return: Dict of numbers of nodes and elements of each dimension in region.
+    '''
+    fieldmodule = region.getFieldmodule()
+    sizes = { 'nodes': fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES).getSize() }
+    for dimension in range(1, 4):
+        sizes['elements' + str(dimension) + 'd'] = fieldmodule.findMeshByDimension(dimension).getSize()
+    return sizes
+
+
+def profileStage(profile, name, region=None):
+    '''
+    :param profile: GenerationProfile or None if not profiling.
+    :return: Context manager recording stage if profiling, otherwise doing nothing.
+    '''
+    if profile:
+        return profile.stage(name, region)
+    return contextlib.nullcontext()
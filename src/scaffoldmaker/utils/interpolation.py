@@ -23,6 +23,44 @@ gaussWt4 = (
     (18.0+math.sqrt(30.0))/72.0,
     (18.0-math.sqrt(30.0))/72.0 )
 
+# Gauss-Kronrod 7-15 point abscissae and weights on [-1, 1], for the positive half
+gaussKronrodXi15 = (
+    0.991455371120812639206854697526329, 0.949107912342758524526189684047851,
+    0.864864423359769072789712788640926, 0.741531185599394439863864773280788,
+    0.586087235467691130294144845693013, 0.405845151377397166906606412076961,
+    0.207784955007898467600689403773245, 0.0 )
+gaussKronrodWt15 = (
+    0.022935322010529224963732008058970, 0.063092092629978553290700663189204,
+    0.104790010322250183839876322541518, 0.140653259715525918745189590510238,
+    0.169004726639267902826583426598550, 0.190350578064785409913256402421014,
+    0.204432940075298892414161999234649, 0.209482141084727828012999174891714 )
+# weights of embedded 7 point Gauss rule at odd indexes of Kronrod abscissae
+gaussKronrodGaussWt7 = (
+    0.129484966168869693270611432679082, 0.279705391489276667901467771423780,
+    0.381830050505118944950369775488975, 0.417959183673469387755102040816327 )
+
+# relative tolerance for arc lengths, or None to use fixed 4 point Gaussian quadrature
+_arcLengthTolerance = None
+
+def setArcLengthTolerance(tolerance):
+    """
+    Set accuracy of arc lengths of cubic Hermite curves, for all functions in this module
+    calculating them. With a tolerance, lengths are integrated by adaptive Gauss-Kronrod
+    quadrature to this relative error, and iterative scaling of derivatives to arc length
+    converges to it. Larger tolerances are faster.
+    :param tolerance: Relative tolerance e.g. 1.0E-6, or None for the default, which uses
+    fixed 4 point Gaussian quadrature and converges derivative scaling to 1.0E-6.
+    """
+    global _arcLengthTolerance
+    assert (tolerance is None) or (tolerance > 0.0), 'setArcLengthTolerance.  Invalid tolerance'
+    _arcLengthTolerance = tolerance
+
+def getArcLengthTolerance():
+    """
+    :return: Relative tolerance for arc lengths, or None if using fixed 4 point Gaussian quadrature.
+    """
+    return _arcLengthTolerance
+
 def getCubicHermiteBasis(xi):
     """
     :return: 4 basis functions for x1, d1, x2, d2
@@ -106,7 +144,7 @@ def computeCubicHermiteArcLength(v1, d1, v2, d2, rescaleDerivatives):
         lastArcLength = getCubicHermiteArcLength(v1, d1, v2, d2)
     d1 = vector.normalise(d1)
     d2 = vector.normalise(d2)
-    tol = 1.0E-6
+    tol = _arcLengthTolerance if _arcLengthTolerance else 1.0E-6
     for iters in range(100):
         #print('iter',iters,'=',lastArcLength)
         d1s = [lastArcLength*d for d in d1]
@@ -128,10 +166,11 @@ def computeCubicHermiteDerivativeScaling(v1, d1, v2, d2):
     '''
     origMag = 0.5*(vector.magnitude(d1) + vector.magnitude(d2))
     scaling = 1.0
+    tol = _arcLengthTolerance if _arcLengthTolerance else 0.000001
     for iters in range(100):
         mag = origMag*scaling
         arcLength = getCubicHermiteArcLength(v1, [ d*scaling for d in d1 ], v2, [ d*scaling for d in d2 ])
-        if math.fabs(arcLength - mag) < 0.000001*arcLength:
+        if math.fabs(arcLength - mag) < tol*arcLength:
             #print('compute scaling', v1, d1, v2, d2, '\n  --> scaling',scaling)
             return scaling
         scaling *= arcLength/mag
@@ -141,14 +180,78 @@ def computeCubicHermiteDerivativeScaling(v1, d1, v2, d2):
 def getCubicHermiteArcLength(v1, d1, v2, d2):
     '''
     Note this is approximate.
-    :return: Arc length of cubic curve using 4 point Gaussian quadrature.
+    :return: Arc length of cubic curve using 4 point Gaussian quadrature, or adaptive
+    quadrature if an arc length tolerance is set. See setArcLengthTolerance().
     '''
+    if _arcLengthTolerance:
+        return getCubicHermiteArcLengthAdaptive(v1, d1, v2, d2, _arcLengthTolerance)
     arcLength = 0.0
     for i in range(4):
         dm = interpolateCubicHermiteDerivative(v1, d1, v2, d2, gaussXi4[i])
         arcLength += gaussWt4[i]*math.sqrt(sum(d*d for d in dm))
     return arcLength
 
+def _getCubicHermiteArcLengthGaussKronrod(v1, d1, v2, d2, xiStart, xiEnd):
+    '''
+    :return: Arc length of cubic curve from xiStart to xiEnd by 15 point Gauss-Kronrod
+    quadrature, and its difference from the embedded 7 point Gauss quadrature.
+    '''
+    xiCentre = 0.5*(xiStart + xiEnd)
+    xiHalfRange = 0.5*(xiEnd - xiStart)
+    kronrod = 0.0
+    gauss = 0.0
+    for i in range(8):
+        for xi in ((xiCentre - xiHalfRange*gaussKronrodXi15[i]), (xiCentre + xiHalfRange*gaussKronrodXi15[i])) if (i < 7) else (xiCentre, ):
+            dm = interpolateCubicHermiteDerivative(v1, d1, v2, d2, xi)
+            speed = math.sqrt(sum(d*d for d in dm))
+            kronrod += gaussKronrodWt15[i]*speed
+            if i % 2:
+                gauss += gaussKronrodGaussWt7[i//2]*speed
+    return xiHalfRange*kronrod, xiHalfRange*math.fabs(kronrod - gauss)
+
+def getCubicHermiteArcLengthAdaptive(v1, d1, v2, d2, tolerance):
+    '''
+    Get arc length of cubic curve to a relative tolerance, subdividing the curve only where
+    15 point Gauss-Kronrod quadrature is not accurate enough. Near-straight curves without
+    reversal, whose length is their chord length to within tolerance, are not integrated.
+    :param tolerance: Relative tolerance for arc length.
+    :return: Arc length.
+    '''
+    chord = [ (v2[c] - v1[c]) for c in range(len(v1)) ]
+    chordLength = vector.magnitude(chord)
+    if chordLength > 0.0:
+        # derivatives deviating from chord direction by angle under sqrt(tolerance) change length by under tolerance
+        chordDirection = [ c/chordLength for c in chord ]
+        du1 = vector.dotproduct(d1, chordDirection)
+        du2 = vector.dotproduct(d2, chordDirection)
+        if (du1 >= 0.0) and (du2 >= 0.0):
+            squareSine1 = vector.dotproduct(d1, d1) - du1*du1
+            squareSine2 = vector.dotproduct(d2, d2) - du2*du2
+            if (squareSine1 <= tolerance*du1*du1) and (squareSine2 <= tolerance*du2*du2):
+                # straight if derivative along chord does not reverse at its extremum
+                a = 3.0*(du1 + du2) - 6.0*chordLength
+                b = 6.0*chordLength - 4.0*du1 - 2.0*du2
+                xiExtremum = -b/(2.0*a) if (a != 0.0) else -1.0
+                if not ((0.0 < xiExtremum < 1.0) and ((a*xiExtremum + b)*xiExtremum + du1 < 0.0)):
+                    return chordLength
+    arcLength, error = _getCubicHermiteArcLengthGaussKronrod(v1, d1, v2, d2, 0.0, 1.0)
+    absoluteTolerance = tolerance*arcLength
+    if error <= absoluteTolerance:
+        return arcLength
+    # subdivide intervals with error above their share of tolerance, to a limited depth
+    arcLength = 0.0
+    intervals = [ (0.0, 0.5, 1), (0.5, 1.0, 1) ]
+    while intervals:
+        xiStart, xiEnd, depth = intervals.pop()
+        intervalArcLength, error = _getCubicHermiteArcLengthGaussKronrod(v1, d1, v2, d2, xiStart, xiEnd)
+        if (error <= absoluteTolerance*(xiEnd - xiStart)) or (depth >= 20):
+            arcLength += intervalArcLength
+        else:
+            xiCentre = 0.5*(xiStart + xiEnd)
+            intervals.append((xiStart, xiCentre, depth + 1))
+            intervals.append((xiCentre, xiEnd, depth + 1))
+    return arcLength
+
 def getCubicHermiteArcLengthToXi(v1, d1, v2, d2, xi):
     '''
     Note this is approximate.
@@ -160,6 +263,19 @@ def getCubicHermiteArcLengthToXi(v1, d1, v2, d2, xi):
     d2m = [ d*xi for d in d2m ]
     return getCubicHermiteArcLength(v1, d1m, v2m, d2m)
 
+def getCubicHermiteCurvesElementLengths(nx, nd1):
+    """
+    Get arc lengths of the elements of cubic Hermite curves through consecutive nodes,
+    as given by getCubicHermiteArcLength().
+    :param nx: Coordinates of nodes along curves.
+    :param nd1: Derivatives of nodes along curves.
+    :return: List of element arc lengths.
+    """
+    if _arcLengthTolerance:
+        return [ getCubicHermiteArcLength(nx[e], nd1[e], nx[e + 1], nd1[e + 1]) for e in range(len(nx) - 1) ]
+    from scaffoldmaker.utils import interpolation_np  # imported here as it imports this module
+    return interpolation_np.getCubicHermiteCurvesElementLengths(nx, nd1).tolist()
+
 def getCubicHermiteCurvesLength(cx, sd1):
     """
     Calculate total length of a curve
@@ -167,13 +283,8 @@ def getCubicHermiteCurvesLength(cx, sd1):
     :param sd1: d1 derivatives.
     :return:
     """
-    totalLength = 0.0
-    elementsCountIn = len(cx) - 1
-    for e in range(elementsCountIn):
-        arcLength = getCubicHermiteArcLength(cx[e], sd1[e], cx[e + 1], sd1[e + 1])
-        totalLength += arcLength
-
-    return totalLength
+    # sum in order for same result as adding element lengths one at a time
+    return sum(getCubicHermiteCurvesElementLengths(cx, sd1), 0.0)
 
 def getCubicHermiteCurvature(v1, d1, v2, d2, radialVector, xi):
     """
@@ -296,7 +407,7 @@ def projectHermiteCurvesThroughWall(nx, nd1, nd2, n, wallThickness, loop = False
 def sampleCubicHermiteCurves(nx, nd1, elementsCountOut,
     addLengthStart = 0.0, addLengthEnd = 0.0,
     lengthFractionStart = 1.0, lengthFractionEnd = 1.0,
-    elementLengthStartEndRatio = 1.0, arcLengthDerivatives = False):
+    elementLengthStartEndRatio = 1.0, arcLengthDerivatives = False, arcLengthTable = False):
     """
     Get systematically spaced points and derivatives over cubic Hermite interpolated
     curves with nodes nx and derivatives nd1. The first element uses the first two nodes.
@@ -312,6 +423,10 @@ def sampleCubicHermiteCurves(nx, nd1, elementsCountOut,
         to lengthFractionStart, lengthFractionEnd.
     :param arcLengthDerivatives: If True each cubic section is rescaled to arc length.
     If False (default), derivatives and distances are used as supplied.
+    :param arcLengthTable: If True, and not arcLengthDerivatives, get element lengths and
+    locate all sample points at once with a CubicHermiteArcLengthTable. This is faster and
+    more accurate than the default, but gives slightly different points. Ignored if an arc
+    length tolerance is set, as the table uses fixed Gaussian quadrature. See setArcLengthTolerance().
     :return: px[], pd1[], pe[], pxi[], psf[], where pe[] and pxi[] are lists of element indices and
     and xi locations in the 'in' elements to pass to partner interpolateSample functions. psf[] is
     a list of scale factors for converting derivatives from old to new xi coordinates: dxi(old)/dxi(new).
@@ -319,17 +434,25 @@ def sampleCubicHermiteCurves(nx, nd1, elementsCountOut,
     elementsCountIn = len(nx) - 1
     assert (elementsCountIn > 0) and (len(nd1) == (elementsCountIn + 1)) and \
         (elementsCountOut > 0), 'sampleCubicHermiteCurves.  Invalid arguments'
+    arcLengthTable = arcLengthTable and not _arcLengthTolerance
     lengths = [ 0.0 ]
     nd1a = []
     nd1b = []
     length = 0.0
-    for e in range(elementsCountIn):
-        if arcLengthDerivatives:
+    if arcLengthDerivatives:
+        arcLengths = []
+        for e in range(elementsCountIn):
             arcLength = computeCubicHermiteArcLength(nx[e], nd1[e], nx[e + 1], nd1[e + 1], rescaleDerivatives = True)
             nd1a.append(vector.setMagnitude(nd1[e], arcLength))
             nd1b.append(vector.setMagnitude(nd1[e + 1], arcLength))
-        else:
-            arcLength = getCubicHermiteArcLength(nx[e], nd1[e], nx[e + 1], nd1[e + 1])
+            arcLengths.append(arcLength)
+    elif arcLengthTable:
+        from scaffoldmaker.utils import interpolation_np  # imported here as it imports this module
+        table = interpolation_np.CubicHermiteArcLengthTable(nx, nd1)
+        arcLengths = table.getElementLengths().tolist()
+    else:
+        arcLengths = getCubicHermiteCurvesElementLengths(nx, nd1)
+    for arcLength in arcLengths:
         length += arcLength
         lengths.append(length)
     proportionEnd = 2.0/(elementLengthStartEndRatio + 1)
@@ -371,27 +494,35 @@ def sampleCubicHermiteCurves(nx, nd1, elementsCountOut,
     pe = []
     pxi = []
     psf = []
+    # get output element index, element index and distance in element for each sample point
+    samples = []
     distance = 0.0
     e = 0
     for eOut in range(elementsCountOut):
         while e < elementsCountIn:
             if distance < lengths[e + 1]:
-                partDistance = distance - lengths[e]
-                if arcLengthDerivatives:
-                    xi = partDistance/(lengths[e + 1] - lengths[e])
-                    x = interpolateCubicHermite(nx[e], nd1a[e], nx[e + 1], nd1b[e], xi)
-                    d1 = interpolateCubicHermiteDerivative(nx[e], nd1a[e], nx[e + 1], nd1b[e], xi)
-                else:
-                    x, d1, _eIn, xi = getCubicHermiteCurvesPointAtArcDistance(nx[e:e + 2], nd1[e:e + 2], partDistance)
-                sf = nodeDerivativeMagnitudes[eOut]/vector.magnitude(d1)
-                px.append(x)
-                pd1.append([ sf*d for d in d1 ])
-                pe.append(e)
-                pxi.append(xi)
-                psf.append(sf)
+                samples.append((eOut, e, distance - lengths[e]))
                 break
             e += 1
         distance += elementLengths[eOut]
+    if arcLengthTable and samples and not arcLengthDerivatives:
+        tx, td1, _, txi = table.evaluate([ sample[2] for sample in samples ], [ sample[1] for sample in samples ])
+        tx, td1, txi = tx.tolist(), td1.tolist(), txi.tolist()
+    for s, (eOut, e, partDistance) in enumerate(samples):
+        if arcLengthDerivatives:
+            xi = partDistance/(lengths[e + 1] - lengths[e])
+            x = interpolateCubicHermite(nx[e], nd1a[e], nx[e + 1], nd1b[e], xi)
+            d1 = interpolateCubicHermiteDerivative(nx[e], nd1a[e], nx[e + 1], nd1b[e], xi)
+        elif arcLengthTable:
+            x, d1, xi = tx[s], td1[s], txi[s]
+        else:
+            x, d1, _eIn, xi = getCubicHermiteCurvesPointAtArcDistance(nx[e:e + 2], nd1[e:e + 2], partDistance)
+        sf = nodeDerivativeMagnitudes[eOut]/vector.magnitude(d1)
+        px.append(x)
+        pd1.append([ sf*d for d in d1 ])
+        pe.append(e)
+        pxi.append(xi)
+        psf.append(sf)
     e = elementsCountIn
     eOut = elementsCountOut
     xi = 1.0
@@ -405,7 +536,7 @@ def sampleCubicHermiteCurves(nx, nd1, elementsCountOut,
     return px, pd1, pe, pxi, psf
 
 def sampleCubicHermiteCurvesSmooth(nx, nd1, elementsCountOut,
-       derivativeMagnitudeStart=None, derivativeMagnitudeEnd=None):
+       derivativeMagnitudeStart=None, derivativeMagnitudeEnd=None, arcLengthTable=False):
     """
     Get smoothly spaced points and derivatives over cubic Hermite interpolated
     curves with nodes nx and derivatives nd1. The first element uses the first two nodes.
@@ -416,6 +547,8 @@ def sampleCubicHermiteCurvesSmooth(nx, nd1, elementsCountOut,
     :param derivativeMagnitudeStart, derivativeMagnitudeEnd: Optional magnitudes of start and end
     derivatives appropriate for elementsCountOut. If unspecified these are calculated from the other
     end or set to be equal for even spaced elements.
+    :param arcLengthTable: If True, get element lengths and locate all sample points at once
+    with a CubicHermiteArcLengthTable, unless an arc length tolerance is set. See sampleCubicHermiteCurves().
     :return: px[], pd1[], pe[], pxi[], psf[], where pe[] and pxi[] are lists of element indices and
     and xi locations in the 'in' elements to pass to partner interpolateSample functions. psf[] is
     a list of scale factors for converting derivatives from old to new xi coordinates: dxi(old)/dxi(new).
@@ -423,10 +556,17 @@ def sampleCubicHermiteCurvesSmooth(nx, nd1, elementsCountOut,
     elementsCountIn = len(nx) - 1
     assert (elementsCountIn > 0) and (len(nd1) == (elementsCountIn + 1)) and (elementsCountOut > 0), \
         'sampleCubicHermiteCurvesSmooth.  Invalid arguments'
+    arcLengthTable = arcLengthTable and not _arcLengthTolerance
     lengths = [ 0.0 ]
     length = 0.0
-    for e in range(elementsCountIn):
-        length += getCubicHermiteArcLength(nx[e], nd1[e], nx[e + 1], nd1[e + 1])
+    if arcLengthTable:
+        from scaffoldmaker.utils import interpolation_np  # imported here as it imports this module
+        table = interpolation_np.CubicHermiteArcLengthTable(nx, nd1)
+        arcLengths = table.getElementLengths().tolist()
+    else:
+        arcLengths = getCubicHermiteCurvesElementLengths(nx, nd1)
+    for arcLength in arcLengths:
+        length += arcLength
         lengths.append(length)
     if derivativeMagnitudeStart and derivativeMagnitudeEnd:
         pass
@@ -458,21 +598,30 @@ def sampleCubicHermiteCurvesSmooth(nx, nd1, elementsCountOut,
     pe = []
     pxi = []
     psf = []
+    # get output element index, element index and distance in element for each sample point
+    samples = []
     e = 0
     for eOut in range(elementsCountOut):
         distance = nodeDistances[eOut]
         while e < elementsCountIn:
             if distance < lengths[e + 1]:
-                partDistance = distance - lengths[e]
-                x, d1, _, xi = getCubicHermiteCurvesPointAtArcDistance(nx[e:e + 2], nd1[e:e + 2], partDistance)
-                sf = nodeDerivativeMagnitudes[eOut]/vector.magnitude(d1)
-                px.append(x)
-                pd1.append([ sf*d for d in d1 ])
-                pe.append(e)
-                pxi.append(xi)
-                psf.append(sf)
+                samples.append((eOut, e, distance - lengths[e]))
                 break
             e += 1
+    if arcLengthTable and samples:
+        tx, td1, _, txi = table.evaluate([ sample[2] for sample in samples ], [ sample[1] for sample in samples ])
+        tx, td1, txi = tx.tolist(), td1.tolist(), txi.tolist()
+    for s, (eOut, e, partDistance) in enumerate(samples):
+        if arcLengthTable:
+            x, d1, xi = tx[s], td1[s], txi[s]
+        else:
+            x, d1, _, xi = getCubicHermiteCurvesPointAtArcDistance(nx[e:e + 2], nd1[e:e + 2], partDistance)
+        sf = nodeDerivativeMagnitudes[eOut]/vector.magnitude(d1)
+        px.append(x)
+        pd1.append([ sf*d for d in d1 ])
+        pe.append(e)
+        pxi.append(xi)
+        psf.append(sf)
     e = elementsCountIn
     eOut = elementsCountOut
     xi = 1.0
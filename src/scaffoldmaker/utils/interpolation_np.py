@@ -0,0 +1,524 @@
+'''
+Interpolation functions operating on numpy arrays of many curves and xi at once.
+Batched equivalents of functions in scaffoldmaker.utils.interpolation, evaluated
+with the same floating point operations in the same order so results are identical.
+Curves are given by arrays of start and end values and derivatives with shape
+(N, C) for N curves with C components; a single curve of shape (C,) is N = 1.
+'''
+
+from __future__ import division
+import numpy as np
+from scaffoldmaker.utils import interpolation
+
+
+def _getCurvesArrays(v1, d1, v2, d2):
+    '''
+    :return: v1, d1, v2, d2 as float64 arrays of shape (N, C).
+    '''
+    return tuple(np.atleast_2d(np.asarray(a, dtype=np.float64)) for a in (v1, d1, v2, d2))
+
+
+def _interpolateCubicHermiteBasis(f, v1, d1, v2, d2):
+    '''
+    :param f: Basis function values with shape (M, 4).
+    :return: Interpolated values with shape (N, M, C).
+    '''
+    v1, d1, v2, d2 = _getCurvesArrays(v1, d1, v2, d2)
+    f1, f2, f3, f4 = (f[:, i][np.newaxis, :, np.newaxis] for i in range(4))
+    return f1*v1[:, np.newaxis, :] + f2*d1[:, np.newaxis, :] + f3*v2[:, np.newaxis, :] + f4*d2[:, np.newaxis, :]
+
+
+def getCubicHermiteBasis(xi):
+    '''
+    :param xi: Array-like of M xi values.
+    :return: Basis functions for x1, d1, x2, d2 at xi, with shape (M, 4).
+    '''
+    xi = np.atleast_1d(np.asarray(xi, dtype=np.float64))
+    xi2 = xi*xi
+    xi3 = xi2*xi
+    return np.stack([ 1.0 - 3.0*xi2 + 2.0*xi3, xi - 2.0*xi2 + xi3, 3.0*xi2 - 2.0*xi3, -xi2 + xi3 ], axis=1)
+
+
+def getCubicHermiteBasisDerivatives(xi):
+    '''
+    :param xi: Array-like of M xi values.
+    :return: Derivatives of basis functions for x1, d1, x2, d2 at xi, with shape (M, 4).
+    '''
+    xi = np.atleast_1d(np.asarray(xi, dtype=np.float64))
+    xi2 = xi*xi
+    return np.stack([ -6.0*xi + 6.0*xi2, 1.0 - 4.0*xi + 3.0*xi2, 6.0*xi - 6.0*xi2, -2.0*xi + 3.0*xi2 ], axis=1)
+
+
+def getCubicHermiteBasisSecondDerivatives(xi):
+    '''
+    :param xi: Array-like of M xi values.
+    :return: Second derivatives of basis functions for x1, d1, x2, d2 at xi, with shape (M, 4).
+    '''
+    xi = np.atleast_1d(np.asarray(xi, dtype=np.float64))
+    return np.stack([ -6.0 + 12.0*xi, -4.0 + 6.0*xi, 6.0 - 12.0*xi, -2.0 + 6.0*xi ], axis=1)
+
+
+def interpolateCubicHermite(v1, d1, v2, d2, xi):
+    '''
+    Get values of cubic Hermite curves interpolated from v1, d1 to v2, d2.
+    :param v1, v2: Values at xi = 0.0 and xi = 1.0, with shape (N, C).
+    :param d1, d2: Derivatives w.r.t. xi at xi = 0.0 and xi = 1.0, with shape (N, C).
+    :param xi: Array-like of M positions in curves, nominally in [0.0, 1.0].
+    :return: Interpolated values with shape (N, M, C).
+    '''
+    return _interpolateCubicHermiteBasis(getCubicHermiteBasis(xi), v1, d1, v2, d2)
+
+
+def interpolateCubicHermiteDerivative(v1, d1, v2, d2, xi):
+    '''
+    Get derivatives w.r.t. xi of cubic Hermite curves interpolated from v1, d1 to v2, d2.
+    Arguments as for interpolateCubicHermite().
+    :return: Interpolated derivatives with shape (N, M, C).
+    '''
+    return _interpolateCubicHermiteBasis(getCubicHermiteBasisDerivatives(xi), v1, d1, v2, d2)
+
+
+def interpolateCubicHermiteSecondDerivative(v1, d1, v2, d2, xi):
+    '''
+    Get second derivatives w.r.t. xi of cubic Hermite curves interpolated from v1, d1 to v2, d2.
+    Arguments as for interpolateCubicHermite().
+    :return: Interpolated second derivatives with shape (N, M, C).
+    '''
+    return _interpolateCubicHermiteBasis(getCubicHermiteBasisSecondDerivatives(xi), v1, d1, v2, d2)
+
+
+def getCubicHermiteArcLength(v1, d1, v2, d2):
+    '''
+    Note this is approximate.
+    :param v1, d1, v2, d2: Curve values and derivatives with shape (N, C).
+    :return: Arc lengths of N cubic curves using 4 point Gaussian quadrature, with shape (N,).
+    '''
+    dm = interpolateCubicHermiteDerivative(v1, d1, v2, d2, interpolation.gaussXi4)
+    # sum squares of components in order, as sum() does
+    magnitudeSquared = dm[:, :, 0]*dm[:, :, 0]
+    for c in range(1, dm.shape[2]):
+        magnitudeSquared = magnitudeSquared + dm[:, :, c]*dm[:, :, c]
+    magnitudes = np.sqrt(magnitudeSquared)
+    arcLengths = np.zeros(dm.shape[0])
+    for i in range(4):
+        arcLengths += interpolation.gaussWt4[i]*magnitudes[:, i]
+    return arcLengths
+
+
+def _getCubicHermiteArcLengths(v1, d1, v2, d2):
+    '''
+    Get arc lengths of curves as given by interpolation.getCubicHermiteArcLength() for each:
+    by adaptive quadrature curve by curve if an arc length tolerance is set, otherwise by
+    getCubicHermiteArcLength() for all curves at once.
+    :param v1, d1, v2, d2: Curve values and derivatives with shape (N, C).
+    :return: Arc lengths with shape (N,).
+    '''
+    if interpolation.getArcLengthTolerance():
+        return np.array([ interpolation.getCubicHermiteArcLength(*curve)
+            for curve in zip(v1.tolist(), d1.tolist(), v2.tolist(), d2.tolist()) ], dtype=np.float64)
+    return getCubicHermiteArcLength(v1, d1, v2, d2)
+
+
+def getCubicHermiteArcLengthToXi(v1, d1, v2, d2, xi):
+    '''
+    Note this is approximate.
+    :param v1, d1, v2, d2: Curve values and derivatives with shape (N, C).
+    :param xi: Array-like of M xi values.
+    :return: Arc lengths of N cubic curves up to each xi, with shape (N, M).
+    '''
+    v1, d1, v2, d2 = _getCurvesArrays(v1, d1, v2, d2)
+    xi = np.atleast_1d(np.asarray(xi, dtype=np.float64))
+    curvesCount, componentsCount = v1.shape
+    pointsCount = xi.size
+    xim = xi[np.newaxis, :, np.newaxis]
+    d1m = d1[:, np.newaxis, :]*xim
+    v2m = interpolateCubicHermite(v1, d1, v2, d2, xi)
+    d2m = interpolateCubicHermiteDerivative(v1, d1, v2, d2, xi)*xim
+    v1m = np.broadcast_to(v1[:, np.newaxis, :], v2m.shape)
+    d1m = np.broadcast_to(d1m, v2m.shape)
+    shape = (curvesCount*pointsCount, componentsCount)
+    return getCubicHermiteArcLength(v1m.reshape(shape), d1m.reshape(shape), v2m.reshape(shape),
+        d2m.reshape(shape)).reshape(curvesCount, pointsCount)
+
+
+def getCubicHermiteCurvesElementLengths(nx, nd1):
+    '''
+    Get arc lengths of the elements of cubic Hermite curves through consecutive nodes.
+    Note this is approximate.
+    :param nx: Coordinates of nodes along curves, array-like with shape (E + 1, C).
+    :param nd1: Derivatives of nodes along curves, array-like with shape (E + 1, C).
+    :return: Arc lengths of E elements, with shape (E,).
+    '''
+    nx = np.asarray(nx, dtype=np.float64)
+    nd1 = np.asarray(nd1, dtype=np.float64)
+    return getCubicHermiteArcLength(nx[:-1], nd1[:-1], nx[1:], nd1[1:])
+
+
+class CubicHermiteArcLengthTable:
+    '''
+    Cumulative arc length lookup table for cubic Hermite curves through consecutive nodes,
+    for converting many distances along the curves to element xi at once.
+    Each element is divided into segments of equal xi whose arc lengths are integrated
+    by 4 point Gaussian quadrature. Distances are inverted by monotone cubic interpolation
+    of xi between segment ends, then polished by Newton iterations on the segment arc length.
+    '''
+
+    def __init__(self, nx, nd1, segmentsCount=8):
+        '''
+        :param nx: Coordinates of nodes along curves, array-like with shape (E + 1, C).
+        :param nd1: Derivatives of nodes along curves, array-like with shape (E + 1, C).
+        :param segmentsCount: Number of segments per element.
+        '''
+        nx = np.asarray(nx, dtype=np.float64)
+        nd1 = np.asarray(nd1, dtype=np.float64)
+        elementsCount = nx.shape[0] - 1
+        assert (elementsCount > 0) and (nd1.shape == nx.shape) and (segmentsCount > 0), \
+            'CubicHermiteArcLengthTable.  Invalid arguments'
+        self._v1 = nx[:-1]
+        self._d1 = nd1[:-1]
+        self._v2 = nx[1:]
+        self._d2 = nd1[1:]
+        self._segmentsCount = segmentsCount
+        self._segmentXi = np.linspace(0.0, 1.0, segmentsCount + 1)
+        segmentXiSize = 1.0/segmentsCount
+        # speeds |dx/dxi| at Gauss points of all segments in all elements
+        gaussXi = (self._segmentXi[:-1, np.newaxis] + segmentXiSize*np.array(interpolation.gaussXi4)).reshape(-1)
+        speeds = np.linalg.norm(interpolateCubicHermiteDerivative(self._v1, self._d1, self._v2, self._d2, gaussXi), axis=2)
+        segmentLengths = segmentXiSize*np.dot(speeds.reshape(elementsCount, segmentsCount, 4), interpolation.gaussWt4)
+        # cumulative distance at segment ends from start of each element, and speeds there
+        self._segmentDistances = np.zeros((elementsCount, segmentsCount + 1))
+        np.cumsum(segmentLengths, axis=1, out=self._segmentDistances[:, 1:])
+        self._segmentSpeeds = np.linalg.norm(
+            interpolateCubicHermiteDerivative(self._v1, self._d1, self._v2, self._d2, self._segmentXi), axis=2)
+        self._elementLengths = self._segmentDistances[:, -1].copy()
+        self._elementStartDistances = np.zeros(elementsCount + 1)
+        np.cumsum(self._elementLengths, out=self._elementStartDistances[1:])
+
+    def getElementLengths(self):
+        '''
+        :return: Arc lengths of elements, with shape (E,).
+        '''
+        return self._elementLengths
+
+    def getLength(self):
+        '''
+        :return: Total arc length of curves.
+        '''
+        return self._elementStartDistances[-1]
+
+    def _interpolatePoints(self, f, e):
+        '''
+        :param f: Basis functions at each point, with shape (K, 4).
+        :param e: Element index of each point, with shape (K,).
+        :return: Values interpolated in element e with f, with shape (K, C).
+        '''
+        return f[:, 0:1]*self._v1[e] + f[:, 1:2]*self._d1[e] + f[:, 2:3]*self._v2[e] + f[:, 3:4]*self._d2[e]
+
+    def _getSpeeds(self, e, xi):
+        return np.linalg.norm(self._interpolatePoints(getCubicHermiteBasisDerivatives(xi), e), axis=1)
+
+    def _getDistancesInElement(self, e, s, xi):
+        '''
+        :return: Distances from start of elements e to xi in their segments s.
+        '''
+        xi0 = self._segmentXi[s]
+        dxi = xi - xi0
+        segmentDistances = np.zeros(dxi.shape)
+        for i in range(4):
+            segmentDistances += interpolation.gaussWt4[i]*self._getSpeeds(e, xi0 + dxi*interpolation.gaussXi4[i])
+        return self._segmentDistances[e, s] + dxi*segmentDistances
+
+    def getDistances(self, elementIndexes, xi):
+        '''
+        Get distances along curves to element xi locations.
+        :param elementIndexes: Array-like of K element indexes.
+        :param xi: Array-like of K element xi values in [0.0, 1.0].
+        :return: Distances from start of curves with shape (K,).
+        '''
+        e = np.atleast_1d(np.asarray(elementIndexes, dtype=np.int64))
+        xi = np.atleast_1d(np.asarray(xi, dtype=np.float64))
+        s = np.clip(np.floor(xi*self._segmentsCount).astype(np.int64), 0, self._segmentsCount - 1)
+        return self._elementStartDistances[e] + self._getDistancesInElement(e, s, xi)
+
+    def getElementXi(self, distances, elementIndexes=None):
+        '''
+        Get element indexes and xi at distances along curves.
+        :param distances: Array-like of K distances along curves, or from the start of
+        each element if elementIndexes is supplied. Clamped to the ends of curves or elements.
+        :param elementIndexes: Optional array-like of K element indexes containing each distance.
+        :return: int array of element indexes, float array of xi, each with shape (K,).
+        '''
+        distances = np.atleast_1d(np.asarray(distances, dtype=np.float64))
+        elementsCount, segmentsCount = self._segmentSpeeds.shape[0], self._segmentsCount
+        if elementIndexes is None:
+            e = np.searchsorted(self._elementStartDistances, distances, side='right') - 1
+            e = np.clip(e, 0, elementsCount - 1)
+            distances = distances - self._elementStartDistances[e]
+        else:
+            e = np.asarray(elementIndexes, dtype=np.int64).reshape(distances.shape)
+        distances = np.clip(distances, 0.0, self._elementLengths[e])
+        segmentDistances = self._segmentDistances[e]
+        s = np.clip((segmentDistances <= distances[:, np.newaxis]).sum(axis=1) - 1, 0, segmentsCount - 1)
+        k = np.arange(distances.size)
+        s0 = segmentDistances[k, s]
+        s1 = segmentDistances[k, s + 1]
+        xi0 = self._segmentXi[s]
+        xi1 = self._segmentXi[s + 1]
+        # monotone cubic xi(distance) with slopes dxi/ds = 1/speed limited to 3*secant slope
+        h = s1 - s0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            secant = np.where(h > 0.0, (xi1 - xi0)/h, 0.0)
+            m0 = np.minimum(1.0/self._segmentSpeeds[e, s], 3.0*secant)
+            m1 = np.minimum(1.0/self._segmentSpeeds[e, s + 1], 3.0*secant)
+            t = np.where(h > 0.0, (distances - s0)/h, 0.0)
+        f = getCubicHermiteBasis(t)
+        xi = f[:, 0]*xi0 + f[:, 1]*m0*h + f[:, 2]*xi1 + f[:, 3]*m1*h
+        # Newton iterations on arc length in element
+        for iter in range(3):
+            speeds = self._getSpeeds(e, xi)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                xi = np.where(speeds > 0.0, xi - (self._getDistancesInElement(e, s, xi) - distances)/speeds, xi)
+            xi = np.clip(xi, xi0, xi1)
+        return e, xi
+
+    def evaluate(self, distances, elementIndexes=None):
+        '''
+        Get coordinates and derivatives at distances along curves.
+        Arguments as for getElementXi().
+        :return: Coordinates and derivatives w.r.t. element xi with shape (K, C),
+        element indexes and xi with shape (K,).
+        '''
+        e, xi = self.getElementXi(distances, elementIndexes)
+        x = self._interpolatePoints(getCubicHermiteBasis(xi), e)
+        d1 = self._interpolatePoints(getCubicHermiteBasisDerivatives(xi), e)
+        return x, d1, e, xi
+
+
+def _getMagnitudes(v):
+    '''
+    :param v: Vectors with components in last axis.
+    :return: Magnitudes of vectors, summing squares of components in order as vector.magnitude() does.
+    '''
+    magnitudeSquared = v[..., 0]*v[..., 0]
+    for c in range(1, v.shape[-1]):
+        magnitudeSquared = magnitudeSquared + v[..., c]*v[..., c]
+    return np.sqrt(magnitudeSquared)
+
+
+def _setMagnitudes(v, magnitudes):
+    '''
+    :return: Vectors v scaled to magnitudes, as vector.setMagnitude() does.
+    '''
+    return v*(magnitudes/_getMagnitudes(v))[..., np.newaxis]
+
+
+def smoothCubicHermiteDerivativesLines(nx, nd1, loop=False,
+        fixAllDirections=False,
+        fixStartDerivative=False, fixEndDerivative=False,
+        fixStartDirection=False, fixEndDirection=False,
+        magnitudeScalingMode=None,
+        active=None, accelerationDepth=0, maxIterations=100):
+    '''
+    Modifies derivatives of many independent lines or loops to be smoothly varying and
+    near arc length, as for smoothCubicHermiteDerivativesLine/Loop() for each, but updating
+    all nodes of all lines at once. Each line stops iterating once converged, giving the
+    same result as the single line functions unless accelerated. Element arc lengths are
+    evaluated together by 4 point Gaussian quadrature, or element by element with adaptive
+    quadrature if an arc length tolerance is set with interpolation.setArcLengthTolerance().
+    Arguments not listed are as for smoothCubicHermiteDerivativesLine(), applying to all lines.
+    :param nx: Coordinates of nodes along lines, array-like with shape (L, N, C).
+    :param nd1: Derivatives of nodes along lines, array-like with shape (L, N, C).
+    :param loop: Set to True if lines are loops, with the first node following the last.
+    Start and end fix options are ignored for loops.
+    :param magnitudeScalingMode: A value from enum DerivativeScalingMode, or None for ARITHMETIC_MEAN.
+    :param active: Optional array-like of L bool, False for lines to return unchanged.
+    :param accelerationDepth: If positive, apply Anderson acceleration using this many
+    previous iterations, typically 3-5, to converge in fewer iterations.
+    :param maxIterations: Maximum number of iterations.
+    :return: Smoothed derivatives with shape (L, N, C), numbers of iterations for each line
+    with shape (L,), 0 if inactive.
+    '''
+    nx = np.asarray(nx, dtype=np.float64)
+    nd1 = np.asarray(nd1, dtype=np.float64)
+    assert (nx.ndim == 3) and (nd1.shape == nx.shape), 'smoothCubicHermiteDerivativesLines.  Invalid nx, nd1'
+    linesCount, nodesCount, componentsCount = nx.shape
+    elementsCount = nodesCount if loop else (nodesCount - 1)
+    assert elementsCount > (1 if loop else 0), 'smoothCubicHermiteDerivativesLines.  Too few nodes/elements'
+    arithmeticMeanMagnitude = magnitudeScalingMode in (None, interpolation.DerivativeScalingMode.ARITHMETIC_MEAN)
+    assert arithmeticMeanMagnitude or (magnitudeScalingMode is interpolation.DerivativeScalingMode.HARMONIC_MEAN), \
+        'smoothCubicHermiteDerivativesLines. Invalid magnitude scaling mode'
+    md1 = nd1.copy()
+    iterationsCounts = np.zeros(linesCount, dtype=np.int64)
+    lines = np.arange(linesCount) if (active is None) else np.flatnonzero(np.asarray(active, dtype=bool))
+    if loop:
+        fixStartDerivative = fixEndDerivative = fixStartDirection = fixEndDirection = False
+    elif elementsCount == 1:
+        # special cases for one element
+        if not (fixStartDerivative or fixEndDerivative or fixStartDirection or fixEndDirection or fixAllDirections):
+            # straight line
+            md1[lines, 0] = md1[lines, 1] = nx[lines, 1] - nx[lines, 0]
+            return md1, iterationsCounts
+        if fixAllDirections or (fixStartDirection and fixEndDirection):
+            # fixed directions, equal magnitude
+            for l in lines.tolist():
+                arcLength = interpolation.computeCubicHermiteArcLength(nx[l, 0].tolist(), nd1[l, 0].tolist(),
+                    nx[l, 1].tolist(), nd1[l, 1].tolist(), rescaleDerivatives=True)
+                md1[l] = _setMagnitudes(nd1[l], arcLength)
+            return md1, iterationsCounts
+    tol = 1.0E-6
+    # nodes before and after each node, and elements before and after, for nodes smoothed as middle nodes
+    if loop:
+        middleNodes = np.arange(nodesCount)
+    else:
+        middleNodes = np.arange(1, nodesCount - 1)
+    nm = middleNodes - 1
+    np_ = (middleNodes + 1) % nodesCount
+    em = nm % elementsCount
+    ep = middleNodes
+    nextNodes = (np.arange(elementsCount) + 1) % nodesCount
+    if not fixAllDirections:
+        dirm = nx[:, middleNodes] - nx[:, nm]
+        dirp = nx[:, np_] - nx[:, middleNodes]
+    vectorSize = nodesCount*componentsCount
+    historyF = []
+    historyG = []
+    lastF = lastG = None
+    for iter in range(maxIterations):
+        if lines.size == 0:
+            break
+        lx = nx[lines]
+        u = md1[lines]
+        g = u.copy()
+        arcLengths = _getCubicHermiteArcLengths(lx[:, :elementsCount].reshape(-1, componentsCount),
+            u[:, :elementsCount].reshape(-1, componentsCount), lx[:, nextNodes].reshape(-1, componentsCount),
+            u[:, nextNodes].reshape(-1, componentsCount)).reshape(-1, elementsCount)
+        # start
+        if not (loop or fixStartDerivative):
+            if fixAllDirections or fixStartDirection:
+                mag = 2.0*arcLengths[:, 0] - _getMagnitudes(u[:, 1])
+                g[:, 0] = np.where((mag > 0.0)[:, np.newaxis], _setMagnitudes(nd1[lines, 0], mag), 0.0)
+            else:
+                g[:, 0] = lx[:, 0]*-2.0 + lx[:, 1]*2.0 + u[:, 1]*-1.0
+        # middle
+        if middleNodes.size > 0:
+            arcLengthsm = arcLengths[:, em]
+            arcLengthsp = arcLengths[:, ep]
+            if not fixAllDirections:
+                # mean weighted by fraction towards that end, equivalent to harmonic mean
+                arcLengthmp = arcLengthsm + arcLengthsp
+                wm = (arcLengthsp/arcLengthmp)[:, :, np.newaxis]
+                wp = (arcLengthsm/arcLengthmp)[:, :, np.newaxis]
+                g[:, middleNodes] = wm*dirm[lines] + wp*dirp[lines]
+            if arithmeticMeanMagnitude:
+                mag = 0.5*(arcLengthsm + arcLengthsp)
+            else:
+                mag = 2.0/(1.0/arcLengthsm + 1.0/arcLengthsp)
+            g[:, middleNodes] = _setMagnitudes(g[:, middleNodes], mag)
+        # end
+        if not (loop or fixEndDerivative):
+            if fixAllDirections or fixEndDirection:
+                mag = 2.0*arcLengths[:, -1] - _getMagnitudes(u[:, -2])
+                g[:, -1] = np.where((mag > 0.0)[:, np.newaxis], _setMagnitudes(nd1[lines, -1], mag), 0.0)
+            else:
+                g[:, -1] = lx[:, -2]*-2.0 + u[:, -2]*-1.0 + lx[:, -1]*2.0
+        iterationsCounts[lines] = iter + 1
+        # sum lengths in order as sum() does
+        dtol = tol*np.cumsum(arcLengths, axis=1)[:, -1]/elementsCount
+        f = (g - u).reshape(-1, vectorSize)
+        converged = np.all(np.fabs(f) <= dtol[:, np.newaxis], axis=1)
+        md1[lines] = g
+        if accelerationDepth > 0:
+            g = g.reshape(-1, vectorSize)
+            if lastF is not None:
+                historyF.append(f - lastF)
+                historyG.append(g - lastG)
+                if len(historyF) > accelerationDepth:
+                    del historyF[0]
+                    del historyG[0]
+                # minimise |f - dF.gamma| by least squares, regularised for near-dependent columns
+                dF = np.stack(historyF, axis=1)
+                dG = np.stack(historyG, axis=1)
+                normal = np.einsum('lik,ljk->lij', dF, dF)
+                normal += 1.0E-12*np.trace(normal, axis1=1, axis2=2)[:, np.newaxis, np.newaxis]*np.eye(len(historyF)) + \
+                    1.0E-300*np.eye(len(historyF))
+                gamma = np.linalg.solve(normal, np.einsum('lik,lk->li', dF, f)[:, :, np.newaxis])[:, :, 0]
+                accelerated = g - np.einsum('li,lik->lk', gamma, dG)
+                accept = ~converged & np.all(np.isfinite(accelerated), axis=1)
+                md1[lines[accept]] = accelerated[accept].reshape(-1, nodesCount, componentsCount)
+            keep = ~converged
+            lastF = f[keep]
+            lastG = g[keep]
+            historyF = [ history[keep] for history in historyF ]
+            historyG = [ history[keep] for history in historyG ]
+        lines = lines[~converged]
+    if lines.size > 0:
+        print('smoothCubicHermiteDerivativesLines max iters reached:', maxIterations, 'for', lines.size, 'lines')
+    return md1, iterationsCounts
+
+
+def getPackedOffsets(nodesCounts):
+    '''
+    :param nodesCounts: Numbers of nodes in each of L lines.
+    :return: Offsets of the first node of each line in packed arrays, plus total nodes count,
+    with shape (L + 1,).
+    '''
+    offsets = np.zeros(len(nodesCounts) + 1, dtype=np.int64)
+    np.cumsum(nodesCounts, out=offsets[1:])
+    return offsets
+
+
+def smoothCubicHermiteDerivativesLinesPacked(x, d1, offsets, loop=False,
+        fixAllDirections=False,
+        fixStartDerivative=False, fixEndDerivative=False,
+        fixStartDirection=False, fixEndDirection=False,
+        magnitudeScalingMode=None,
+        accelerationDepth=0, maxIterations=100):
+    '''
+    Modifies derivatives of a ragged collection of lines or loops packed one after another
+    into flat arrays, as for smoothCubicHermiteDerivativesLine/Loop() for each. Lines with
+    the same number of nodes and options are smoothed together with
+    smoothCubicHermiteDerivativesLines(), giving identical results to the single line functions
+    unless accelerated, including with adaptive arc lengths if an arc length tolerance is set.
+    The loop and fix options each take either a single bool applying to all lines, or an
+    array-like of L bools for each line; other arguments are as for smoothCubicHermiteDerivativesLines().
+    :param x: Coordinates of nodes of all lines, array-like with shape (T, C).
+    :param d1: Derivatives of nodes of all lines, array-like with shape (T, C).
+    :param offsets: Index of first node of each line in x, d1 plus final T, with shape (L + 1,).
+    See getPackedOffsets().
+    :return: Smoothed derivatives with shape (T, C), numbers of iterations for each line
+    with shape (L,).
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    d1 = np.asarray(d1, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    assert (x.ndim == 2) and (d1.shape == x.shape), 'smoothCubicHermiteDerivativesLinesPacked.  Invalid x, d1'
+    assert (offsets.ndim == 1) and (offsets.size > 0) and (offsets[0] == 0) and (offsets[-1] == x.shape[0]), \
+        'smoothCubicHermiteDerivativesLinesPacked.  Invalid offsets'
+    linesCount = offsets.size - 1
+    nodesCounts = np.diff(offsets)
+    assert np.all(nodesCounts > 1), 'smoothCubicHermiteDerivativesLinesPacked.  Lines must have at least 2 nodes'
+    flags = np.stack([ np.broadcast_to(np.asarray(flag, dtype=bool), (linesCount,))
+                       for flag in (loop, fixAllDirections, fixStartDerivative, fixEndDerivative,
+                                    fixStartDirection, fixEndDirection) ], axis=1)
+    md1 = d1.copy()
+    iterationsCounts = np.zeros(linesCount, dtype=np.int64)
+    if linesCount == 0:
+        return md1, iterationsCounts
+    # group lines with the same nodes count and options
+    keys = np.concatenate((nodesCounts[:, np.newaxis], flags), axis=1)
+    groupKeys, groupIndexes = np.unique(keys, axis=0, return_inverse=True)
+    groupIndexes = groupIndexes.reshape(-1)
+    for g, groupKey in enumerate(groupKeys.tolist()):
+        lines = np.flatnonzero(groupIndexes == g)
+        nodesCount = groupKey[0]
+        groupLoop, groupFixAllDirections, groupFixStartDerivative, groupFixEndDerivative, \
+            groupFixStartDirection, groupFixEndDirection = [ bool(flag) for flag in groupKey[1:] ]
+        assert (not groupLoop) or (nodesCount > 2), 'smoothCubicHermiteDerivativesLinesPacked.  Loops must have at least 3 nodes'
+        nodeIndexes = offsets[lines][:, np.newaxis] + np.arange(nodesCount)
+        md1[nodeIndexes], iterationsCounts[lines] = smoothCubicHermiteDerivativesLines(
+            x[nodeIndexes], d1[nodeIndexes], loop=groupLoop, fixAllDirections=groupFixAllDirections,
+            fixStartDerivative=groupFixStartDerivative, fixEndDerivative=groupFixEndDerivative,
+            fixStartDirection=groupFixStartDirection, fixEndDirection=groupFixEndDirection,
+            magnitudeScalingMode=magnitudeScalingMode, accelerationDepth=accelerationDepth,
+            maxIterations=maxIterations)
+    return md1, iterationsCounts
@@ -3,6 +3,9 @@ Class for refining a mesh from one region to another.
 '''
 from __future__ import division
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from opencmiss.utils.zinc.field import findOrCreateFieldCoordinates, findOrCreateFieldGroup, findOrCreateFieldNodeGroup, \
     findOrCreateFieldStoredMeshLocation, findOrCreateFieldStoredString
 from opencmiss.zinc.element import Element, Elementbasis
@@ -10,7 +13,9 @@ from opencmiss.zinc.field import Field
 from opencmiss.zinc.node import Node
 from opencmiss.zinc.result import RESULT_OK as ZINC_OK
 from scaffoldmaker.annotation.annotationgroup import AnnotationGroup
+from scaffoldmaker.utils.eftfactory_tricubichermite import eftfactory_tricubichermite
 from scaffoldmaker.utils.octree import Octree
+from scaffoldmaker.utils.tensorbasis import getElementFieldParameters, getTensorBasisMatrix
 
 
 class MeshRefinement:
@@ -18,11 +23,27 @@ class MeshRefinement:
     Class for refining a mesh from one region to another.
     '''
 
-    def __init__(self, sourceRegion, targetRegion, sourceAnnotationGroups = []):
+    # node value labels for tricubic Hermite in basis function order, with derivative orders in each xi
+    _hermiteValueLabels = [ Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2, Node.VALUE_LABEL_D2_DS1DS2,
+        Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3, Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3 ]
+    _hermiteDerivatives = [ [ 0, 0, 0 ], [ 1, 0, 0 ], [ 0, 1, 0 ], [ 1, 1, 0 ], [ 0, 0, 1 ], [ 1, 0, 1 ], [ 0, 1, 1 ], [ 1, 1, 1 ] ]
+
+    def __init__(self, sourceRegion, targetRegion, sourceAnnotationGroups = [], evaluateElementGrids = False,
+            tricubicHermite = False):
         '''
         Assumes targetRegion is empty.
         :param sourceAnnotationGroups: List of AnnotationGroup for source mesh in sourceRegion.
         A copy containing the refined elements is created by the MeshRefinement.
+        :param evaluateElementGrids: Set to True to evaluate all refined points in each source
+        element at once from basis function matrices and element parameters, which is much
+        faster than evaluating each point with Zinc. Elements with unsupported bases or
+        per-component fields fall back to evaluation with Zinc.
+        :param tricubicHermite: Set to True to refine into tricubic Hermite elements with cross
+        derivatives instead of linear Lagrange elements. Node derivatives are evaluated from the
+        source element and rescaled to the sub-element, so the refined mesh exactly reproduces
+        tricubic Hermite source geometry. Where source elements meeting at a node give different
+        derivatives, extra node derivative versions are used. Always evaluates element grids;
+        asserts if source element bases or fields are not supported for this.
         '''
         self._sourceRegion = sourceRegion
         self._sourceFm = sourceRegion.getFieldmodule()
@@ -60,6 +81,16 @@ class MeshRefinement:
         self._nodetemplate.defineField(self._targetCoordinates)
 
         self._targetMesh = self._targetFm.findMeshByDimension(3)
+        self._tricubicHermite = tricubicHermite
+        if tricubicHermite:
+            self._targetEftFactory = eftfactory_tricubichermite(self._targetMesh, True)
+            # map number of versions -> node template
+            self._hermiteNodetemplates = {}
+            self._nodetemplate = self._getHermiteNodetemplate(1)
+            # map tuple of node versions -> (eft, element template)
+            self._hermiteEftElementtemplates = {}
+            # map node identifier -> list of derivative parameters for each version
+            self._nodeVersionDerivatives = {}
         self._targetBasis = self._targetFm.createElementbasis(3, Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE)
         self._targetEft = self._targetMesh.createElementfieldtemplate(self._targetBasis)
         self._targetElementtemplate = self._targetMesh.createElementtemplate()
@@ -68,6 +99,11 @@ class MeshRefinement:
 
         self._nodeIdentifier = 1
         self._elementIdentifier = 1
+        self._evaluateElementGrids = evaluateElementGrids or tricubicHermite
+        # map (function types, numbers in xi) -> basis matrix for refined points
+        self._basisMatrices = {}
+        # map (node identifier, value label, version) -> source coordinates parameters
+        self._sourceNodeParametersMap = {}
         # prepare annotation group map
         self._sourceAnnotationGroups = sourceAnnotationGroups
         self._annotationGroups = []
@@ -117,11 +153,124 @@ class MeshRefinement:
         return self._annotationGroups
 
 
+    def _evaluateElementGrid(self, sourceElement, numberInXi1, numberInXi2, numberInXi3):
+        '''
+        Evaluate source coordinates at all refined points in sourceElement at once.
+        :return: List of coordinates at points with xi1 fastest, or None if element basis
+        or field is not supported. If refining to tricubic Hermite, coordinates at each point
+        are a list of the 8 tricubic Hermite parameters for the sub-element.
+        '''
+        functionTypes, parameters = getElementFieldParameters(sourceElement, self._sourceCoordinates, self._sourceCache,
+            self._sourceNodeParametersMap)
+        if functionTypes is None:
+            return None
+        basisMatrix = self._getElementGridBasisMatrix(functionTypes, numberInXi1, numberInXi2, numberInXi3)
+        return self._getElementGridPoints(np.matmul(basisMatrix, parameters))
+
+
+    def _getElementGridBasisMatrix(self, functionTypes, numberInXi1, numberInXi2, numberInXi3):
+        '''
+        :return: Cached basis matrix for refined points in element with functionTypes.
+        If refining to tricubic Hermite, has rows for each point for value then each derivative
+        in Hermite order, with derivatives scaled for the sub-element.
+        '''
+        key = (tuple(functionTypes), numberInXi1, numberInXi2, numberInXi3)
+        basisMatrix = self._basisMatrices.get(key)
+        if basisMatrix is None:
+            numbersInXi = [ numberInXi1, numberInXi2, numberInXi3 ]
+            xiGrids = [ [ (i/numberInXi) for i in range(numberInXi + 1) ] for numberInXi in numbersInXi ]
+            if self._tricubicHermite:
+                basisMatrices = []
+                for derivatives in self._hermiteDerivatives:
+                    scale = 1.0
+                    for d in range(3):
+                        if derivatives[d]:
+                            scale /= numbersInXi[d]
+                    basisMatrices.append(scale*getTensorBasisMatrix(functionTypes, xiGrids, derivatives))
+                basisMatrix = np.vstack(basisMatrices)
+            else:
+                basisMatrix = getTensorBasisMatrix(functionTypes, xiGrids)
+            self._basisMatrices[key] = basisMatrix
+        return basisMatrix
+
+
+    def _getElementGridPoints(self, values):
+        '''
+        :param values: Product of element grid basis matrix and element parameters.
+        :return: List of coordinates at points, or of lists of tricubic Hermite parameters.
+        '''
+        if self._tricubicHermite:
+            parametersCount = len(self._hermiteValueLabels)
+            return values.reshape(parametersCount, -1, values.shape[-1]).transpose(1, 0, 2).tolist()
+        return values.tolist()
+
+
+    def _getHermiteNodetemplate(self, versionsCount):
+        '''
+        :return: Cached node template for tricubic Hermite coordinates with versionsCount derivative versions.
+        '''
+        nodetemplate = self._hermiteNodetemplates.get(versionsCount)
+        if not nodetemplate:
+            nodetemplate = self._targetNodes.createNodetemplate()
+            nodetemplate.defineField(self._targetCoordinates)
+            for valueLabel in self._hermiteValueLabels[1:]:
+                nodetemplate.setValueNumberOfVersions(self._targetCoordinates, -1, valueLabel, versionsCount)
+            self._hermiteNodetemplates[versionsCount] = nodetemplate
+        return nodetemplate
+
+
+    def _getHermiteNodeVersion(self, nodeId, derivatives):
+        '''
+        Get version of derivatives at existing node matching those supplied, adding a new version if none match.
+        :param derivatives: List of 7 tricubic Hermite derivatives, excluding the value.
+        :return: Version number starting at 1.
+        '''
+        tol = self._octree._tolerance
+        versionDerivatives = self._nodeVersionDerivatives[nodeId]
+        for v in range(len(versionDerivatives)):
+            for d, vd in zip(derivatives, versionDerivatives[v]):
+                if (math.fabs(d[0] - vd[0]) > tol) or (math.fabs(d[1] - vd[1]) > tol) or (math.fabs(d[2] - vd[2]) > tol):
+                    break
+            else:
+                return v + 1
+        versionDerivatives.append(derivatives)
+        versionsCount = len(versionDerivatives)
+        node = self._targetNodes.findNodeByIdentifier(nodeId)
+        node.merge(self._getHermiteNodetemplate(versionsCount))
+        self._targetCache.setNode(node)
+        # set all versions as node parameters are not guaranteed to be kept by merge
+        for v in range(versionsCount):
+            for valueLabel, d in zip(self._hermiteValueLabels[1:], versionDerivatives[v]):
+                self._targetCoordinates.setNodeParameters(self._targetCache, -1, valueLabel, v + 1, d)
+        return versionsCount
+
+
+    def _getHermiteEftElementtemplate(self, nodeVersions):
+        '''
+        :param nodeVersions: Derivative version used at each of 8 local nodes.
+        :return: Cached tricubic Hermite eft and element template using nodeVersions.
+        '''
+        nodeVersions = tuple(nodeVersions)
+        eftElementtemplate = self._hermiteEftElementtemplates.get(nodeVersions)
+        if not eftElementtemplate:
+            eft = self._targetEftFactory.createEftBasic()
+            for n in range(8):
+                version = nodeVersions[n]
+                if version > 1:
+                    for fn in range(n*8 + 2, n*8 + 9):
+                        eft.setTermNodeParameter(fn, 1, n + 1, eft.getTermNodeValueLabel(fn, 1), version)
+            elementtemplate = self._targetMesh.createElementtemplate()
+            elementtemplate.setElementShapeType(Element.SHAPE_TYPE_CUBE)
+            elementtemplate.defineField(self._targetCoordinates, -1, eft)
+            eftElementtemplate = self._hermiteEftElementtemplates[nodeVersions] = (eft, elementtemplate)
+        return eftElementtemplate
+
+
     def refineElementCubeStandard3d(self, sourceElement, numberInXi1, numberInXi2, numberInXi3,
             addNewNodesToOctree=True, shareNodeIds=None, shareNodeCoordinates=None):
         '''
-        Refine cube sourceElement to numberInXi1*numberInXi2*numberInXi3 linear cube
-        sub-elements, evenly spaced in xi.
+        Refine cube sourceElement to numberInXi1*numberInXi2*numberInXi3 linear or, if
+        enabled, tricubic Hermite cube sub-elements, evenly spaced in xi.
         :param addNewNodesToOctree: If True (default) add newly created nodes to
         octree to be found when refining later elements. Set to False when nodes are at the
         same location and not intended to be shared.
@@ -133,6 +282,26 @@ class MeshRefinement:
         '''
         assert (shareNodeIds and shareNodeCoordinates) or (not shareNodeIds and not shareNodeCoordinates), \
             'refineElementCubeStandard3d.  Must supply both of shareNodeIds and shareNodeCoordinates, or neither'
+        gridx = self._evaluateElementGrid(sourceElement, numberInXi1, numberInXi2, numberInXi3) \
+            if self._evaluateElementGrids else None
+        return self._refineElementCubeStandard3d(sourceElement, numberInXi1, numberInXi2, numberInXi3, gridx,
+            addNewNodesToOctree, shareNodeIds, shareNodeCoordinates)
+
+
+    def _refineElementCubeStandard3d(self, sourceElement, numberInXi1, numberInXi2, numberInXi3, gridx,
+            addNewNodesToOctree=True, shareNodeIds=None, shareNodeCoordinates=None, knownNodeIds=None):
+        '''
+        Create refined nodes and elements for sourceElement. See refineElementCubeStandard3d().
+        :param gridx: Coordinates at all refined points in sourceElement with xi1 fastest, or
+        None to evaluate them with Zinc. If refining to tricubic Hermite, must be supplied
+        with the list of 8 tricubic Hermite parameters at each point.
+        :param knownNodeIds: Optional list over refined points of identifiers of existing nodes
+        already found for exterior points, -1 - index of an earlier refined point in this element
+        with the same node, or None for a new node. If supplied, replaces searching for shared nodes.
+        '''
+        assert gridx or not self._tricubicHermite, \
+            'MeshRefinement.  Cannot refine to tricubic Hermite: source element ' + str(sourceElement.getIdentifier()) + \
+            ' basis or field is not supported'
         shareNodesCount = len(shareNodeIds) if shareNodeIds else 0
         meshGroups = []
         for sourceAndTargetMeshGroup in self._sourceAndTargetMeshGroups:
@@ -141,6 +310,7 @@ class MeshRefinement:
         # create nodes
         nids = []
         nx = []
+        nversions = []
         xi = [ 0.0, 0.0, 0.0 ]
         tol = self._octree._tolerance
         for k in range(numberInXi3 + 1):
@@ -152,11 +322,21 @@ class MeshRefinement:
                 for i in range(numberInXi1 + 1):
                     iExterior = jExterior or (i == 0) or (i == numberInXi1)
                     xi[0] = i/numberInXi1
-                    self._sourceCache.setMeshLocation(sourceElement, xi)
-                    result, x = self._sourceCoordinates.evaluateReal(self._sourceCache, 3)
+                    if self._tricubicHermite:
+                        hermiteParameters = gridx[len(nx)]
+                        x = hermiteParameters[0]
+                    elif gridx:
+                        x = gridx[len(nx)]
+                    else:
+                        self._sourceCache.setMeshLocation(sourceElement, xi)
+                        result, x = self._sourceCoordinates.evaluateReal(self._sourceCache, 3)
                     # only exterior points are ever common:
                     nodeId = None
-                    if iExterior:
+                    if iExterior and knownNodeIds:
+                        nodeId = knownNodeIds[len(nx)]
+                        if (nodeId is not None) and (nodeId < 0):
+                            nodeId = nids[-nodeId - 1]
+                    elif iExterior:
                         if shareNodeIds:
                             for n in range(shareNodesCount):
                                 if (math.fabs(shareNodeCoordinates[n][0] - x[0]) <= tol) and \
@@ -166,16 +346,24 @@ class MeshRefinement:
                                     break
                         if nodeId is None:
                             nodeId = self._octree.findObjectByCoordinates(x)
+                    version = 1
                     if nodeId is None:
                         node = self._targetNodes.createNode(self._nodeIdentifier, self._nodetemplate)
                         self._targetCache.setNode(node)
                         result = self._targetCoordinates.setNodeParameters(self._targetCache, -1, Node.VALUE_LABEL_VALUE, 1, x)
                         nodeId = self._nodeIdentifier
+                        if self._tricubicHermite:
+                            for valueLabel, d in zip(self._hermiteValueLabels[1:], hermiteParameters[1:]):
+                                self._targetCoordinates.setNodeParameters(self._targetCache, -1, valueLabel, 1, d)
+                            self._nodeVersionDerivatives[nodeId] = [ hermiteParameters[1:] ]
                         if iExterior and addNewNodesToOctree:
                             self._octree.addObjectAtCoordinates(x, nodeId)
                         self._nodeIdentifier += 1
+                    elif self._tricubicHermite:
+                        version = self._getHermiteNodeVersion(nodeId, hermiteParameters[1:])
                     nids.append(nodeId)
                     nx.append(x)
+                    nversions.append(version)
         # create elements
         startElementIdentifier = self._elementIdentifier
         for k in range(numberInXi3):
@@ -184,10 +372,14 @@ class MeshRefinement:
                 oj = (numberInXi1 + 1)
                 for i in range(numberInXi1):
                     bni = k*ok + j*oj + i
-                    element = self._targetMesh.createElement(self._elementIdentifier, self._targetElementtemplate)
-                    enids = [ nids[bni     ], nids[bni      + 1], nids[bni      + oj], nids[bni      + oj + 1],
-                              nids[bni + ok], nids[bni + ok + 1], nids[bni + ok + oj], nids[bni + ok + oj + 1] ]
-                    result = element.setNodesByIdentifier(self._targetEft, enids)
+                    bnis = [ bni, bni + 1, bni + oj, bni + oj + 1, bni + ok, bni + ok + 1, bni + ok + oj, bni + ok + oj + 1 ]
+                    enids = [ nids[n] for n in bnis ]
+                    if self._tricubicHermite:
+                        eft, elementtemplate = self._getHermiteEftElementtemplate([ nversions[n] for n in bnis ])
+                    else:
+                        eft, elementtemplate = self._targetEft, self._targetElementtemplate
+                    element = self._targetMesh.createElement(self._elementIdentifier, elementtemplate)
+                    result = element.setNodesByIdentifier(eft, enids)
                     #if result != ZINC_OK:
                     #print('Element', self._elementIdentifier, result, enids)
                     self._elementIdentifier += 1
@@ -230,3 +422,137 @@ class MeshRefinement:
         while element.isValid():
             self.refineElementCubeStandard3d(element, numberInXi1, numberInXi2, numberInXi3)
             element = self._sourceElementiterator.next()
+
+
+    def refineAllElementsCubeStandard3dParallel(self, numberInXi1, numberInXi2, numberInXi3, workers=None, chunkSize=256):
+        '''
+        Parallel equivalent of refineAllElementsCubeStandard3d(). Element parameters are
+        extracted in this process, then worker processes evaluate refined points for chunks
+        of consecutive elements and find exterior points coincident with earlier points in
+        the same chunk, using an octree with the same range and tolerance. A single merge
+        pass in element order then creates nodes and elements, finding nodes from earlier
+        chunks for the remaining exterior points with one octree search per chunk. Node and
+        element identifiers are therefore the same as from the serial algorithm.
+        Elements whose basis or field is not supported by batched evaluation are refined
+        serially with Zinc evaluation in the merge pass.
+        This only saves time where the worker processes run concurrently with the merge pass,
+        which still does all node and element creation, so with one worker or CPU it refines
+        serially, evaluating element grids at once.
+        :param workers: Maximum number of worker processes, or None for number of CPUs.
+        :param chunkSize: Maximum number of elements evaluated per task.
+        '''
+        if (workers or os.cpu_count() or 1) < 2:
+            element = self._sourceElementiterator.next()
+            while element.isValid():
+                gridx = self._evaluateElementGrid(element, numberInXi1, numberInXi2, numberInXi3)
+                self._refineElementCubeStandard3d(element, numberInXi1, numberInXi2, numberInXi3, gridx)
+                element = self._sourceElementiterator.next()
+            return
+        exteriorPointIndexes = [ (i + (numberInXi1 + 1)*(j + (numberInXi2 + 1)*k))
+            for k in range(numberInXi3 + 1) for j in range(numberInXi2 + 1) for i in range(numberInXi1 + 1)
+            if (i in (0, numberInXi1)) or (j in (0, numberInXi2)) or (k in (0, numberInXi3)) ]
+        exteriorCount = len(exteriorPointIndexes)
+        octreeRange = (self._octree._minimums.tolist(), self._octree._maximums.tolist(), self._octree._tolerance)
+        # list of chunks of consecutive elements, each a list of (element, function types, parameters);
+        # unsupported elements are in chunks of their own with parameters None
+        chunks = []
+        chunk = []
+        element = self._sourceElementiterator.next()
+        while element.isValid():
+            functionTypes, parameters = getElementFieldParameters(element, self._sourceCoordinates, self._sourceCache,
+                self._sourceNodeParametersMap)
+            if (functionTypes is None) or (len(chunk) == chunkSize):
+                if chunk:
+                    chunks.append(chunk)
+                chunk = []
+            if functionTypes is None:
+                chunks.append([ (element, None, None) ])
+            else:
+                chunk.append((element, tuple(functionTypes), parameters))
+            element = self._sourceElementiterator.next()
+        if chunk:
+            chunks.append(chunk)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for chunk in chunks:
+                if chunk[0][2] is None:
+                    futures.append(None)
+                    continue
+                # map function types -> (basis matrix, chunk indexes, parameters)
+                basisGroups = {}
+                for index, (element, functionTypes, parameters) in enumerate(chunk):
+                    basisGroup = basisGroups.get(functionTypes)
+                    if not basisGroup:
+                        basisGroup = basisGroups[functionTypes] = \
+                            (self._getElementGridBasisMatrix(functionTypes, numberInXi1, numberInXi2, numberInXi3), [], [])
+                    basisGroup[1].append(index)
+                    basisGroup[2].append(parameters)
+                futures.append(executor.submit(_evaluateElementGridsChunk,
+                    [ (basisMatrix, indexes, np.stack(parameters)) for basisMatrix, indexes, parameters in basisGroups.values() ],
+                    len(chunk), exteriorPointIndexes, octreeRange))
+            for chunk, future in zip(chunks, futures):
+                if future is None:
+                    element = chunk[0][0]
+                    self._refineElementCubeStandard3d(element, numberInXi1, numberInXi2, numberInXi3, None)
+                    continue
+                values, earlierIndexes = future.result()
+                # find nodes from earlier chunks for exterior points not coincident with earlier points in chunk
+                firstIndexes = np.flatnonzero(earlierIndexes < 0)
+                exteriorx = values[:, exteriorPointIndexes, :3].reshape(-1, 3)
+                exteriorNodeIds = [ None ]*earlierIndexes.size
+                foundNodeIds = self._octree.findObjectsByCoordinates(exteriorx[firstIndexes])
+                for index, nodeId in zip(firstIndexes.tolist(), foundNodeIds):
+                    exteriorNodeIds[index] = nodeId
+                earlierIndexes = earlierIndexes.tolist()
+                for e, (element, functionTypes, parameters) in enumerate(chunk):
+                    start = e*exteriorCount
+                    knownNodeIds = [ None ]*values.shape[1]
+                    for n, pointIndex in enumerate(exteriorPointIndexes):
+                        earlierIndex = earlierIndexes[start + n]
+                        if earlierIndex < 0:
+                            knownNodeIds[pointIndex] = exteriorNodeIds[start + n]
+                        elif earlierIndex < start:
+                            knownNodeIds[pointIndex] = exteriorNodeIds[earlierIndex]
+                        else:
+                            knownNodeIds[pointIndex] = -1 - exteriorPointIndexes[earlierIndex - start]
+                    nids, nx = self._refineElementCubeStandard3d(element, numberInXi1, numberInXi2, numberInXi3,
+                        self._getElementGridPoints(values[e]), addNewNodesToOctree=False, knownNodeIds=knownNodeIds)
+                    for n, pointIndex in enumerate(exteriorPointIndexes):
+                        exteriorNodeIds[start + n] = nids[pointIndex]
+                # add new exterior nodes to octree together; these are not coincident with each other
+                newIndexes = firstIndexes[[ (nodeId is None) for nodeId in foundNodeIds ]]
+                self._octree.addObjectsAtCoordinates(exteriorx[newIndexes], [ exteriorNodeIds[index] for index in newIndexes.tolist() ])
+
+
+def _evaluateElementGridsChunk(basisGroups, elementsCount, exteriorPointIndexes, octreeRange):
+    '''
+    Evaluate field at refined points in a chunk of consecutive elements, and find exterior
+    points coincident with earlier exterior points in the chunk, in the order the serial
+    refinement would create them. Run in worker process by
+    MeshRefinement.refineAllElementsCubeStandard3dParallel().
+    :param basisGroups: List of (basis matrix with shape (rowsCount, functionsCount), list of
+    indexes of elements in chunk using it, element parameters with shape (elementsCount, functionsCount,
+    componentsCount)), with rows for points first.
+    :param elementsCount: Number of elements in chunk.
+    :param exteriorPointIndexes: Indexes of refined points on the element boundary, in creation order.
+    :param octreeRange: Octree minimums, maximums and tolerance.
+    :return: Field values with shape (elementsCount, rowsCount, componentsCount); int64 array over
+    exterior points of all elements in order, giving index of first coincident earlier exterior point
+    or -1 if none.
+    '''
+    values = None
+    for basisMatrix, indexes, parameters in basisGroups:
+        groupValues = np.matmul(basisMatrix, parameters)
+        if values is None:
+            values = np.zeros((elementsCount,) + groupValues.shape[1:])
+        values[indexes] = groupValues
+    exteriorx = values[:, exteriorPointIndexes, :3].reshape(-1, 3).tolist()
+    earlierIndexes = np.full(len(exteriorx), -1, dtype=np.int64)
+    octree = Octree(*octreeRange)
+    for index, x in enumerate(exteriorx):
+        earlierIndex = octree.findObjectByCoordinates(x)
+        if earlierIndex is None:
+            octree.addObjectAtCoordinates(x, index)
+        else:
+            earlierIndexes[index] = earlierIndex
+    return values, earlierIndexes
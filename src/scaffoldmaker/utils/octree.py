@@ -2,14 +2,24 @@
 Octree for searching for objects by coordinates
 '''
 from __future__ import division
-import copy
 import math
+import numpy as np
+
 
 class Octree:
     '''
-    Octree for searching for objects by coordinates
+    Spatial index for searching for objects by coordinates, within a tolerance.
+    Historically a recursive octree; now a uniform hash grid over flat numpy
+    arrays with cells at least twice the tolerance in size, so a search only
+    needs to examine the point's cell and its neighbours on the nearer side in
+    each direction: 8 cells. Single point adds and finds use a dict of cell key
+    to point indexes; batch finds use a sorted key array. Both are built lazily
+    so neither costs anything until used.
     '''
 
+    _cellIndexBits = 21
+    _nearSideMasks = np.array([ [ i, j, k ] for k in (0, 1) for j in (0, 1) for i in (0, 1) ], dtype=np.int64)
+
     def __init__(self, minimums, maximums, tolerance = None):
         '''
         :param minimums: List of 3 minimum coordinate values. Caller to include any edge allowance.
@@ -17,21 +27,88 @@ class Octree:
         :param tolerance: If supplied, tolerance to use, or None to compute as 1.0E-6*diagonal.
         '''
         self._dimension = 3
-        self._dimensionPower2 = 1 << self._dimension
-        self._maxObjects = 20
         assert len(minimums) == self._dimension, 'Octree minimums is invalid length'
         assert len(maximums) == self._dimension, 'Octree maximums is invalid length'
         if tolerance is None:
             self._tolerance = 1.0E-6*math.sqrt(sum(((maximums[i] - minimums[i])*(maximums[i] - minimums[i])) for i in range(self._dimension)))
         else:
             self._tolerance = tolerance
-        self._minimums = copy.deepcopy(minimums)
-        self._maximums = copy.deepcopy(maximums)
-        # Octree is either leaf with _coordinatesObjects, or has 2**self._dimension children
-        self._coordinatesObjects = []
-        # exactly 2^self._dimension children, cycling in lowest x index fastest
-        self._children = None
+        self._minimums = np.array(minimums, dtype=np.float64)
+        self._maximums = np.array(maximums, dtype=np.float64)
+        self._minimumsList = self._minimums.tolist()
+        # cells no smaller than twice tolerance, and few enough per axis to pack 3 indexes in an int64 key
+        maxCellIndex = (1 << self._cellIndexBits) - 1
+        self._cellSize = max(2.0*self._tolerance, max(self._maximums - self._minimums)/(maxCellIndex - 1))
+        if self._cellSize <= 0.0:
+            self._cellSize = 1.0
+        self._maxCellIndex = maxCellIndex
+        self._count = 0
+        self._coordinates = np.zeros((64, self._dimension), dtype=np.float64)
+        self._keys = np.zeros(64, dtype=np.int64)
+        self._objects = []
+        # lazily built: dict cell key -> list of point indexes, and list of point coordinates
+        # for fast access from python, for single point operations
+        self._cellPoints = None
+        self._coordinatesList = None
+        # lazily built: point indexes sorted by key and the sorted keys, for batch finds
+        self._sortedIndexes = None
+        self._sortedKeys = None
 
+    def _getCellIndexes(self, x, nearSides=False):
+        '''
+        :param x: numpy array of coordinates with shape (N, 3).
+        :param nearSides: Set to True to also return direction of nearer neighbour cells.
+        :return: int64 array of cell indexes with shape (N, 3), clamped to grid.
+        If nearSides, also int64 array of shape (N, 3) with -1 or 1 for direction
+        of nearer neighbour cell in each direction.
+        '''
+        cellCoordinates = (x - self._minimums)/self._cellSize
+        cellIndexes = np.floor(cellCoordinates)
+        if nearSides:
+            sides = np.where((cellCoordinates - cellIndexes) < 0.5, -1, 1).astype(np.int64)
+        np.clip(cellIndexes, 0, self._maxCellIndex, out=cellIndexes)
+        cellIndexes = cellIndexes.astype(np.int64)
+        if nearSides:
+            return cellIndexes, sides
+        return cellIndexes
+
+    def _getKeys(self, cellIndexes):
+        '''
+        Pack cell indexes into keys. Offset indexes outside the grid may alias other
+        cells, which only adds candidates rejected by the distance test.
+        '''
+        bits = self._cellIndexBits
+        return (((cellIndexes[..., 2] << bits) + cellIndexes[..., 1]) << bits) + cellIndexes[..., 0]
+
+    def _reserve(self, count):
+        capacity = self._coordinates.shape[0]
+        if count > capacity:
+            capacity = max(count, 2*capacity)
+            coordinates = np.zeros((capacity, self._dimension), dtype=np.float64)
+            coordinates[:self._count] = self._coordinates[:self._count]
+            self._coordinates = coordinates
+            keys = np.zeros(capacity, dtype=np.int64)
+            keys[:self._count] = self._keys[:self._count]
+            self._keys = keys
+
+    def _buildCellPoints(self):
+        self._cellPoints = {}
+        self._coordinatesList = self._coordinates[:self._count].tolist()
+        if self._count == 0:
+            return
+        keys = self._keys[:self._count]
+        order = np.argsort(keys, kind='stable')
+        sortedKeys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+        ends = np.r_[starts[1:], self._count]
+        orderList = order.tolist()
+        for key, start, end in zip(sortedKeys[starts].tolist(), starts.tolist(), ends.tolist()):
+            self._cellPoints[key] = orderList[start:end]
+
+    def _buildSorted(self):
+        keys = self._keys[:self._count]
+        self._sortedIndexes = np.argsort(keys, kind='stable')
+        self._sortedKeys = keys[self._sortedIndexes]
 
     def _findObjectByCoordinates(self, x):
         '''
@@ -39,42 +116,36 @@ class Octree:
         :param x: 3 coordinates in a list.
         :return: nearest distance, nearest object or None, None if none found.
         '''
+        if self._cellPoints is None:
+            self._buildCellPoints()
         nearestDistance = None
         nearestObject = None
-        if self._coordinatesObjects is not None:
-            for coordinatesObject in self._coordinatesObjects:
-                # cheaply determine if in 2*tolerance sized box around object
-                inBox = True
-                for c in range(self._dimension):
-                    if math.fabs(x[c] - coordinatesObject[0][c]) > self._tolerance:
-                        inBox = False
-                        break
-                if inBox:
-                    # now test exact distance
-                    distance = math.sqrt(sum((x[i] - coordinatesObject[0][i])*(x[i] - coordinatesObject[0][i]) for i in range(self._dimension)))
-                    if (distance < self._tolerance) and ((nearestDistance is None) or (distance < nearestDistance)):
-                        nearestDistance = distance
-                        nearestObject = coordinatesObject[1]
-        else:
-            centre = self._children[0]._maximums
-            for i in range(self._dimensionPower2):
-                inBoundsPlusTolerance = True
-                for c in range(self._dimension):
-                    if i & (1 << c):
-                        if x[c] < (centre[c] - self._tolerance):
-                            inBoundsPlusTolerance = False
-                            break
-                    elif x[c] > (centre[c] + self._tolerance):
-                        inBoundsPlusTolerance = False
-                        break
-                if inBoundsPlusTolerance:
-                    distance, obj = self._children[i]._findObjectByCoordinates(x)
-                    if (distance is not None) and ((nearestDistance is None) or (distance < nearestDistance)):
-                        nearestDistance = distance
-                        nearestObject = obj
+        tolerance = self._tolerance
+        bits = self._cellIndexBits
+        cellIndexRanges = []
+        for c in range(self._dimension):
+            cellCoordinate = (x[c] - self._minimumsList[c])/self._cellSize
+            index = math.floor(cellCoordinate)
+            side = -1 if ((cellCoordinate - index) < 0.5) else 1
+            index = min(max(index, 0), self._maxCellIndex)
+            cellIndexRanges.append((index, index + side))
+        for k in cellIndexRanges[2]:
+            for j in cellIndexRanges[1]:
+                for i in cellIndexRanges[0]:
+                    pointIndexes = self._cellPoints.get((((k << bits) + j) << bits) + i)
+                    if not pointIndexes:
+                        continue
+                    for pointIndex in pointIndexes:
+                        ox = self._coordinatesList[pointIndex]
+                        dx = x[0] - ox[0]
+                        dy = x[1] - ox[1]
+                        dz = x[2] - ox[2]
+                        distance = math.sqrt(dx*dx + dy*dy + dz*dz)
+                        if (distance < tolerance) and ((nearestDistance is None) or (distance < nearestDistance)):
+                            nearestDistance = distance
+                            nearestObject = self._objects[pointIndex]
         return nearestDistance, nearestObject
 
-
     def findObjectByCoordinates(self, x):
         '''
         Find closest existing object with |x - ox| < tolerance.
@@ -84,41 +155,93 @@ class Octree:
         nearestDistance, nearestObject = self._findObjectByCoordinates(x)
         return nearestObject
 
-
     def addObjectAtCoordinates(self, x, obj):
         '''
-        Add object at coordianates to octree.
+        Add object at coordinates to octree.
         Caller must have received None result for findObjectByCoordinates() first!
-        Assumes caller has verified x is within range of Octree.
+        Objects outside range of Octree are added but searches near them are slower.
         :param x: 3 coordinates in a list.
         :param obj: object to store with coordinates.
         '''
-        if self._coordinatesObjects is not None:
-            if len(self._coordinatesObjects) < self._maxObjects:
-                self._coordinatesObjects.append( (copy.deepcopy(x), obj) )
-                return
-            else:
-                # subdivide and add coordinatesObjects plus new object to new children
-                coordinatesObjects = self._coordinatesObjects
-                self._coordinatesObjects = None
-                self._children = []
-                for i in range(self._dimensionPower2):
-                    childMinimums = copy.deepcopy(self._minimums)
-                    childMaximums = copy.deepcopy(self._maximums)
-                    for c in range(self._dimension):
-                        if i & (1 << c):
-                            childMinimums[c] = 0.5*(self._minimums[c] + self._maximums[c])
-                        else:
-                            childMaximums[c] = 0.5*(self._minimums[c] + self._maximums[c])
-                    child = Octree(childMinimums, childMaximums, self._tolerance)
-                    self._children.append(child)
-                # add coordinatesObjects to children
-                for coordinatesObject in coordinatesObjects:
-                    self.addObjectAtCoordinates(coordinatesObject[0], coordinatesObject[1])
-        # add the new object to the first child it fits in, using efficient octree search
-        i = 0
-        centre = self._children[0]._maximums
-        for c in range(self._dimension):
-            if x[c] > centre[c]:
-                i += 1 << c
-        self._children[i].addObjectAtCoordinates(x, obj)
+        if self._cellPoints is None:
+            self._buildCellPoints()
+        px = [ float(x[c]) for c in range(self._dimension) ]
+        key = 0
+        for c in range(self._dimension - 1, -1, -1):
+            index = math.floor((px[c] - self._minimumsList[c])/self._cellSize)
+            key = (key << self._cellIndexBits) + min(max(index, 0), self._maxCellIndex)
+        pointIndex = self._count
+        self._reserve(pointIndex + 1)
+        self._coordinates[pointIndex] = px
+        self._keys[pointIndex] = key
+        self._objects.append(obj)
+        self._count += 1
+        self._sortedIndexes = self._sortedKeys = None
+        self._cellPoints.setdefault(key, []).append(pointIndex)
+        self._coordinatesList.append(px)
+
+    def findObjectsByCoordinates(self, x):
+        '''
+        Find closest existing objects with |x - ox| < tolerance for many points.
+        :param x: Coordinates array-like with shape (N, 3).
+        :return: List of N nearest objects, with None for points not found.
+        '''
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self._dimension)
+        pointsCount = x.shape[0]
+        result = [ None ]*pointsCount
+        if (pointsCount == 0) or (self._count == 0):
+            return result
+        if self._sortedKeys is None:
+            self._buildSorted()
+        cellIndexes, sides = self._getCellIndexes(x, nearSides=True)
+        nearestDistances = np.full(pointsCount, np.inf)
+        nearestIndexes = np.full(pointsCount, -1, dtype=np.int64)
+        for nearSideMask in self._nearSideMasks:
+            keys = self._getKeys(cellIndexes + nearSideMask*sides)
+            starts = np.searchsorted(self._sortedKeys, keys, side='left')
+            ends = np.searchsorted(self._sortedKeys, keys, side='right')
+            counts = ends - starts
+            queryIndexes = np.flatnonzero(counts)
+            if queryIndexes.size == 0:
+                continue
+            counts = counts[queryIndexes]
+            # expand to one row per candidate point
+            candidateQueries = np.repeat(queryIndexes, counts)
+            candidateStarts = np.repeat(starts[queryIndexes] - np.cumsum(counts) + counts, counts)
+            candidatePoints = self._sortedIndexes[candidateStarts + np.arange(candidateQueries.size)]
+            distances = np.sqrt(np.sum(np.square(x[candidateQueries] - self._coordinates[candidatePoints]), axis=1))
+            # process in descending distance order so nearest candidate is written last
+            order = np.argsort(-distances, kind='stable')
+            candidateQueries = candidateQueries[order]
+            distances = distances[order]
+            candidatePoints = candidatePoints[order]
+            closer = distances < nearestDistances[candidateQueries]
+            nearestDistances[candidateQueries[closer]] = distances[closer]
+            nearestIndexes[candidateQueries[closer]] = candidatePoints[closer]
+        for q in np.flatnonzero(nearestDistances < self._tolerance).tolist():
+            result[q] = self._objects[nearestIndexes[q]]
+        return result
+
+    def addObjectsAtCoordinates(self, x, objs):
+        '''
+        Add many objects at coordinates to octree.
+        Caller must have received None results for findObjectsByCoordinates() first,
+        and ensured the new points are not within tolerance of each other.
+        :param x: Coordinates array-like with shape (N, 3).
+        :param objs: Sequence of N objects to store with coordinates.
+        '''
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self._dimension)
+        pointsCount = x.shape[0]
+        assert len(objs) == pointsCount, 'Octree addObjectsAtCoordinates:  Number of objects does not match coordinates'
+        if pointsCount == 0:
+            return
+        start = self._count
+        self._reserve(start + pointsCount)
+        keys = self._getKeys(self._getCellIndexes(x))
+        self._coordinates[start:start + pointsCount] = x
+        self._keys[start:start + pointsCount] = keys
+        self._objects.extend(objs)
+        self._count += pointsCount
+        self._sortedIndexes = self._sortedKeys = None
+        # cheaper to rebuild than update one by one for large additions
+        self._cellPoints = self._coordinatesList = None
@@ -0,0 +1,143 @@
+'''
+Utilities for evaluating tensor product element bases at many xi locations at once,
+and for extracting the element field parameters they multiply.
+'''
+from __future__ import division
+import numpy as np
+from opencmiss.zinc.element import Element, Elementbasis
+from opencmiss.zinc.result import RESULT_OK
+from scaffoldmaker.utils.eft_utils import getEftTermScaling
+
+
+def getBasisFunctions1d(functionType, xi, derivative=0):
+    '''
+    Get values or derivatives of a 1-D basis at many xi.
+    :param functionType: Zinc Elementbasis function type. Supported types are
+    FUNCTION_TYPE_LINEAR_LAGRANGE, FUNCTION_TYPE_QUADRATIC_LAGRANGE and FUNCTION_TYPE_CUBIC_HERMITE.
+    :param xi: Array-like of xi values.
+    :param derivative: Order of derivative w.r.t. xi: 0 (value) or 1.
+    :return: numpy array of shape (len(xi), nodesCount, functionsPerNodeCount), or None if
+    function type or derivative is not supported.
+    '''
+    xi = np.asarray(xi, dtype=np.float64)
+    xi2 = xi*xi
+    if functionType == Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE:
+        if derivative == 0:
+            functions = [ 1.0 - xi, xi ]
+        elif derivative == 1:
+            functions = [ -np.ones_like(xi), np.ones_like(xi) ]
+        else:
+            return None
+        return np.stack(functions, axis=1).reshape(xi.size, 2, 1)
+    if functionType == Elementbasis.FUNCTION_TYPE_QUADRATIC_LAGRANGE:
+        if derivative == 0:
+            functions = [ 1.0 - 3.0*xi + 2.0*xi2, 4.0*xi - 4.0*xi2, -xi + 2.0*xi2 ]
+        elif derivative == 1:
+            functions = [ -3.0 + 4.0*xi, 4.0 - 8.0*xi, -1.0 + 4.0*xi ]
+        else:
+            return None
+        return np.stack(functions, axis=1).reshape(xi.size, 3, 1)
+    if functionType == Elementbasis.FUNCTION_TYPE_CUBIC_HERMITE:
+        # same as interpolation.getCubicHermiteBasis(), getCubicHermiteBasisDerivatives()
+        xi3 = xi2*xi
+        if derivative == 0:
+            functions = [ 1.0 - 3.0*xi2 + 2.0*xi3, xi - 2.0*xi2 + xi3, 3.0*xi2 - 2.0*xi3, -xi2 + xi3 ]
+        elif derivative == 1:
+            functions = [ -6.0*xi + 6.0*xi2, 1.0 - 4.0*xi + 3.0*xi2, 6.0*xi - 6.0*xi2, -2.0*xi + 3.0*xi2 ]
+        else:
+            return None
+        return np.stack(functions, axis=1).reshape(xi.size, 2, 2)
+    return None
+
+
+def getTensorBasisMatrix(functionTypes, xiGrids, derivatives=None):
+    '''
+    Get matrix of tensor product basis function values at all points on a regular grid of
+    xi, so field values at the points are this matrix multiplied by element parameters.
+    Points are ordered with xi1 fastest, then xi2, then xi3. Basis functions are in Zinc
+    order: by basis node with lowest xi fastest, then by function at node, e.g. value, d1,
+    d2, d12, d3, d13, d23, d123 for tricubic Hermite.
+    :param functionTypes: List of Zinc Elementbasis function types for each xi direction.
+    :param xiGrids: List of array-like xi values along each direction.
+    :param derivatives: Optional list of derivative order w.r.t. xi in each direction.
+    :return: numpy array of shape (pointsCount, functionsCount), or None if unsupported.
+    '''
+    dimension = len(functionTypes)
+    if not derivatives:
+        derivatives = [ 0 ]*dimension
+    basis = None
+    for d in range(dimension):
+        basis1d = getBasisFunctions1d(functionTypes[d], xiGrids[d], derivatives[d])
+        if basis1d is None:
+            return None
+        if basis is None:
+            basis = basis1d
+        else:
+            # outer product with new direction slowest in each of points, nodes, functions
+            basis = np.einsum('qmg,pnf->qpmngf', basis1d, basis).reshape(
+                basis1d.shape[0]*basis.shape[0], basis1d.shape[1]*basis.shape[1], basis1d.shape[2]*basis.shape[2])
+    return basis.reshape(basis.shape[0], -1)
+
+
+def getElementbasisFunctionTypes(elementbasis):
+    '''
+    :return: List of Zinc function types for each xi direction of elementbasis.
+    '''
+    return [ elementbasis.getFunctionType(d) for d in range(1, elementbasis.getDimension() + 1) ]
+
+
+def getElementFieldParameters(element, field, fieldcache, nodeParametersMap=None):
+    '''
+    Get element field parameters for each basis function, being sums of node parameters
+    for each term multiplied by its scale factors, as mapped by the element field template.
+    Only supports fields with the same element field template for all components, on cube,
+    square or line elements, with bases supported by getTensorBasisMatrix().
+    :param element: Zinc element.
+    :param field: Finite element field, e.g. coordinates.
+    :param fieldcache: Zinc fieldcache for field's fieldmodule, used to evaluate node parameters.
+    :param nodeParametersMap: Optional dict (nodeIdentifier, valueLabel, version) -> node parameters,
+    filled in by this function, for reuse over multiple elements.
+    :return: Function types list, numpy array of shape (functionsCount, componentsCount); or None, None
+    if unsupported.
+    '''
+    eft = element.getElementfieldtemplate(field, -1)
+    if not eft.isValid():
+        return None, None
+    if element.getShapeType() not in (Element.SHAPE_TYPE_CUBE, Element.SHAPE_TYPE_SQUARE, Element.SHAPE_TYPE_LINE):
+        return None, None
+    functionTypes = getElementbasisFunctionTypes(eft.getElementbasis())
+    if getTensorBasisMatrix(functionTypes, [ [ 0.0 ] ]*len(functionTypes)) is None:
+        return None, None
+    componentsCount = field.getNumberOfComponents()
+    scaleFactors = []
+    scaleFactorsCount = eft.getNumberOfLocalScaleFactors()
+    if scaleFactorsCount > 0:
+        # handle zinc returning single value as a scalar, change to list for consistency
+        result, scaleFactors = element.getScaleFactors(eft, scaleFactorsCount)
+        if result != RESULT_OK:
+            return None, None
+        if not isinstance(scaleFactors, list):
+            scaleFactors = [ scaleFactors ]
+    if nodeParametersMap is None:
+        nodeParametersMap = {}
+    functionsCount = eft.getNumberOfFunctions()
+    parameters = np.zeros((functionsCount, componentsCount))
+    for fn in range(1, functionsCount + 1):
+        for t in range(1, eft.getFunctionNumberOfTerms(fn) + 1):
+            node = element.getNode(eft, eft.getTermLocalNodeIndex(fn, t))
+            key = (node.getIdentifier(), eft.getTermNodeValueLabel(fn, t), eft.getTermNodeVersion(fn, t))
+            nodeParameters = nodeParametersMap.get(key)
+            if nodeParameters is None:
+                fieldcache.setNode(node)
+                result, nodeParameters = field.getNodeParameters(fieldcache, -1, key[1], key[2], componentsCount)
+                if result != RESULT_OK:
+                    return None, None
+                if not isinstance(nodeParameters, list):
+                    nodeParameters = [ nodeParameters ]
+                nodeParametersMap[key] = nodeParameters
+            totalScaleFactor = 1.0
+            if scaleFactorsCount > 0:
+                for s in getEftTermScaling(eft, fn, t):
+                    totalScaleFactor *= scaleFactors[s - 1]
+            parameters[fn - 1] += totalScaleFactor*np.array(nodeParameters)
+    return functionTypes, parameters
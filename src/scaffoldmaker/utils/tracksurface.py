@@ -6,7 +6,10 @@ from __future__ import division
 import copy
 from enum import Enum
 import math
+import numpy as np
 from scaffoldmaker.utils import interpolation as interp
+from scaffoldmaker.utils.boundingvolumehierarchy import BoundingVolumeHierarchy
+from scaffoldmaker.utils import interpolation_np
 from scaffoldmaker.utils import vector
 
 
@@ -54,6 +57,10 @@ class TrackSurface:
             self.nd1 += nd1
             self.nd2 += nd2
         self.loop1 = loop1
+        # per-element arrays of node parameters and spatial index of elements, created on first use
+        self._elementParameters = None
+        self._elementsHierarchy = None
+        self.resetNearestPositionStatistics()
 
     def createMirrorX(self):
         '''
@@ -163,6 +170,113 @@ class TrackSurface:
             derivative2.append(d2)
         return coordinates, derivative1, derivative2
 
+    def _getElementParameters(self):
+        '''
+        :return: Array of bicubic Hermite parameters for each element with shape (elementsCount2*elementsCount1, 12, 3),
+        giving x then d1 then d2 at the 4 element nodes varying fastest in direction 1. Created on first use.
+        '''
+        if self._elementParameters is None:
+            nodesCount1 = self.elementsCount1 + 1
+            nodeParameters = np.array([ self.nx, self.nd1, self.nd2 ], dtype=np.float64).reshape(
+                3, self.elementsCount2 + 1, nodesCount1, 3)
+            elementParameters = np.empty((self.elementsCount2, self.elementsCount1, 3, 4, 3))
+            for ln, (o2, o1) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+                elementParameters[:, :, :, ln] = nodeParameters[:, o2:o2 + self.elementsCount2, o1:o1 + self.elementsCount1] \
+                    .transpose(1, 2, 0, 3)
+            self._elementParameters = elementParameters.reshape(-1, 12, 3)
+        return self._elementParameters
+
+    def _evaluateCoordinatesArrays(self, e1, e2, xi1, xi2, derivatives=False):
+        '''
+        Evaluate coordinates on surface at many positions given as arrays of element indexes and xi.
+        :param e1, e2, xi1, xi2: Arrays of M element indexes and xi in directions 1 and 2.
+        :return: If derivatives is False: coordinates with shape (M, 3).
+        If derivatives is True: coordinates, derivative1, derivative2 each with shape (M, 3).
+        '''
+        parameters = self._getElementParameters()[np.asarray(e2)*self.elementsCount1 + np.asarray(e1)]
+        f1 = interpolation_np.getCubicHermiteBasis(xi1)
+        f2 = interpolation_np.getCubicHermiteBasis(xi2)
+        coordinates = np.einsum('mk,mkc->mc', _getBicubicHermiteWeights(f1, f2), parameters)
+        if not derivatives:
+            return coordinates
+        df1 = interpolation_np.getCubicHermiteBasisDerivatives(xi1)
+        df2 = interpolation_np.getCubicHermiteBasisDerivatives(xi2)
+        derivative1 = np.einsum('mk,mkc->mc', _getBicubicHermiteWeights(df1, f2), parameters)
+        derivative2 = np.einsum('mk,mkc->mc', _getBicubicHermiteWeights(f1, df2), parameters)
+        return coordinates, derivative1, derivative2
+
+    def evaluateCoordinatesMany(self, positions, derivatives = False):
+        '''
+        Evaluate coordinates on surface at many positions at once, and optionally
+        derivatives w.r.t. xi1 and xi2. Faster than evaluateCoordinates() for each.
+        :param positions: List of M valid TrackSurfacePosition.
+        :return: If derivatives is False: coordinates as array with shape (M, 3).
+        If derivatives is True: coordinates, derivative1, derivative2 arrays each with shape (M, 3).
+        '''
+        e1 = np.array([ position.e1 for position in positions ], dtype=np.int64)
+        e2 = np.array([ position.e2 for position in positions ], dtype=np.int64)
+        xi1 = np.array([ position.xi1 for position in positions ], dtype=np.float64)
+        xi2 = np.array([ position.xi2 for position in positions ], dtype=np.float64)
+        return self._evaluateCoordinatesArrays(e1, e2, xi1, xi2, derivatives)
+
+    _sampleXi = [ 1.0/6.0, 0.5, 5.0/6.0 ]
+
+    def _getElementsHierarchy(self):
+        '''
+        :return: BoundingVolumeHierarchy over elements bounded by their Bezier control polygons,
+        which contain the surface, with a 3x3 grid of sample points in each. Created on first use.
+        '''
+        if self._elementsHierarchy is None:
+            parameters = self._getElementParameters()
+            x = parameters[:, 0:4]
+            d1 = parameters[:, 4:8]/3.0
+            d2 = parameters[:, 8:12]/3.0
+            # sign of derivatives pointing into element from each node
+            sign1 = np.array([ 1.0, -1.0, 1.0, -1.0 ])[:, np.newaxis]
+            sign2 = np.array([ 1.0, 1.0, -1.0, -1.0 ])[:, np.newaxis]
+            # zero cross derivatives give zero twist so inner control points are x + d1 + d2
+            controlPoints = np.concatenate((x, x + sign1*d1, x + sign2*d2, x + sign1*d1 + sign2*d2), axis=1)
+            elementsCount = parameters.shape[0]
+            sampleXi1 = np.tile(self._sampleXi, 3)
+            sampleXi2 = np.repeat(self._sampleXi, 3)
+            e2, e1 = np.divmod(np.repeat(np.arange(elementsCount), 9), self.elementsCount1)
+            samplePoints = self._evaluateCoordinatesArrays(e1, e2, np.tile(sampleXi1, elementsCount),
+                np.tile(sampleXi2, elementsCount)).reshape(elementsCount, 9, 3)
+            self._elementsHierarchy = BoundingVolumeHierarchy(np.min(controlPoints, axis=1),
+                np.max(controlPoints, axis=1), samplePoints)
+        return self._elementsHierarchy
+
+    def _getNearestStartPositions(self, targetx):
+        '''
+        Get start positions for finding nearest positions to targetx at the nearest of a grid
+        of 3x3 sample points in each element, found with a bounding volume hierarchy.
+        :param targetx: Array of M target coordinates with shape (M, 3).
+        :return: Arrays of M e1, e2, xi1, xi2.
+        '''
+        elementIndexes, sampleIndexes, _ = self._getElementsHierarchy().findNearestSamples(targetx)
+        e2, e1 = np.divmod(elementIndexes, self.elementsCount1)
+        sampleXi = np.array(self._sampleXi)
+        return e1, e2, sampleXi[sampleIndexes % 3], sampleXi[sampleIndexes//3]
+
+    def getNearestPositionStatistics(self):
+        '''
+        :return: Dict with numbers of nearest position queries, and total and maximum
+        iterations for them since creation or last reset, for profiling.
+        '''
+        return dict(self._nearestPositionStatistics)
+
+    def resetNearestPositionStatistics(self):
+        self._nearestPositionStatistics = { 'queries': 0, 'iterations': 0, 'maxIterations': 0 }
+
+    def _addNearestPositionStatistics(self, iterationsCounts):
+        '''
+        :param iterationsCounts: List of numbers of iterations taken by queries.
+        '''
+        statistics = self._nearestPositionStatistics
+        statistics['queries'] += len(iterationsCounts)
+        statistics['iterations'] += sum(iterationsCounts)
+        statistics['maxIterations'] = max([ statistics['maxIterations'] ] + iterationsCounts)
+
     class HermiteCurveMode(Enum):
         SMOOTH = 1    # smooth variation of element size between end derivatives
         TRANSITION_END = 2  # transition from start derivative then even size
@@ -279,10 +393,15 @@ class TrackSurface:
         mag2 = vector.magnitude(nd2[0])
         if mag2 > 0.0:
             nd2[0] = vector.setMagnitude(nd2[0], vector.magnitude(nd1[0]))
+        positions = self.findNearestPositions(nx[1:elementsCount],
+            [ self.createPositionProportion(*nProportions[n]) for n in range(1, elementsCount) ])
+        if positions:
+            _, psd1, psd2 = self.evaluateCoordinatesMany(positions, derivatives=True)
         for n in range(1, elementsCount):
-            p = self.findNearestPosition(nx[n], self.createPositionProportion(*nProportions[n]))
+            p = positions[n - 1]
             nProportions[n] = self.getProportion(p)
-            _, sd1, sd2 = self.evaluateCoordinates(p, derivatives=True)
+            sd1 = psd1[n - 1].tolist()
+            sd2 = psd2[n - 1].tolist()
             _, d2, d3 = calculate_surface_axes(sd1, sd2, vector.normalise(nd1[n]))
             nd2[n] = vector.setMagnitude(d2, vector.magnitude(nd1[n]))
             nd3[n] = d3
@@ -294,11 +413,14 @@ class TrackSurface:
     def findNearestPosition(self, targetx, startPosition = None):
         '''
         Find the nearest point to targetx on the track surface, with optional start position.
-        Only works if track surface is simply shaped; use a close startPosition if not.
+        If no start position, starts from the nearest of a grid of points sampled in each element,
+        found with a bounding volume hierarchy over the elements.
+        Numbers of iterations are recorded in getNearestPositionStatistics().
         :return: Nearest TrackSurfacePosition
         '''
         if not startPosition:
-            startPosition = self.createPositionProportion(0.5, 0.5)
+            e1, e2, xi1, xi2 = self._getNearestStartPositions(np.array([ targetx ], dtype=np.float64))
+            startPosition = TrackSurfacePosition(int(e1[0]), int(e2[0]), float(xi1[0]), float(xi2[0]))
         position = copy.deepcopy(startPosition)
         max_mag_dxi = 0.5  # target/maximum magnitude of xi increment
         xi_tol = 1.0E-6
@@ -345,9 +467,73 @@ class TrackSurface:
                             break
         else:
             print('TrackSurface.findNearestPosition:  Reach max iterations', iter + 1, 'closeness in xi', mag_dxi)
+        self._addNearestPositionStatistics([ iter + 1 ])
         #print('final position', position)
         return position
 
+    def findNearestPositions(self, targetx, startPositions = None):
+        '''
+        Find the nearest points to many targetx on the track surface at once, iterating
+        all points together by the same method as findNearestPosition().
+        :param targetx: List of M target coordinates, or array with shape (M, 3).
+        :param startPositions: Optional list of M TrackSurfacePosition to start from. If
+        omitted, each starts from the nearest of a grid of points sampled in each element.
+        :return: List of M nearest TrackSurfacePosition
+        '''
+        targetx = np.asarray(targetx, dtype=np.float64).reshape(-1, 3)
+        if targetx.shape[0] == 0:
+            return []
+        if startPositions:
+            e1 = np.array([ position.e1 for position in startPositions ], dtype=np.int64)
+            e2 = np.array([ position.e2 for position in startPositions ], dtype=np.int64)
+            xi1 = np.array([ position.xi1 for position in startPositions ], dtype=np.float64)
+            xi2 = np.array([ position.xi2 for position in startPositions ], dtype=np.float64)
+        else:
+            e1, e2, xi1, xi2 = self._getNearestStartPositions(targetx)
+        assert e1.size == targetx.shape[0], 'TrackSurface.findNearestPositions:  Invalid number of start positions'
+        max_mag_dxi = 0.5  # target/maximum magnitude of xi increment
+        xi_tol = 1.0E-6
+        active = np.arange(targetx.shape[0])
+        iterationsCounts = np.zeros(targetx.shape[0], dtype=np.int64)
+        for iter in range(100):
+            if active.size == 0:
+                break
+            iterationsCounts[active] += 1
+            ax, ad1, ad2 = self._evaluateCoordinatesArrays(e1[active], e2[active], xi1[active], xi2[active], derivatives = True)
+            adelta_xi1, adelta_xi2 = calculate_surface_delta_xi_many(ad1, ad2, targetx[active] - ax)
+            mag_dxi = np.sqrt(adelta_xi1*adelta_xi1 + adelta_xi2*adelta_xi2)
+            limit = mag_dxi > max_mag_dxi
+            dxi1 = np.where(limit, adelta_xi1*(max_mag_dxi/np.where(limit, mag_dxi, 1.0)), adelta_xi1)
+            dxi2 = np.where(limit, adelta_xi2*(max_mag_dxi/np.where(limit, mag_dxi, 1.0)), adelta_xi2)
+            bxi1, bxi2, proportion, faceNumber = increment_xi_on_square_many(xi1[active], xi2[active], dxi1, dxi2)
+            xi1[active] = bxi1
+            xi2[active] = bxi2
+            finished = mag_dxi < xi_tol
+            cross = ~finished & (faceNumber > 0)
+            onBoundary = self._updatePositionsToFaceNumbers(e1, e2, xi1, xi2, active[cross], faceNumber[cross])
+            # slide along boundary to nearest point; may cross other sides
+            slide = np.flatnonzero(cross)[onBoundary & (proportion[cross] < xi_tol)]
+            if slide.size > 0:
+                along2 = faceNumber[slide] <= 2
+                remainder = 1.0 - proportion[slide]
+                bdxi1 = np.where(along2, 0.0, dxi1[slide]*remainder)
+                bdxi2 = np.where(along2, dxi2[slide]*remainder, 0.0)
+                cmag_dxi = np.where(along2, bdxi2, bdxi1)
+                cxi1, cxi2, _, cFaceNumber = increment_xi_on_square_many(bxi1[slide], bxi2[slide], bdxi1, bdxi2)
+                xi1[active[slide]] = cxi1
+                xi2[active[slide]] = cxi2
+                slideFinished = np.fabs(cmag_dxi) < xi_tol
+                cCross = ~slideFinished & (cFaceNumber > 0)
+                cOnBoundary = self._updatePositionsToFaceNumbers(e1, e2, xi1, xi2, active[slide[cCross]], cFaceNumber[cCross])
+                slideFinished[np.flatnonzero(cCross)[cOnBoundary]] = True
+                finished[slide[slideFinished]] = True
+            active = active[~finished]
+        else:
+            if active.size > 0:
+                print('TrackSurface.findNearestPositions:  Reach max iterations', iter + 1, 'for', active.size, 'points')
+        self._addNearestPositionStatistics(iterationsCounts.tolist())
+        return [ TrackSurfacePosition(*values) for values in zip(e1.tolist(), e2.tolist(), xi1.tolist(), xi2.tolist()) ]
+
     def trackVector(self, startPosition, direction, trackDistance):
         '''
         Track from startPosition the given distance in the vector direction.
@@ -425,6 +611,176 @@ class TrackSurface:
                 #print('  cross face', faceNumber, 'new position', position)
         return position
 
+    # Dormand-Prince 5(4) coefficients: stage xi fractions, stage weights, 5th order weights
+    # and differences from embedded 4th order weights for error estimate
+    _dpC = [ 0.0, 1.0/5.0, 3.0/10.0, 4.0/5.0, 8.0/9.0, 1.0, 1.0 ]
+    _dpA = [
+        [],
+        [ 1.0/5.0 ],
+        [ 3.0/40.0, 9.0/40.0 ],
+        [ 44.0/45.0, -56.0/15.0, 32.0/9.0 ],
+        [ 19372.0/6561.0, -25360.0/2187.0, 64448.0/6561.0, -212.0/729.0 ],
+        [ 9017.0/3168.0, -355.0/33.0, 46732.0/5247.0, 49.0/176.0, -5103.0/18656.0 ],
+        [ 35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0 ] ]
+    _dpB = [ 35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0, 0.0 ]
+    _dpE = [ 71.0/57600.0, 0.0, -71.0/16695.0, 71.0/1920.0, -17253.0/339200.0, 22.0/525.0, -1.0/40.0 ]
+
+    def _getTrackRates(self, u, directions):
+        '''
+        Get rates of change of surface coordinates u with distance tracked in directions
+        projected onto the surface.
+        :param u: Surface coordinates e1 + xi1, e2 + xi2 with shape (T, 2). Can be slightly
+        outside the surface, where the boundary elements are extrapolated.
+        :param directions: 3-D directions to track in with shape (T, 3).
+        :return: du/ds with shape (T, 2), zero where no direction on surface, and derivatives
+        d1, d2 at u each with shape (T, 3).
+        '''
+        e1 = np.clip(np.floor(u[:, 0]), 0, self.elementsCount1 - 1).astype(np.int64)
+        e2 = np.clip(np.floor(u[:, 1]), 0, self.elementsCount2 - 1).astype(np.int64)
+        _, d1, d2 = self._evaluateCoordinatesArrays(e1, e2, u[:, 0] - e1, u[:, 1] - e2, derivatives = True)
+        delta_xi1, delta_xi2 = calculate_surface_delta_xi_many(d1, d2, directions)
+        rates = np.stack([ delta_xi1, delta_xi2 ], axis=1)
+        magnitudes = np.sqrt(np.einsum('tc,tc->t', d1*delta_xi1[:, np.newaxis] + d2*delta_xi2[:, np.newaxis],
+                                       d1*delta_xi1[:, np.newaxis] + d2*delta_xi2[:, np.newaxis]))
+        moving = magnitudes > 0.0
+        rates[moving] /= magnitudes[moving][:, np.newaxis]
+        rates[~moving] = 0.0
+        return rates, d1, d2
+
+    def trackVectorsAdaptive(self, startPositions, directions, trackDistances, tolerance = 1.0E-6, maxSteps = 1000):
+        '''
+        Track many start positions at once the given distances in vector directions.
+        Integrates surface coordinates with respect to distance by the adaptive Dormand-Prince
+        5(4) method, so distance is accumulated with no separate arc length calculation, and the
+        step size is controlled from an estimate of the local error in 3-D coordinates.
+        Tracks stop at the boundary of the track surface, with the last step shortened to reach it.
+        :param startPositions: List of T TrackSurfacePosition.
+        :param directions: List of T 3-D vectors (x, y, z) to track along, projected onto surface.
+        :param trackDistances: List of T distances to track along. Can be negative.
+        :param tolerance: Maximum local error estimate for each step, as a fraction of track distance.
+        :param maxSteps: Maximum number of accepted and rejected steps for each track.
+        :return: List of T final TrackSurfacePosition, array of T estimates of the error in final
+        coordinates as the sum of local error estimates of all steps.
+        '''
+        tracksCount = len(startPositions)
+        if tracksCount == 0:
+            return [], np.zeros(0)
+        trackDistances = np.array(trackDistances, dtype=np.float64).reshape(tracksCount)
+        directions = np.array(directions, dtype=np.float64).reshape(tracksCount, 3)*np.where(trackDistances < 0.0, -1.0, 1.0)[:, np.newaxis]
+        trackDistances = np.fabs(trackDistances)
+        u = np.array([ [ position.e1 + position.xi1, position.e2 + position.xi2 ] for position in startPositions ], dtype=np.float64)
+        uMaximums = np.array([ self.elementsCount1, self.elementsCount2 ], dtype=np.float64)
+        distances = np.zeros(tracksCount)
+        errors = np.zeros(tracksCount)
+        stepsCounts = np.zeros(tracksCount, dtype=np.int64)
+        errorTolerances = tolerance*trackDistances
+        k1, d1, d2 = self._getTrackRates(u, directions)
+        # initial step of up to 0.25 in xi
+        rateMagnitudes = np.max(np.fabs(k1), axis=1)
+        steps = np.where(rateMagnitudes > 0.0, 0.25/np.where(rateMagnitudes > 0.0, rateMagnitudes, 1.0), trackDistances)
+        active = np.flatnonzero(trackDistances > 0.0)
+        stopped = active[~np.any(k1[active] != 0.0, axis=1)]
+        for t in stopped.tolist():
+            print('TrackSurface.trackVectorsAdaptive. No direction on surface at track', t)
+        active = active[np.any(k1[active] != 0.0, axis=1)]
+        while active.size > 0:
+            a = active
+            h = np.minimum(steps[a], trackDistances[a] - distances[a])
+            k = [ k1[a] ]
+            for stage in range(1, 7):
+                ustage = u[a] + h[:, np.newaxis]*sum(self._dpA[stage][j]*k[j] for j in range(stage) if self._dpA[stage][j] != 0.0)
+                if stage < 6:
+                    k.append(self._getTrackRates(ustage, directions[a])[0])
+                else:
+                    unew = ustage
+                    k7, nd1, nd2 = self._getTrackRates(unew, directions[a])
+                    k.append(k7)
+            error = h[:, np.newaxis]*sum(self._dpE[j]*k[j] for j in range(7) if self._dpE[j] != 0.0)
+            errorx = d1[a]*error[:, 0:1] + d2[a]*error[:, 1:2]
+            errorMagnitudes = np.sqrt(np.einsum('tc,tc->t', errorx, errorx))
+            stepsCounts[a] += 1
+            accept = errorMagnitudes <= errorTolerances[a]
+            # new step size
+            with np.errstate(divide='ignore'):
+                factors = np.where(errorMagnitudes > 0.0,
+                    0.9*np.power(errorTolerances[a]/errorMagnitudes, 0.2), 5.0)
+            steps[a] = h*np.clip(factors, 0.2, 5.0)
+            # accepted steps leaving the surface are cut back along chord to the boundary
+            with np.errstate(all='ignore'):
+                du = unew - u[a]
+                proportions = np.min(np.where(unew < 0.0, -u[a]/du, np.where(unew > uMaximums, (uMaximums - u[a])/du, 1.0)), axis=1)
+            crossing = accept & (proportions < 1.0)
+            # unless nearly there, retry with step shortened to reach boundary since u is nonlinear in distance
+            retry = crossing & (proportions < 0.99) & (h*proportions > errorTolerances[a])
+            steps[a[retry]] = h[retry]*proportions[retry]
+            accept &= ~retry
+            onBoundary = crossing & ~retry
+            proportions = np.clip(np.where(onBoundary, proportions, 1.0), 0.0, 1.0)
+            acceptIndexes = a[accept]
+            u[acceptIndexes] = np.clip(u[acceptIndexes] + proportions[accept][:, np.newaxis]*du[accept], 0.0, uMaximums)
+            distances[acceptIndexes] += proportions[accept]*h[accept]
+            errors[acceptIndexes] += errorMagnitudes[accept]
+            # direction turns back where it is normal to surface, where tracks converge and stop
+            tangents = d1[a]*k1[a, 0:1] + d2[a]*k1[a, 1:2]
+            newTangents = nd1*k7[:, 0:1] + nd2*k7[:, 1:2]
+            normal = accept & (np.einsum('tc,tc->t', tangents, newTangents) < 0.0)
+            # first same as last: reuse final stage rates for next step
+            k1[acceptIndexes] = k7[accept]
+            d1[acceptIndexes] = nd1[accept]
+            d2[acceptIndexes] = nd2[accept]
+            finished = (accept & (distances[a] >= trackDistances[a]*(1.0 - 1.0E-12))) | onBoundary
+            for t in a[onBoundary].tolist():
+                print('TrackSurface.trackVectorsAdaptive:  End on boundary at track', t, 'distance', distances[t], 'of', trackDistances[t])
+            stall = accept & ~finished & ~np.any(k7 != 0.0, axis=1)
+            for t in a[stall].tolist():
+                print('TrackSurface.trackVectorsAdaptive. No direction on surface at track', t, 'distance', distances[t], 'of', trackDistances[t])
+            normal &= ~finished
+            for t in a[normal].tolist():
+                print('TrackSurface.trackVectorsAdaptive. Direction normal to surface at track', t, 'distance', distances[t], 'of', trackDistances[t])
+            limit = ~finished & ~normal & (stepsCounts[a] >= maxSteps)
+            for t in a[limit].tolist():
+                print('TrackSurface.trackVectorsAdaptive:  Reach max steps', maxSteps, 'at track', t, 'distance', distances[t], 'of', trackDistances[t])
+            active = a[~(finished | stall | normal | limit)]
+        e1 = np.clip(np.floor(u[:, 0]), 0, self.elementsCount1 - 1).astype(np.int64)
+        e2 = np.clip(np.floor(u[:, 1]), 0, self.elementsCount2 - 1).astype(np.int64)
+        positions = [ TrackSurfacePosition(*values) for values in zip(e1.tolist(), e2.tolist(),
+                      (u[:, 0] - e1).tolist(), (u[:, 1] - e2).tolist()) ]
+        return positions, errors
+
+    def trackVectorAdaptive(self, startPosition, direction, trackDistance, tolerance = 1.0E-6):
+        '''
+        Track from startPosition the given distance in the vector direction by the adaptive
+        Dormand-Prince method; see trackVectorsAdaptive(). Needs fewer surface evaluations than
+        trackVector() for a far more accurate result, and reports its accuracy, but for single
+        tracks numpy overheads make it slower: track many positions at once where possible.
+        :param startPosition: TrackSurfacePosition
+        :param direction: 3-D vector (x, y, z) to track along. Projected onto surface.
+        :param trackDistance: Distance to track along. Can be negative.
+        :param tolerance: Maximum local error estimate for each step, as a fraction of track distance.
+        :return: Final TrackSurfacePosition, estimate of error in its coordinates.
+        '''
+        positions, errors = self.trackVectorsAdaptive([ startPosition ], [ direction ], [ trackDistance ], tolerance)
+        return positions[0], errors[0].item()
+
+    def _updatePositionsToFaceNumbers(self, e1, e2, xi1, xi2, indexes, faceNumbers):
+        '''
+        Update positions in arrays e1, e2, xi1, xi2 at indexes to cross the given face
+        numbers, or clamp to range if reached boundary, as for updatePositionTofaceNumber().
+        :return: Array of bool for each index, True if reached boundary of track surface.
+        '''
+        onBoundary = np.zeros(indexes.size, dtype=bool)
+        for faceNumber, e, xi, eLimit, eIncrement in ((1, e1, xi1, 0, -1), (2, e1, xi1, self.elementsCount1 - 1, 1),
+                                                      (3, e2, xi2, 0, -1), (4, e2, xi2, self.elementsCount2 - 1, 1)):
+            face = faceNumbers == faceNumber
+            faceIndexes = indexes[face]
+            faceOnBoundary = e[faceIndexes] == eLimit
+            crossIndexes = faceIndexes[~faceOnBoundary]
+            e[crossIndexes] += eIncrement
+            xi[crossIndexes] = 1.0 if (eIncrement < 0) else 0.0
+            xi[faceIndexes[faceOnBoundary]] = 0.0 if (eIncrement < 0) else 1.0
+            onBoundary[face] = faceOnBoundary
+        return onBoundary
+
     def updatePositionTofaceNumber(self, position, faceNumber):
         '''
         Update coordinates of TrackSurfacePosition position to cross
@@ -587,3 +943,63 @@ def increment_xi_on_square(xi1, xi2, dxi1, dxi2):
                 nxi2 = 1.0
         #print('  increment to face', faceNumber, 'xi (' + str(xi1) + ',' + str(xi2) + ')', 'nxi (' + str(nxi1) + ',' + str(nxi2) + ')')
     return nxi1, nxi2, proportion, faceNumber
+
+def _getBicubicHermiteWeights(f1, f2):
+    '''
+    :param f1, f2: Cubic Hermite basis functions or their derivatives in xi1 and xi2, each with shape (M, 4).
+    :return: Weights of x, d1 and d2 parameters at 4 element nodes with zero cross derivatives, shape (M, 12).
+    '''
+    fx1 = f1[:, [ 0, 2, 0, 2 ]]
+    fd1 = f1[:, [ 1, 3, 1, 3 ]]
+    fx2 = f2[:, [ 0, 0, 2, 2 ]]
+    fd2 = f2[:, [ 1, 1, 3, 3 ]]
+    return np.concatenate((fx1*fx2, fd1*fx2, fx1*fd2), axis=1)
+
+def calculate_surface_delta_xi_many(d1, d2, direction):
+    '''
+    Calculate dxi1, dxi2 in 3-D vector direction for many points at once, as for
+    calculate_surface_delta_xi().
+    :param d1, d2: Derivatives of coordinate w.r.t. xi1, xi2, each with shape (M, 3).
+    :param direction: 3-D vectors with shape (M, 3).
+    :return: Arrays delta_xi1, delta_xi2
+    '''
+    a00 = np.einsum('mc,mc->m', d1, d1)
+    a01 = np.einsum('mc,mc->m', d1, d2)
+    a11 = np.einsum('mc,mc->m', d2, d2)
+    b0 = np.einsum('mc,mc->m', d1, direction)
+    b1 = np.einsum('mc,mc->m', d2, direction)
+    deta = a00*a11 - a01*a01
+    valid = deta > 0.0
+    useDeta = np.where(valid, deta, 1.0)
+    delta_xi1 = (a11/useDeta)*b0 - (a01/useDeta)*b1
+    delta_xi2 = (a00/useDeta)*b1 - (a01/useDeta)*b0
+    # at pole
+    for i in np.flatnonzero(~valid).tolist():
+        delta_xi1[i], delta_xi2[i] = calculate_surface_delta_xi(d1[i].tolist(), d2[i].tolist(), direction[i].tolist())
+    return delta_xi1, delta_xi2
+
+def increment_xi_on_square_many(xi1, xi2, dxi1, dxi2):
+    '''
+    Increment arrays of xi1, xi2 by dxi1, dxi2 limited to square element bounds on [0,1],
+    as for increment_xi_on_square().
+    :return: Arrays of new xi1, xi2, proportion, face number 1-4 or 0 if within boundary.
+    '''
+    nxi1 = xi1 + dxi1
+    nxi2 = xi2 + dxi2
+    proportion = np.ones(xi1.shape)
+    faceNumber = np.zeros(xi1.shape, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for thisFaceNumber, cross, thisProportion in (
+                (1, (nxi1 < 0.0) & (dxi1 < 0.0), -xi1/dxi1),
+                (2, (nxi1 > 1.0) & (dxi1 > 0.0), (1.0 - xi1)/dxi1),
+                (3, (nxi2 < 0.0) & (dxi2 < 0.0), -xi2/dxi2),
+                (4, (nxi2 > 1.0) & (dxi2 > 0.0), (1.0 - xi2)/dxi2)):
+            nearer = cross & (thisProportion < proportion)
+            proportion = np.where(nearer, thisProportion, proportion)
+            faceNumber = np.where(nearer, thisFaceNumber, faceNumber)
+    face = faceNumber > 0
+    nxi1 = np.where(face, xi1 + proportion*dxi1, nxi1)
+    nxi2 = np.where(face, xi2 + proportion*dxi2, nxi2)
+    nxi1 = np.where(faceNumber == 1, 0.0, np.where(faceNumber == 2, 1.0, nxi1))
+    nxi2 = np.where(faceNumber == 3, 0.0, np.where(faceNumber == 4, 1.0, nxi2))
+    return nxi1, nxi2, proportion, faceNumber
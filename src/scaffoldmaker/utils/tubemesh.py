@@ -4,6 +4,7 @@ using a segment profile.
 '''
 from __future__ import division
 import math
+import numpy as np
 from opencmiss.utils.zinc.field import findOrCreateFieldCoordinates, findOrCreateFieldTextureCoordinates
 from opencmiss.zinc.element import Element
 from opencmiss.zinc.field import Field
@@ -13,6 +14,7 @@ from scaffoldmaker.utils.eftfactory_bicubichermitelinear import eftfactory_bicub
 from scaffoldmaker.utils.eftfactory_tricubichermite import eftfactory_tricubichermite
 from scaffoldmaker.utils.geometry import createCirclePoints
 from scaffoldmaker.utils import interpolation as interp
+from scaffoldmaker.utils import interpolation_np
 from scaffoldmaker.utils import matrix
 from scaffoldmaker.utils import vector
 
@@ -102,7 +104,6 @@ def warpSegmentPoints(xList, d1List, d2List, segmentAxis,
     xWarpedList = []
     d1WarpedList = []
     d2WarpedList = []
-    d2WarpedListFinal = []
     d3WarpedUnitList = []
 
     for nAlongSegment in range(elementsCountAlongSegment + 1):
@@ -212,22 +213,10 @@ def warpSegmentPoints(xList, d1List, d2List, segmentAxis,
             d2 = [factor * c for c in d2WarpedList[n]]
             d2WarpedListScaled.append(d2)
 
-    # Smooth d2 for segment
-    smoothd2Raw = []
-    for n1 in range(elementsCountAround):
-        nx = []
-        nd2 = []
-        for n2 in range(elementsCountAlongSegment + 1):
-            n = n2*elementsCountAround + n1
-            nx.append(xWarpedList[n])
-            nd2.append(d2WarpedListScaled[n])
-        smoothd2 = interp.smoothCubicHermiteDerivativesLine(nx, nd2, fixStartDerivative = True, fixEndDerivative = True)
-        smoothd2Raw.append(smoothd2)
-
-    # Re-arrange smoothd2
-    for n2 in range(elementsCountAlongSegment + 1):
-        for n1 in range(elementsCountAround):
-            d2WarpedListFinal.append(smoothd2Raw[n1][n2])
+    # Smooth d2 for segment, for all lines along at once
+    d2WarpedListFinal = smoothd2AlongColumns(xWarpedList, d2WarpedListScaled, elementsCountAround,
+                                             elementsCountAlongSegment, fixStartDerivative=True,
+                                             fixEndDerivative=True)
 
     # Calculate unit d3
     for n in range(len(xWarpedList)):
@@ -237,6 +226,29 @@ def warpSegmentPoints(xList, d1List, d2List, segmentAxis,
 
     return xWarpedList, d1WarpedList, d2WarpedListFinal, d3WarpedUnitList
 
+def smoothd2AlongColumns(xList, d2List, elementsCountAround, elementsCountAlong,
+                         fixStartDerivative=False, fixEndDerivative=False):
+    """
+    Smooth d2 derivatives along each line of nodes at the same position around a tube,
+    smoothing all lines at once.
+    :param xList: Coordinates of nodes, listed around then along.
+    :param d2List: Derivatives along tube of nodes, listed around then along.
+    :param elementsCountAround: Number of elements around tube.
+    :param elementsCountAlong: Number of elements along tube.
+    :param fixStartDerivative, fixEndDerivative: As for smoothCubicHermiteDerivativesLine.
+    :return: Smoothed d2 derivatives, listed around then along.
+    """
+    nodesCountAlong = elementsCountAlong + 1
+    # pack lines along one after another
+    x = np.asarray(xList, dtype=np.float64).reshape(nodesCountAlong, elementsCountAround, -1).transpose(1, 0, 2)
+    d2 = np.asarray(d2List, dtype=np.float64).reshape(nodesCountAlong, elementsCountAround, -1).transpose(1, 0, 2)
+    offsets = interpolation_np.getPackedOffsets([nodesCountAlong]*elementsCountAround)
+    smoothd2, _ = interpolation_np.smoothCubicHermiteDerivativesLinesPacked(
+        x.reshape(-1, x.shape[2]), d2.reshape(-1, d2.shape[2]), offsets,
+        fixStartDerivative=fixStartDerivative, fixEndDerivative=fixEndDerivative)
+    # re-arrange to list around then along
+    return smoothd2.reshape(elementsCountAround, nodesCountAlong, -1).transpose(1, 0, 2).reshape(-1, d2.shape[2]).tolist()
+
 def getCoordinatesFromInner(xInner, d1Inner, d2Inner, d3Inner,
     wallThicknessList, elementsCountAround,
     elementsCountAlong, elementsCountThroughWall, transitElementList):
@@ -763,7 +775,6 @@ def getCylindricalSegmentInnerPoints(elementsCountAround, elementsCountAlongSegm
 
     xFinal = []
     d1Final = []
-    d2Final = []
     xiList = []
     flatWidthList = []
     sRadiusAlongSegment = []
@@ -781,26 +792,14 @@ def getCylindricalSegmentInnerPoints(elementsCountAround, elementsCountAlongSegm
         xFinal = xFinal + xLoop
         d1Final = d1Final + d1Loop
 
-    # Smooth d2 for segment
-    smoothd2Raw = []
-    for n1 in range(elementsCountAround):
-        nx = []
-        nd2 = []
-        for n2 in range(elementsCountAlongSegment + 1):
-            n = n2 * elementsCountAround + n1
-            nx.append(xFinal[n])
-            nd2.append(segmentAxis)
-        smoothd2 = interp.smoothCubicHermiteDerivativesLine(nx, nd2)
-        smoothd2Raw.append(smoothd2)
-
-    # Re-arrange smoothd2
+    # Smooth d2 for segment, for all lines along at once
+    d2Final = smoothd2AlongColumns(xFinal, [segmentAxis]*len(xFinal), elementsCountAround, elementsCountAlongSegment)
+
     for n2 in range(elementsCountAlongSegment + 1):
         radius = sRadiusAlongSegment[n2]
         flatWidth = 2.0*math.pi*(radius + wallThickness)
         flatWidthList.append(flatWidth)
         xiFace = []
-        for n1 in range(elementsCountAround):
-            d2Final.append(smoothd2Raw[n1][n2])
         for n1 in range(elementsCountAround + 1):
             xi = 1.0/elementsCountAround * n1
             xiFace.append(xi)
@@ -2,6 +2,7 @@
 Utility functions for easing use of Zinc API.
 '''
 
+import numpy as np
 from opencmiss.utils.zinc.field import findOrCreateFieldCoordinates
 from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.context import Context
@@ -403,6 +404,112 @@ def extract_node_field_parameters(nodeset, field, only_value_labels=None):
     return valueLabels, fieldParameters
 
 
+def extract_node_field_parameters_array(nodeset, field, only_value_labels=None):
+    '''
+    Returns parameters of field from nodes in nodeset in identifier order as a dense array,
+    suited to vectorised processing and comparison of models.
+    Assumes all components have the same labels and versions.
+    :param nodeset: Zinc Nodeset or NodesetGroup to extract from.
+    :param field: Finite element field to extract parameters of.
+    :param only_value_labels: Optional list of node value labels to extract, all of which are returned
+    even if not defined at any node. By default, all value labels defined at any node are returned.
+    :return: list of valueLabels returned, int64 array of identifiers of nodes field is defined at with
+    shape (nodesCount,), float64 array of parameters with shape (nodesCount, valueLabelsCount, versionsCount,
+    componentsCount), bool array with shape (nodesCount, valueLabelsCount, versionsCount) which is True
+    where parameters are defined; undefined parameters are zero. versionsCount is the maximum number of
+    versions of any value label at any node.
+    '''
+    fieldmodule = nodeset.getFieldmodule()
+    componentsCount = field.getNumberOfComponents()
+    fieldcache = fieldmodule.createFieldcache()
+    valueLabels = list(only_value_labels) if only_value_labels else \
+        [ Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2, Node.VALUE_LABEL_D2_DS1DS2, Node.VALUE_LABEL_D_DS3, Node.VALUE_LABEL_D2_DS1DS3, Node.VALUE_LABEL_D2_DS2DS3, Node.VALUE_LABEL_D3_DS1DS2DS3 ]
+    valueLabelsCount = len(valueLabels)
+    nodeIdentifiers = []
+    # flat lists of node index, value label index, version index and parameters for each set of parameters
+    nodeIndexes = []
+    valueLabelIndexes = []
+    versionIndexes = []
+    parameters = []
+    nodeIter = nodeset.createNodeiterator()
+    node = nodeIter.next()
+    while node.isValid():
+        fieldcache.setNode(node)
+        nodeIndex = len(nodeIdentifiers)
+        fieldDefinedAtNode = False
+        for i in range(valueLabelsCount):
+            version = 1
+            while True:
+                result, x = field.getNodeParameters(fieldcache, -1, valueLabels[i], version, componentsCount)
+                if result != RESULT_OK:
+                    break
+                fieldDefinedAtNode = True
+                nodeIndexes.append(nodeIndex)
+                valueLabelIndexes.append(i)
+                versionIndexes.append(version - 1)
+                parameters.append(x)
+                version += 1
+        if fieldDefinedAtNode:
+            nodeIdentifiers.append(node.getIdentifier())
+        node = nodeIter.next()
+    nodeIndexes = np.array(nodeIndexes, dtype=np.int64)
+    valueLabelIndexes = np.array(valueLabelIndexes, dtype=np.int64)
+    versionIndexes = np.array(versionIndexes, dtype=np.int64)
+    versionsCount = (np.max(versionIndexes) + 1) if versionIndexes.size else 0
+    nodeParameters = np.zeros((len(nodeIdentifiers), valueLabelsCount, versionsCount, componentsCount), dtype=np.float64)
+    mask = np.zeros((len(nodeIdentifiers), valueLabelsCount, versionsCount), dtype=bool)
+    nodeParameters[nodeIndexes, valueLabelIndexes, versionIndexes] = np.array(parameters, dtype=np.float64).reshape(-1, componentsCount)
+    mask[nodeIndexes, valueLabelIndexes, versionIndexes] = True
+    if not only_value_labels:
+        valueLabelsUsed = np.any(mask, axis=(0, 2))
+        valueLabels = [ valueLabel for valueLabel, used in zip(valueLabels, valueLabelsUsed) if used ]
+        nodeParameters = nodeParameters[:, valueLabelsUsed]
+        mask = mask[:, valueLabelsUsed]
+    return valueLabels, np.array(nodeIdentifiers, dtype=np.int64), nodeParameters, mask
+
+
+def set_node_field_parameters_array(nodeset, field, value_labels, node_identifiers, node_parameters, mask=None):
+    '''
+    Set parameters of field at nodes from dense array, the inverse of extract_node_field_parameters_array.
+    Parameters must already be defined at the nodes; changes are cached until the end.
+    :param nodeset: Zinc Nodeset or NodesetGroup containing nodes.
+    :param field: Finite element field to set parameters of.
+    :param value_labels: List of node value labels for second axis of node_parameters.
+    :param node_identifiers: Array-like of identifiers of nodes for first axis of node_parameters.
+    :param node_parameters: Array-like of parameters with shape (nodesCount, valueLabelsCount, versionsCount, componentsCount).
+    :param mask: Optional bool array with shape (nodesCount, valueLabelsCount, versionsCount), True for
+    parameters to set. By default all parameters are set.
+    :return: Number of nodes set.
+    '''
+    fieldmodule = nodeset.getFieldmodule()
+    componentsCount = field.getNumberOfComponents()
+    node_identifiers = np.asarray(node_identifiers, dtype=np.int64)
+    node_parameters = np.asarray(node_parameters, dtype=np.float64)
+    assert (node_parameters.ndim == 4) and (node_parameters.shape[0] == node_identifiers.size) and \
+        (node_parameters.shape[1] == len(value_labels)) and (node_parameters.shape[3] == componentsCount), \
+        'set_node_field_parameters_array.  Invalid shape of node parameters'
+    if mask is None:
+        mask = np.ones(node_parameters.shape[:3], dtype=bool)
+    else:
+        mask = np.asarray(mask, dtype=bool)
+        assert mask.shape == node_parameters.shape[:3], 'set_node_field_parameters_array.  Invalid shape of mask'
+    fieldcache = fieldmodule.createFieldcache()
+    nodesSet = 0
+    with ChangeManager(fieldmodule):
+        for nodeIdentifier, parameters, nodeMask in zip(node_identifiers.tolist(), node_parameters, mask):
+            node = nodeset.findNodeByIdentifier(nodeIdentifier)
+            if not node.isValid():
+                print('set_node_field_parameters_array.  Missing node', nodeIdentifier)
+                continue
+            fieldcache.setNode(node)
+            for i, version in zip(*np.nonzero(nodeMask)):
+                result = field.setNodeParameters(fieldcache, -1, value_labels[i], int(version) + 1, parameters[i, version].tolist())
+                if result != RESULT_OK:
+                    print('set_node_field_parameters_array.  Failed to set parameters at node', nodeIdentifier)
+            nodesSet += 1
+    return nodesSet
+
+
 def parameter_lists_to_string(valuesList, format_string):
     '''
     :return: 'None' if values is an empty list, the values in the first item if only one, otherwise the lists of values.
@@ -0,0 +1,52 @@
+'''
+Benchmark of sampleCubicHermiteCurves() on the default colon central paths, locating
+sample points by Newton iteration on arc length per point (default) or all at once
+with a CubicHermiteArcLengthTable. Accuracy is the range of sample point spacings,
+measured along the curves with a fine arc length table; ideal spacing is uniform.
+Usage: python benchmark_arclength.py [elementsCountOut ...]
+'''
+from __future__ import division
+import sys
+import time
+import numpy as np
+from opencmiss.zinc.context import Context
+from opencmiss.zinc.node import Node
+from scaffoldmaker.meshtypes.meshtype_1d_path1 import extractPathParametersFromRegion
+from scaffoldmaker.meshtypes.meshtype_3d_colon1 import MeshType_3d_colon1
+from scaffoldmaker.utils.interpolation import sampleCubicHermiteCurves
+from scaffoldmaker.utils.interpolation_np import CubicHermiteArcLengthTable
+
+
+def benchmarkSample(cx, cd1, elementsCountOut, arcLengthTable, repeatsCount=3):
+    '''
+    :return: Best time in seconds, sample element indexes and xi.
+    '''
+    bestTime = None
+    for r in range(repeatsCount):
+        startTime = time.perf_counter()
+        px, pd1, pe, pxi, psf = sampleCubicHermiteCurves(cx, cd1, elementsCountOut, arcLengthTable=arcLengthTable)
+        elapsed = time.perf_counter() - startTime
+        bestTime = elapsed if (bestTime is None) else min(bestTime, elapsed)
+    return bestTime, pe, pxi
+
+
+def main(elementsCountsOut):
+    context = Context('benchmark')
+    print('central path', 'elements in', 'elements out', 'default', 'table', 'speedup',
+          'default spacing range', 'table spacing range', sep='\t')
+    for name, centralPath in MeshType_3d_colon1.centralPathDefaultScaffoldPackages.items():
+        region = context.createRegion()
+        centralPath.generate(region)
+        cx, cd1 = extractPathParametersFromRegion(region, [ Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1 ])
+        fineTable = CubicHermiteArcLengthTable(cx, cd1, segmentsCount=256)
+        for elementsCountOut in elementsCountsOut:
+            defaultTime, pe, pxi = benchmarkSample(cx, cd1, elementsCountOut, arcLengthTable=False)
+            tableTime, tpe, tpxi = benchmarkSample(cx, cd1, elementsCountOut, arcLengthTable=True)
+            spacingRange = np.ptp(np.diff(fineTable.getDistances(pe, pxi)))
+            tableSpacingRange = np.ptp(np.diff(fineTable.getDistances(tpe, tpxi)))
+            print(name, len(cx) - 1, elementsCountOut, '%.4f s' % defaultTime, '%.4f s' % tableTime,
+                  '%.1f' % (defaultTime/tableTime), '%.3g' % spacingRange, '%.3g' % tableSpacingRange, sep='\t')
+
+
+if __name__ == "__main__":
+    main([ int(arg) for arg in sys.argv[1:] ] if len(sys.argv) > 1 else [ 40, 160, 640 ])
@@ -0,0 +1,192 @@
+'''
+Benchmark of Octree against the legacy recursive octree it replaced, for the
+find-then-add pattern used by MeshRefinement, and for batch find and add.
+Usage: python benchmark_octree.py [pointsCount ...]
+Default point counts are 10000 100000 1000000; the legacy octree at 1000000
+points takes several minutes.
+'''
+from __future__ import division
+import copy
+import math
+import sys
+import time
+import numpy as np
+from scaffoldmaker.utils.octree import Octree
+
+
+class LegacyOctree:
+    '''
+    Recursive octree as previously in scaffoldmaker.utils.octree.
+    '''
+
+    def __init__(self, minimums, maximums, tolerance = None):
+        '''
+        :param minimums: List of 3 minimum coordinate values. Caller to include any edge allowance.
+        :param maximums: List of 3 maximum coordinate values. Caller to include any edge allowance.
+        :param tolerance: If supplied, tolerance to use, or None to compute as 1.0E-6*diagonal.
+        '''
+        self._dimension = 3
+        self._dimensionPower2 = 1 << self._dimension
+        self._maxObjects = 20
+        assert len(minimums) == self._dimension, 'Octree minimums is invalid length'
+        assert len(maximums) == self._dimension, 'Octree maximums is invalid length'
+        if tolerance is None:
+            self._tolerance = 1.0E-6*math.sqrt(sum(((maximums[i] - minimums[i])*(maximums[i] - minimums[i])) for i in range(self._dimension)))
+        else:
+            self._tolerance = tolerance
+        self._minimums = copy.deepcopy(minimums)
+        self._maximums = copy.deepcopy(maximums)
+        # Octree is either leaf with _coordinatesObjects, or has 2**self._dimension children
+        self._coordinatesObjects = []
+        # exactly 2^self._dimension children, cycling in lowest x index fastest
+        self._children = None
+
+
+    def _findObjectByCoordinates(self, x):
+        '''
+        Find closest existing object with |x - ox| < tolerance.
+        :param x: 3 coordinates in a list.
+        :return: nearest distance, nearest object or None, None if none found.
+        '''
+        nearestDistance = None
+        nearestObject = None
+        if self._coordinatesObjects is not None:
+            for coordinatesObject in self._coordinatesObjects:
+                # cheaply determine if in 2*tolerance sized box around object
+                inBox = True
+                for c in range(self._dimension):
+                    if math.fabs(x[c] - coordinatesObject[0][c]) > self._tolerance:
+                        inBox = False
+                        break
+                if inBox:
+                    # now test exact distance
+                    distance = math.sqrt(sum((x[i] - coordinatesObject[0][i])*(x[i] - coordinatesObject[0][i]) for i in range(self._dimension)))
+                    if (distance < self._tolerance) and ((nearestDistance is None) or (distance < nearestDistance)):
+                        nearestDistance = distance
+                        nearestObject = coordinatesObject[1]
+        else:
+            centre = self._children[0]._maximums
+            for i in range(self._dimensionPower2):
+                inBoundsPlusTolerance = True
+                for c in range(self._dimension):
+                    if i & (1 << c):
+                        if x[c] < (centre[c] - self._tolerance):
+                            inBoundsPlusTolerance = False
+                            break
+                    elif x[c] > (centre[c] + self._tolerance):
+                        inBoundsPlusTolerance = False
+                        break
+                if inBoundsPlusTolerance:
+                    distance, obj = self._children[i]._findObjectByCoordinates(x)
+                    if (distance is not None) and ((nearestDistance is None) or (distance < nearestDistance)):
+                        nearestDistance = distance
+                        nearestObject = obj
+        return nearestDistance, nearestObject
+
+
+    def findObjectByCoordinates(self, x):
+        '''
+        Find closest existing object with |x - ox| < tolerance.
+        :param x: 3 coordinates in a list.
+        :return: nearest object or None if not found.
+        '''
+        nearestDistance, nearestObject = self._findObjectByCoordinates(x)
+        return nearestObject
+
+
+    def addObjectAtCoordinates(self, x, obj):
+        '''
+        Add object at coordianates to octree.
+        Caller must have received None result for findObjectByCoordinates() first!
+        Assumes caller has verified x is within range of Octree.
+        :param x: 3 coordinates in a list.
+        :param obj: object to store with coordinates.
+        '''
+        if self._coordinatesObjects is not None:
+            if len(self._coordinatesObjects) < self._maxObjects:
+                self._coordinatesObjects.append( (copy.deepcopy(x), obj) )
+                return
+            else:
+                # subdivide and add coordinatesObjects plus new object to new children
+                coordinatesObjects = self._coordinatesObjects
+                self._coordinatesObjects = None
+                self._children = []
+                for i in range(self._dimensionPower2):
+                    childMinimums = copy.deepcopy(self._minimums)
+                    childMaximums = copy.deepcopy(self._maximums)
+                    for c in range(self._dimension):
+                        if i & (1 << c):
+                            childMinimums[c] = 0.5*(self._minimums[c] + self._maximums[c])
+                        else:
+                            childMaximums[c] = 0.5*(self._minimums[c] + self._maximums[c])
+                    child = LegacyOctree(childMinimums, childMaximums, self._tolerance)
+                    self._children.append(child)
+                # add coordinatesObjects to children
+                for coordinatesObject in coordinatesObjects:
+                    self.addObjectAtCoordinates(coordinatesObject[0], coordinatesObject[1])
+        # add the new object to the first child it fits in, using efficient octree search
+        i = 0
+        centre = self._children[0]._maximums
+        for c in range(self._dimension):
+            if x[c] > centre[c]:
+                i += 1 << c
+        self._children[i].addObjectAtCoordinates(x, obj)
+
+
+def makePoints(pointsCount):
+    '''
+    :return: Coordinates of a regular grid of about pointsCount/2 points with each
+    point repeated with a small perturbation, in shuffled order, as for nodes
+    shared between refined elements.
+    '''
+    gridCount = max(2, round((pointsCount/2)**(1.0/3.0)))
+    grid = np.linspace(0.0, 1.0, gridCount)
+    gx, gy, gz = np.meshgrid(grid, grid, grid, indexing='ij')
+    x = np.stack([ gx.ravel(), gy.ravel(), gz.ravel() ], axis=1)
+    rng = np.random.default_rng(0)
+    x = np.vstack([ x, x + rng.uniform(-1.0E-8, 1.0E-8, x.shape) ])
+    return x[rng.permutation(x.shape[0])[:pointsCount]]
+
+
+def benchmarkFindAdd(octree, x):
+    xList = x.tolist()
+    startTime = time.perf_counter()
+    uniqueCount = 0
+    for px in xList:
+        if octree.findObjectByCoordinates(px) is None:
+            octree.addObjectAtCoordinates(px, uniqueCount)
+            uniqueCount += 1
+    return time.perf_counter() - startTime, uniqueCount
+
+
+def benchmarkBatch(octree, x):
+    startTime = time.perf_counter()
+    # add points in cell order so duplicates are consecutive and easily removed
+    keys = octree._getKeys(octree._getCellIndexes(x))
+    order = np.argsort(keys, kind='stable')
+    # unique points are those not within tolerance of an earlier point
+    sx = x[order]
+    distances = np.sqrt(np.sum(np.square(sx[1:] - sx[:-1]), axis=1))
+    uniqueIndexes = order[np.r_[True, distances >= octree._tolerance]]
+    octree.addObjectsAtCoordinates(x[uniqueIndexes], list(range(len(uniqueIndexes))))
+    found = octree.findObjectsByCoordinates(x)
+    elapsed = time.perf_counter() - startTime
+    assert all(obj is not None for obj in found)
+    return elapsed, len(uniqueIndexes)
+
+
+def main(pointsCounts):
+    minimums = [ -0.5, -0.5, -0.5 ]
+    maximums = [ 1.5, 1.5, 1.5 ]
+    print('points', 'legacy find-add', 'find-add', 'batch', sep='\t')
+    for pointsCount in pointsCounts:
+        x = makePoints(pointsCount)
+        legacyTime, legacyUniqueCount = benchmarkFindAdd(LegacyOctree(minimums, maximums), x)
+        newTime, newUniqueCount = benchmarkFindAdd(Octree(minimums, maximums), x)
+        batchTime, batchUniqueCount = benchmarkBatch(Octree(minimums, maximums), x)
+        assert legacyUniqueCount == newUniqueCount == batchUniqueCount
+        print(pointsCount, '%.3f s' % legacyTime, '%.3f s' % newTime, '%.3f s' % batchTime, sep='\t')
+
+
+if __name__ == "__main__":
+    main([ int(arg) for arg in sys.argv[1:] ] if len(sys.argv) > 1 else [ 10000, 100000, 1000000 ])
@@ -0,0 +1,42 @@
+'''
+Benchmark of time to import the scaffold type registry and get scaffold types,
+each measured in a fresh interpreter so no modules are already imported.
+Scaffold type modules are imported on first use, so getting all scaffold types
+costs what importing scaffoldmaker.scaffolds cost when it imported them all.
+Usage: python benchmark_scaffolds_import.py [repeatsCount]
+'''
+import subprocess
+import sys
+
+
+statements = [
+    ('import registry', 'pass'),
+    ('find 3D Box 1', 'Scaffolds().findScaffoldTypeByName("3D Box 1")'),
+    ('find 3D Tube 1', 'Scaffolds().findScaffoldTypeByName("3D Tube 1")'),
+    ('get all scaffold types', 'Scaffolds().getScaffoldTypes()'),
+    ]
+
+
+def timeStatement(statement):
+    '''
+    :return: Wall time in seconds to import Scaffolds and run statement in a new process.
+    '''
+    code = '\n'.join([
+        'import time',
+        'startTime = time.perf_counter()',
+        'from scaffoldmaker.scaffolds import Scaffolds',
+        statement,
+        'print(time.perf_counter() - startTime)'])
+    output = subprocess.run([ sys.executable, '-c', code ], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return float(output.split()[-1])
+
+
+def main(repeatsCount):
+    print('statement', 'best of %d' % repeatsCount, sep='\t')
+    for name, statement in statements:
+        bestTime = min(timeStatement(statement) for r in range(repeatsCount))
+        print(name, '%.3f s' % bestTime, sep='\t')
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,20 +1,36 @@
+import io
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from opencmiss.utils.maths.vectorops import magnitude
 from opencmiss.utils.zinc.finiteelement import evaluateFieldNodesetRange, findNodeWithName
 from opencmiss.zinc.context import Context
+from opencmiss.zinc.element import Element
 from opencmiss.zinc.field import Field
 from opencmiss.zinc.node import Node
 from opencmiss.zinc.result import RESULT_OK
 from scaffoldmaker.annotation.annotationgroup import AnnotationGroup
+from scaffoldmaker.meshtypes.meshtype_1d_path1 import MeshType_1d_path1
 from scaffoldmaker.meshtypes.meshtype_3d_box1 import MeshType_3d_box1
 from scaffoldmaker.meshtypes.meshtype_3d_heartatria1 import MeshType_3d_heartatria1
+from scaffoldmaker.scaffoldcache import ScaffoldCache
 from scaffoldmaker.scaffoldpackage import ScaffoldPackage
-from scaffoldmaker.scaffolds import Scaffolds
+from scaffoldmaker.scaffolds import Scaffolds, Scaffolds_decodeJSON, Scaffolds_JSONEncoder
+from scaffoldmaker.utils import interpolation
+from scaffoldmaker.utils.derivativemoothing import DerivativeSmoothing
+from scaffoldmaker.utils.exportvtk import ExportVtk
+from scaffoldmaker.utils.generationprofile import GenerationProfile
+from scaffoldmaker.utils.interpolation import DerivativeScalingMode
 from testutils import assertAlmostEqualList
 
-from scaffoldmaker.utils.zinc_utils import identifier_ranges_from_string, identifier_ranges_to_string, \
+from scaffoldmaker.utils.zinc_utils import extract_node_field_parameters, extract_node_field_parameters_array, \
+    identifier_ranges_from_string, identifier_ranges_to_string, \
     mesh_group_add_identifier_ranges, mesh_group_to_identifier_ranges, \
-    nodeset_group_add_identifier_ranges, nodeset_group_to_identifier_ranges
+    nodeset_group_add_identifier_ranges, nodeset_group_to_identifier_ranges, set_node_field_parameters_array
 
 
 class GeneralScaffoldTestCase(unittest.TestCase):
@@ -192,6 +208,567 @@ class GeneralScaffoldTestCase(unittest.TestCase):
         identifier_ranges_string = identifier_ranges_to_string(nodeset_group_to_identifier_ranges(nodesetGroup2))
         self.assertEqual('1,3-5,7', identifier_ranges_string)
 
+    def test_scaffold_cache(self):
+        """
+        Test generating heartatria1 scaffold from scaffold cache gives the same model.
+        """
+        cache = ScaffoldCache(maxMemoryEntries=1)
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_heartatria1)
+        key = cache.getKey(scaffoldPackage)
+        # transformation does not affect key
+        scaffoldPackage.setScale([ 2.0, 2.0, 2.0 ])
+        self.assertEqual(key, cache.getKey(scaffoldPackage))
+
+        results = []
+        for i in range(2):
+            context = Context("Test")
+            region = context.getDefaultRegion()
+            scaffoldPackage.generate(region, cache=cache)
+            fieldmodule = region.getFieldmodule()
+            nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            mesh3d = fieldmodule.findMeshByDimension(3)
+            coordinates = fieldmodule.findFieldByName("coordinates").castFiniteElement()
+            minimums, maximums = evaluateFieldNodesetRange(coordinates, nodes)
+            annotationGroups = scaffoldPackage.getAnnotationGroups()
+            groupSizes = [ (annotationGroup.getName(), annotationGroup.getMeshGroup(mesh3d).getSize())
+                for annotationGroup in annotationGroups ]
+            results.append((nodes.getSize(), mesh3d.getSize(), minimums, maximums, groupSizes))
+        statistics = cache.getStatistics()
+        self.assertEqual(1, statistics['hits'])
+        self.assertEqual(1, statistics['misses'])
+        self.assertEqual(results[0][0:2], results[1][0:2])
+        assertAlmostEqualList(self, results[0][2], results[1][2], delta=1.0E-12)
+        assertAlmostEqualList(self, results[0][3], results[1][3], delta=1.0E-12)
+        self.assertEqual(results[0][4], results[1][4])
+
+        # different settings miss and evict the only entry
+        scaffoldPackage2 = ScaffoldPackage(MeshType_3d_box1)
+        self.assertNotEqual(key, cache.getKey(scaffoldPackage2))
+        context = Context("Test")
+        scaffoldPackage2.generate(context.getDefaultRegion(), cache=cache)
+        statistics = cache.getStatistics()
+        self.assertEqual(2, statistics['misses'])
+        self.assertEqual(1, statistics['evictions'])
+        self.assertEqual(1, statistics['memory entries'])
+
+    def test_generate_batch(self):
+        """
+        Test parallel batch generation of scaffolds with failure isolation.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1)
+        scaffoldPackage2 = ScaffoldPackage(MeshType_3d_box1, { 'scaffoldSettings': { 'Number of elements 1': 2 } })
+        badDict = { 'scaffoldTypeName': 'not a scaffold' }
+        results = Scaffolds().generateBatch([ scaffoldPackage, badDict, scaffoldPackage2 ], workers=2)
+        self.assertEqual(3, len(results))
+        self.assertIsNone(results[0]['error'])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertIsNone(results[1]['model'])
+        self.assertIsNone(results[2]['error'])
+        for result, expectedNodesCount in ((results[0], 8), (results[2], 12)):
+            self.assertTrue(result['time'] > 0.0)
+            if sys.platform.startswith('linux'):
+                # peak is reset for each item in reused worker processes
+                self.assertGreater(result['peakRss'], 0)
+            context = Context("Test")
+            region = context.getDefaultRegion()
+            sir = region.createStreaminformationRegion()
+            sir.createStreamresourceMemoryBuffer(result['model'])
+            self.assertEqual(RESULT_OK, region.read(sir))
+            nodes = region.getFieldmodule().findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            self.assertEqual(expectedNodesCount, nodes.getSize())
+
+    def test_generation_cache(self):
+        """
+        Test regeneration with generation cache only re-runs stages affected by changed options.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1)
+        self.assertFalse(scaffoldPackage.isGenerationCacheEnabled())
+        scaffoldPackage.setGenerationCacheEnabled(True)
+        self.assertTrue(scaffoldPackage.isGenerationCacheEnabled())
+        self.assertEqual('base', MeshType_3d_box1.getOptionGenerationStage('Number of elements 1'))
+        self.assertEqual('refine', MeshType_3d_box1.getOptionGenerationStage('Refine number of elements 1'))
+        settings = scaffoldPackage.getScaffoldSettings()
+        generationCache = scaffoldPackage._generationCache
+        for optionName, value, expectedNodesCount, expectedElementsCount, expectedRunCounts in (
+                (None, None, 8, 1, (1, 0, 1)),
+                (None, None, 8, 1, (1, 0, 1)),
+                ('Refine', True, 8, 1, (1, 1, 2)),
+                ('Refine number of elements 1', 2, 12, 2, (1, 2, 3)),
+                ('Refine number of elements 2', 3, 24, 6, (1, 3, 4)),
+                ('Number of elements 3', 2, 36, 12, (2, 4, 5)),
+                ('Refine', False, 12, 2, (2, 4, 6)),
+                ('Refine', True, 36, 12, (2, 4, 7))):
+            if optionName:
+                settings[optionName] = value
+            context = Context("Test")
+            region = context.getDefaultRegion()
+            scaffoldPackage.generate(region)
+            fieldmodule = region.getFieldmodule()
+            nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            self.assertEqual(expectedNodesCount, nodes.getSize())
+            mesh3d = fieldmodule.findMeshByDimension(3)
+            self.assertEqual(expectedElementsCount, mesh3d.getSize())
+            runCounts = generationCache.getStageRunCounts()
+            self.assertEqual(expectedRunCounts, (runCounts['base'], runCounts['refine'], runCounts['final']))
+
+    def test_generation_profile(self):
+        """
+        Test profiling of stages of scaffold generation.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+            'scaffoldSettings': {
+                'Refine': True,
+                'Refine number of elements 1': 2,
+                'Refine number of elements 2': 2,
+                'Refine number of elements 3': 2
+            }
+        })
+        logFile = io.StringIO()
+        profile = GenerationProfile(traceMemory=True, logFile=logFile)
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region, profile=profile)
+        records = profile.getRecords()
+        stageNames = [ record['stage'] for record in records ]
+        self.assertEqual([ 'generateBaseMesh', 'refineMesh', 'defineAllFaces', 'addSubelements', 'defineFaceAnnotations',
+            'generateMesh', 'userAnnotationGroups', 'applyTransformation', 'generate' ], stageNames)
+        record = profile.getStageRecord('generateBaseMesh')
+        self.assertEqual(2, record['depth'])
+        self.assertEqual(8, record['nodes'])
+        self.assertEqual(1, record['elements3d'])
+        self.assertEqual(0, record['elements2d'])
+        record = profile.getStageRecord('refineMesh')
+        self.assertEqual(27, record['nodes'])
+        self.assertEqual(8, record['elements3d'])
+        self.assertEqual(0, record['elements2d'])
+        record = profile.getStageRecord('defineAllFaces')
+        self.assertEqual(36, record['elements2d'])
+        self.assertEqual(54, record['elements1d'])
+        record = profile.getStageRecord('generate')
+        self.assertEqual(0, record['depth'])
+        self.assertNotIn('nodes', profile.getStageRecord('applyTransformation'))
+        for record in records:
+            self.assertGreaterEqual(record['wallTime'], 0.0)
+            self.assertGreaterEqual(record['cpuTime'], 0.0)
+            self.assertGreaterEqual(record['memoryPeak'], 0)
+        self.assertGreaterEqual(profile.getStageRecord('generate')['memoryPeak'],
+                                profile.getStageRecord('generateMesh')['memoryPeak'])
+        logRecords = [ json.loads(line) for line in logFile.getvalue().splitlines() ]
+        self.assertEqual(records, logRecords)
+        # report lists stages in order started, indented by depth
+        reportLines = str(profile).splitlines()
+        self.assertEqual(len(records) + 1, len(reportLines))
+        self.assertTrue(reportLines[1].startswith('generate '))
+        self.assertTrue(reportLines[2].startswith('  generateMesh '))
+        self.assertTrue(reportLines[3].startswith('    generateBaseMesh '))
+        profile.clear()
+        self.assertEqual([], profile.getRecords())
+
+    def test_derivative_smoothing_result(self):
+        """
+        Test convergence results, progress callback and time limit of derivative smoothing.
+        """
+        for stopEarly in (None, 'callback', 'timeLimit'):
+            context = Context("Test")
+            region = context.getDefaultRegion()
+            scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+                'scaffoldSettings': {
+                    'Number of elements 1': 2,
+                    'Number of elements 2': 2,
+                    'Number of elements 3': 2
+                }
+            })
+            scaffoldPackage.generate(region)
+            fieldmodule = region.getFieldmodule()
+            coordinates = fieldmodule.findFieldByName("coordinates").castFiniteElement()
+            nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            # move centre node so derivatives need smoothing
+            fieldcache = fieldmodule.createFieldcache()
+            fieldcache.setNode(nodes.findNodeByIdentifier(14))
+            self.assertEqual(RESULT_OK, coordinates.setNodeParameters(fieldcache, -1, Node.VALUE_LABEL_VALUE, 1, [ 0.6, 0.5, 0.5 ]))
+            smoothing = DerivativeSmoothing(region, coordinates)
+            progress = []
+
+            def progressCallback(iteration, residual):
+                progress.append((iteration, residual))
+                return (stopEarly == 'callback') and (iteration == 1)
+
+            result = smoothing.smooth(updateDirections=True, maxIterations=50, progressCallback=progressCallback,
+                                      timeLimit=0.0 if (stopEarly == 'timeLimit') else None)
+            self.assertEqual(54, result['edgesCount'])
+            self.assertEqual(81, result['derivativesCount'])
+            residuals = result['residuals']
+            self.assertEqual(result['iterations'] + 1, len(residuals))
+            self.assertEqual(1.0, residuals[0])
+            self.assertEqual(len(progress), len(residuals))
+            self.assertEqual([ (iteration, residual) for iteration, residual in enumerate(residuals) ], progress)
+            self.assertEqual(result['iterations'], result['bestIteration'])
+            for key in ('setupTime', 'iterationTime', 'storeTime', 'wallTime'):
+                self.assertGreaterEqual(result[key], 0.0)
+            self.assertLessEqual(result['setupTime'] + result['iterationTime'] + result['storeTime'], result['wallTime'] + 1.0E-9)
+            if stopEarly:
+                self.assertFalse(result['converged'])
+                self.assertEqual(stopEarly, result['stopReason'])
+                self.assertEqual(1 if (stopEarly == 'callback') else 0, result['iterations'])
+            else:
+                self.assertTrue(result['converged'])
+                self.assertEqual('converged', result['stopReason'])
+                self.assertLess(residuals[-1], 1.0E-6)
+                self.assertLess(result['iterations'], 50)
+
+    def test_derivative_smoothing_values(self):
+        """
+        Test smoothed derivatives match values from the previous per-edge implementation,
+        and use adaptive arc lengths if an arc length tolerance is set.
+        """
+        # node identifier, value label, expected for updateDirections False, True
+        expectedArithmeticMean = [
+            (14, Node.VALUE_LABEL_D_DS1, [ 0.5, 0.0, 0.0 ], [ 0.5, 0.0, 0.0 ]),
+            (14, Node.VALUE_LABEL_D_DS2, [ 0.0, 0.5118815830634955, 0.0 ], [ 0.0, 0.5131277781292629, 0.0 ]),
+            (15, Node.VALUE_LABEL_D_DS1, [ 0.3, 0.0, 0.0 ], [ 0.3, 0.0, 0.0 ]),
+            (5, Node.VALUE_LABEL_D_DS3, [ 0.0, 0.0, 0.5118820956272359 ], [ 0.19497580062989403, 0.0, 0.474641506318512 ]),
+            (17, Node.VALUE_LABEL_D_DS2, [ 0.0, 0.5118820956272361, 0.0 ], [ -0.19497580062989414, 0.4746415063185122, 0.0 ])
+        ]
+        expectedHarmonicMean = [
+            (14, Node.VALUE_LABEL_D_DS1, [ 0.48, 0.0, 0.0 ], [ 0.48, 0.0, 0.0 ]),
+            (14, Node.VALUE_LABEL_D_DS2, [ 0.0, 0.5118815830634955, 0.0 ], [ 0.0, 0.513127778129263, 0.0 ]),
+            (15, Node.VALUE_LABEL_D_DS1, [ 0.32, 0.0, 0.0 ], [ 0.32, 0.0, 0.0 ]),
+            (5, Node.VALUE_LABEL_D_DS3, [ 0.0, 0.0, 0.5118820956272359 ], [ 0.19497580062989403, 0.0, 0.4746415063185119 ]),
+            (17, Node.VALUE_LABEL_D_DS2, [ 0.0, 0.5118820956272361, 0.0 ], [ -0.1949758006298942, 0.4746415063185121, 0.0 ])
+        ]
+        for arcLengthTolerance in (None, 1.0E-8):
+            for scalingMode, expectedValues in ((DerivativeScalingMode.ARITHMETIC_MEAN, expectedArithmeticMean),
+                                                (DerivativeScalingMode.HARMONIC_MEAN, expectedHarmonicMean)):
+                for updateDirections in (False, True):
+                    context = Context("Test")
+                    region = context.getDefaultRegion()
+                    scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+                        'scaffoldSettings': {
+                            'Number of elements 1': 2,
+                            'Number of elements 2': 2,
+                            'Number of elements 3': 2
+                        }
+                    })
+                    scaffoldPackage.generate(region)
+                    fieldmodule = region.getFieldmodule()
+                    coordinates = fieldmodule.findFieldByName("coordinates").castFiniteElement()
+                    nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+                    fieldcache = fieldmodule.createFieldcache()
+                    fieldcache.setNode(nodes.findNodeByIdentifier(14))
+                    self.assertEqual(RESULT_OK, coordinates.setNodeParameters(fieldcache, -1, Node.VALUE_LABEL_VALUE, 1, [ 0.6, 0.5, 0.5 ]))
+                    smoothing = DerivativeSmoothing(region, coordinates, scalingMode=scalingMode)
+                    interpolation.setArcLengthTolerance(arcLengthTolerance)
+                    try:
+                        smoothing.smooth(updateDirections=updateDirections)
+                    finally:
+                        interpolation.setArcLengthTolerance(None)
+                    # adaptive arc lengths differ slightly from 4 point Gaussian quadrature
+                    delta = 1.0E-12 if (arcLengthTolerance is None) else 1.0E-5
+                    for nodeIdentifier, valueLabel, expectedFixed, expectedUpdated in expectedValues:
+                        fieldcache.setNode(nodes.findNodeByIdentifier(nodeIdentifier))
+                        result, d = coordinates.getNodeParameters(fieldcache, -1, valueLabel, 1, 3)
+                        self.assertEqual(RESULT_OK, result)
+                        expected = expectedUpdated if updateDirections else expectedFixed
+                        assertAlmostEqualList(self, d, expected, delta=delta)
+                        if arcLengthTolerance and (not updateDirections) and (nodeIdentifier == 14) and \
+                                (valueLabel == Node.VALUE_LABEL_D_DS2):
+                            self.assertGreater(abs(d[1] - expected[1]), 1.0E-6)
+
+    def test_export_vtk_formats(self):
+        """
+        Test export of box scaffold to legacy vtk text and binary, and VTU formats.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+            'scaffoldSettings': {
+                'Number of elements 1': 2,
+                'Number of elements 2': 2,
+                'Number of elements 3': 2
+            }
+        })
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        exportVtk = ExportVtk(region, 'Box')
+        outstream = io.StringIO()
+        exportVtk.write(outstream)
+        text = outstream.getvalue()
+        self.assertTrue(text.startswith('# vtk DataFile Version 2.0\nBox\nASCII\nDATASET UNSTRUCTURED_GRID\nPOINTS 27 double\n'))
+        self.assertIn('\nCELLS 8 72\n', text)
+        asciiCells = text.split('\nCELLS 8 72\n')[1].split('\nCELL_TYPES')[0]
+        outstream = io.BytesIO()
+        exportVtk.write(outstream, ExportVtk.Format.BINARY)
+        data = outstream.getvalue()
+        self.assertTrue(data.startswith(b'# vtk DataFile Version 2.0\nBox\nBINARY\nDATASET UNSTRUCTURED_GRID\nPOINTS 27 double\n'))
+        start = data.index(b'POINTS 27 double\n') + 17
+        points = np.frombuffer(data[start:start + 27*3*8], dtype='>f8').reshape(27, 3)
+        assertAlmostEqualList(self, points.min(axis=0).tolist(), [ 0.0, 0.0, 0.0 ], delta=1.0E-12)
+        assertAlmostEqualList(self, points.max(axis=0).tolist(), [ 1.0, 1.0, 1.0 ], delta=1.0E-12)
+        start = data.index(b'CELLS 8 72\n') + 11
+        cells = np.frombuffer(data[start:start + 72*4], dtype='>i4')
+        self.assertEqual([ int(s) for s in asciiCells.split() ], cells.tolist())
+        self.assertIn(b'CELL_TYPES 8\n' + np.full(8, 12, dtype='>i4').tobytes(), data)
+        for fileFormat in (ExportVtk.Format.VTU_RAW, ExportVtk.Format.VTU_BASE64_ZLIB):
+            outstream = io.BytesIO()
+            exportVtk.write(outstream, fileFormat)
+            data = outstream.getvalue()
+            self.assertIn(b'<Piece NumberOfPoints="27" NumberOfCells="8">', data)
+            self.assertTrue(data.endswith(b'</VTKFile>\n'))
+            if fileFormat == ExportVtk.Format.VTU_RAW:
+                # appended data starts with byte count and points
+                start = data.index(b'<AppendedData encoding="raw">') + 29
+                start = data.index(b'_', start) + 1
+                self.assertEqual(27*3*8, np.frombuffer(data[start:start + 8], dtype='<u8')[0])
+                rawPoints = np.frombuffer(data[start + 8:start + 8 + 27*3*8], dtype='<f8').reshape(27, 3)
+                self.assertTrue(np.array_equal(points, rawPoints))
+            else:
+                self.assertIn(b'compressor="vtkZLibDataCompressor"', data)
+                self.assertNotIn(b'AppendedData', data)
+        # streamed output is independent of chunk size
+        for fileFormat in (ExportVtk.Format.BINARY, ExportVtk.Format.VTU_RAW):
+            outstream = io.BytesIO()
+            exportVtk.write(outstream, fileFormat)
+            chunkedOutstream = io.BytesIO()
+            exportVtk.write(chunkedOutstream, fileFormat, chunkSize=3)
+            self.assertEqual(outstream.getvalue(), chunkedOutstream.getvalue())
+
+    def test_export_vtk_lagrange(self):
+        """
+        Test export of box scaffold to VTK Lagrange hexahedra.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+            'scaffoldSettings': {
+                'Number of elements 1': 2,
+                'Number of elements 2': 2,
+                'Number of elements 3': 2
+            }
+        })
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        exportVtk = ExportVtk(region, 'Box', lagrangeOrder=3)
+        outstream = io.BytesIO()
+        exportVtk.write(outstream, ExportVtk.Format.BINARY)
+        data = outstream.getvalue()
+        # points shared between elements
+        pointCount = 7*7*7
+        start = data.index(b'POINTS ' + str(pointCount).encode() + b' double\n') + 18
+        points = np.frombuffer(data[start:start + pointCount*3*8], dtype='>f8').reshape(pointCount, 3)
+        # points are on grid of element thirds
+        self.assertLess(np.max(np.fabs(points*6.0 - np.round(points*6.0))), 1.0E-10)
+        self.assertEqual(pointCount, np.unique(np.round(points*6.0), axis=0).shape[0])
+        start = data.index(b'CELLS 8 520\n') + 12
+        cells = np.frombuffer(data[start:start + 520*4], dtype='>i4').reshape(8, 65)
+        self.assertEqual([ 64 ]*8, cells[:, 0].tolist())
+        # first cell corners in VTK order
+        cornerPoints = points[cells[0, 1:9]]
+        self.assertTrue(np.allclose(cornerPoints, [ [ 0.0, 0.0, 0.0 ], [ 0.5, 0.0, 0.0 ], [ 0.5, 0.5, 0.0 ], [ 0.0, 0.5, 0.0 ],
+                                                   [ 0.0, 0.0, 0.5 ], [ 0.5, 0.0, 0.5 ], [ 0.5, 0.5, 0.5 ], [ 0.0, 0.5, 0.5 ] ]))
+        self.assertIn(b'CELL_TYPES 8\n' + np.full(8, 72, dtype='>i4').tobytes(), data)
+        outstream = io.BytesIO()
+        exportVtk.write(outstream, ExportVtk.Format.VTU_BASE64_ZLIB)
+        self.assertIn(b'<Piece NumberOfPoints="343" NumberOfCells="8">', outstream.getvalue())
+
+    def test_export_vtk_cell_shapes(self):
+        """
+        Test VTK cell types and corner orders for uncollapsed and collapsed elements.
+        """
+        # corners of unit cube varying fastest in xi1
+        cubeCorners = np.indices((2, 2, 2))[::-1].reshape(3, -1).T
+        for cornerIdentifiers, dimension, expectedShape in (
+                ([ 1, 2 ], 1, (3, [ 0, 1 ])),
+                ([ 1, 2, 3, 4 ], 2, (9, [ 0, 1, 3, 2 ])),
+                ([ 1, 2, 3, 4, 5, 6, 7, 8 ], 3, (12, [ 0, 1, 3, 2, 4, 5, 7, 6 ])),
+                # triangles
+                ([ 1, 2, 3, 3 ], 2, (5, [ 0, 1, 2 ])),
+                ([ 1, 1, 3, 4 ], 2, (5, [ 3, 2, 1 ])),
+                # wedges with collapsed xi1 edges at xi2 = 1, and collapsed xi2 edges at xi1 = 1
+                ([ 1, 2, 3, 3, 5, 6, 7, 7 ], 3, (13, [ 0, 2, 1, 4, 6, 5 ])),
+                ([ 1, 2, 3, 2, 5, 6, 7, 6 ], 3, (13, [ 4, 5, 6, 0, 1, 2 ])),
+                # pyramids with apex on xi3 = 1 face, and on xi1 = 0 face
+                ([ 1, 2, 3, 4, 5, 5, 5, 5 ], 3, (14, [ 0, 1, 3, 2, 4 ])),
+                ([ 1, 2, 1, 4, 1, 6, 1, 8 ], 3, (14, [ 5, 7, 3, 1, 4 ])),
+                # collapse not matching a wedge or pyramid is output as a degenerate hex
+                ([ 1, 1, 1, 4, 5, 6, 7, 8 ], 3, (12, [ 0, 1, 3, 2, 4, 5, 7, 6 ]))):
+            cellType, cornerIndexes = ExportVtk._getCellShape(cornerIdentifiers, dimension)
+            self.assertEqual(expectedShape, (cellType, list(cornerIndexes)))
+            # cells are not degenerate
+            if cellType in (5, 13, 14):
+                self.assertEqual(len(cornerIndexes), len(set(cornerIdentifiers[corner] for corner in cornerIndexes)))
+        # VTK wedge base triangle 0, 1, 2 has normal pointing away from triangle 3, 4, 5
+        for cornerIdentifiers in ([ 1, 2, 3, 3, 5, 6, 7, 7 ], [ 1, 2, 3, 2, 5, 6, 7, 6 ]):
+            cornerIndexes = ExportVtk._getCellShape(cornerIdentifiers, 3)[1]
+            x = cubeCorners[cornerIndexes].astype(float)
+            normal = np.cross(x[1] - x[0], x[2] - x[0])
+            self.assertLess(np.dot(normal, x[3:].mean(axis=0) - x[:3].mean(axis=0)), 0.0)
+        # VTK pyramid base quad 0, 1, 2, 3 has normal pointing towards apex 4
+        for cornerIdentifiers in ([ 1, 2, 3, 4, 5, 5, 5, 5 ], [ 1, 2, 1, 4, 1, 6, 1, 8 ]):
+            cornerIndexes = ExportVtk._getCellShape(cornerIdentifiers, 3)[1]
+            x = cubeCorners[cornerIndexes].astype(float)
+            normal = np.cross(x[2] - x[0], x[3] - x[1])
+            self.assertGreater(np.dot(normal, x[4] - x[:4].mean(axis=0)), 0.0)
+
+    def test_export_vtk_1d(self):
+        """
+        Test export of 1-D path scaffold to VTK lines and Lagrange curves.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_1d_path1, {
+            'scaffoldSettings': {
+                'Length': 1.0,
+                'Number of elements': 4
+            }
+        })
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        exportVtk = ExportVtk(region, 'Path')
+        outstream = io.StringIO()
+        exportVtk.write(outstream)
+        text = outstream.getvalue()
+        self.assertIn('\nPOINTS 5 double\n', text)
+        self.assertIn('\nCELLS 4 12\n2 0 1\n2 1 2\n2 2 3\n2 3 4\n', text)
+        self.assertIn('\nCELL_TYPES 4\n3 3 3 3\n', text)
+        outstream = io.BytesIO()
+        exportVtk.write(outstream, ExportVtk.Format.BINARY)
+        data = outstream.getvalue()
+        start = data.index(b'CELLS 4 12\n') + 11
+        self.assertEqual([ 2, 0, 1, 2, 1, 2, 2, 2, 3, 2, 3, 4 ], np.frombuffer(data[start:start + 12*4], dtype='>i4').tolist())
+        self.assertIn(b'CELL_TYPES 4\n' + np.full(4, 3, dtype='>i4').tobytes(), data)
+        exportVtk = ExportVtk(region, 'Path', lagrangeOrder=2)
+        outstream = io.BytesIO()
+        exportVtk.write(outstream, ExportVtk.Format.BINARY)
+        data = outstream.getvalue()
+        # points shared between elements
+        pointCount = 9
+        start = data.index(b'POINTS 9 double\n') + 16
+        points = np.frombuffer(data[start:start + pointCount*3*8], dtype='>f8').reshape(pointCount, 3)
+        self.assertTrue(np.allclose(np.sort(points[:, 0]), np.linspace(0.0, 1.0, 9)))
+        self.assertTrue(np.allclose(points[:, 1:], 0.0))
+        start = data.index(b'CELLS 4 16\n') + 11
+        cells = np.frombuffer(data[start:start + 16*4], dtype='>i4').reshape(4, 4)
+        self.assertEqual([ 3 ]*4, cells[:, 0].tolist())
+        # Lagrange curve has end points then interior point
+        cellx = points[cells[:, 1:], 0]
+        self.assertTrue(np.allclose(cellx, [ [ 0.0, 0.25, 0.125 ], [ 0.25, 0.5, 0.375 ], [ 0.5, 0.75, 0.625 ], [ 0.75, 1.0, 0.875 ] ]))
+        self.assertIn(b'CELL_TYPES 4\n' + np.full(4, 68, dtype='>i4').tobytes(), data)
+
+    def test_export_vtk_multiblock(self):
+        """
+        Test export of box scaffold with face annotation group to VTK multiblock file.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+            'scaffoldSettings': {
+                'Number of elements 1': 2,
+                'Number of elements 2': 2,
+                'Number of elements 3': 2
+            }
+        })
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        fieldmodule = region.getFieldmodule()
+        bottomGroup = scaffoldPackage.createUserAnnotationGroup(('bottom', None))
+        mesh2d = fieldmodule.findMeshByDimension(2)
+        isBottom = fieldmodule.createFieldAnd(fieldmodule.createFieldIsExterior(),
+                                              fieldmodule.createFieldIsOnFace(Element.FACE_TYPE_XI3_0))
+        bottomGroup.getMeshGroup(mesh2d).addElementsConditional(isBottom)
+        del isBottom
+        self.assertEqual(2, bottomGroup.getDimension())
+        exportVtk = ExportVtk(region, 'Box', scaffoldPackage.getAnnotationGroups())
+        with tempfile.TemporaryDirectory() as directoryName:
+            filename = os.path.join(directoryName, 'box.vtm')
+            exportVtk.writeMultiBlockFile(filename)
+            with open(filename, 'r') as instream:
+                text = instream.read()
+            self.assertIn('<DataSet index="0" name="mesh3d" file="box/box_0.vtu"/>', text)
+            self.assertIn('<Block index="1" name="groups2d">', text)
+            self.assertIn('<DataSet index="0" name="bottom" file="box/box_1.vtu"/>', text)
+            with open(os.path.join(directoryName, 'box', 'box_0.vtu'), 'rb') as instream:
+                self.assertIn(b'<Piece NumberOfPoints="27" NumberOfCells="8">', instream.read())
+            with open(os.path.join(directoryName, 'box', 'box_1.vtu'), 'rb') as instream:
+                data = instream.read()
+            # points merged between faces
+            self.assertIn(b'<Piece NumberOfPoints="9" NumberOfCells="4">', data)
+            start = data.index(b'<AppendedData encoding="raw">') + 29
+            start = data.index(b'_', start) + 1
+            points = np.frombuffer(data[start + 8:start + 8 + 9*3*8], dtype='<f8').reshape(9, 3)
+            assertAlmostEqualList(self, points[:, 2].tolist(), [ 0.0 ]*9, delta=1.0E-12)
+            self.assertIn(np.full(4, 9, dtype='u1').tobytes(), data)
+
+    def test_node_field_parameters_array(self):
+        """
+        Test extracting node field parameters of box scaffold into arrays and setting them back.
+        """
+        scaffoldPackage = ScaffoldPackage(MeshType_3d_box1, {
+            'scaffoldSettings': {
+                'Number of elements 1': 2,
+                'Number of elements 2': 2,
+                'Number of elements 3': 2
+            }
+        })
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        scaffoldPackage.generate(region)
+        fieldmodule = region.getFieldmodule()
+        nodes = fieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+        coordinates = fieldmodule.findFieldByName("coordinates").castFiniteElement()
+        valueLabels, nodeIdentifiers, nodeParameters, mask = extract_node_field_parameters_array(nodes, coordinates)
+        self.assertEqual([ Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D_DS1, Node.VALUE_LABEL_D_DS2, Node.VALUE_LABEL_D_DS3 ], valueLabels)
+        self.assertEqual(list(range(1, 28)), nodeIdentifiers.tolist())
+        self.assertEqual((27, 4, 1, 3), nodeParameters.shape)
+        self.assertTrue(np.all(mask))
+        assertAlmostEqualList(self, nodeParameters[:, 0, 0].min(axis=0).tolist(), [ 0.0, 0.0, 0.0 ], delta=1.0E-12)
+        assertAlmostEqualList(self, nodeParameters[:, 0, 0].max(axis=0).tolist(), [ 1.0, 1.0, 1.0 ], delta=1.0E-12)
+        # same parameters as list extraction
+        listValueLabels, fieldParameters = extract_node_field_parameters(nodes, coordinates)
+        self.assertEqual(valueLabels, listValueLabels)
+        self.assertTrue(np.array_equal(nodeParameters, np.array([ nodeParameters for nodeIdentifier, nodeParameters in fieldParameters ])))
+        # requested value labels are returned even if not defined
+        valueLabels2, nodeIdentifiers2, nodeParameters2, mask2 = extract_node_field_parameters_array(
+            nodes, coordinates, [ Node.VALUE_LABEL_VALUE, Node.VALUE_LABEL_D2_DS1DS2 ])
+        self.assertEqual((27, 2, 1, 3), nodeParameters2.shape)
+        self.assertTrue(np.all(mask2[:, 0]))
+        self.assertFalse(np.any(mask2[:, 1]))
+        self.assertTrue(np.array_equal(nodeParameters[:, 0], nodeParameters2[:, 0]))
+        # set scaled values back at some nodes
+        newNodeParameters = nodeParameters[:, :1]*2.0
+        self.assertEqual(26, set_node_field_parameters_array(nodes, coordinates, valueLabels[:1], nodeIdentifiers[1:], newNodeParameters[1:]))
+        valueLabels3, nodeIdentifiers3, nodeParameters3, mask3 = extract_node_field_parameters_array(nodes, coordinates)
+        self.assertTrue(np.array_equal(nodeParameters[0], nodeParameters3[0]))
+        self.assertTrue(np.array_equal(newNodeParameters[1:, 0], nodeParameters3[1:, 0]))
+        self.assertTrue(np.array_equal(nodeParameters[:, 1:], nodeParameters3[:, 1:]))
+
+    def test_scaffolds_registry(self):
+        """
+        Test scaffold types are registered under their names and imported on demand.
+        """
+        scaffolds = Scaffolds()
+        scaffoldTypeNames = scaffolds.getScaffoldTypeNames()
+        self.assertEqual(37, len(scaffoldTypeNames))
+        scaffoldTypes = scaffolds.getScaffoldTypes()
+        self.assertEqual(scaffoldTypeNames, [ scaffoldType.getName() for scaffoldType in scaffoldTypes ])
+        self.assertEqual(scaffoldTypes, list(scaffolds))
+        self.assertIs(MeshType_3d_box1, scaffolds.getDefaultScaffoldType())
+        self.assertIs(MeshType_3d_heartatria1, scaffolds.findScaffoldTypeByName('3D Heart Atria 1'))
+        self.assertIsNone(scaffolds.findScaffoldTypeByName('3D Unknown 1'))
+
+        # only modules for scaffold types in use are imported
+        code = '\n'.join([
+            'import sys',
+            'from scaffoldmaker.scaffolds import Scaffolds',
+            'assert not [ name for name in sys.modules if name.startswith("scaffoldmaker.meshtypes.meshtype_") ]',
+            'Scaffolds().findScaffoldTypeByName("3D Box 1")',
+            'assert "scaffoldmaker.meshtypes.meshtype_3d_box1" in sys.modules',
+            'assert "scaffoldmaker.meshtypes.meshtype_3d_stomachhuman1" not in sys.modules'])
+        subprocess.run([ sys.executable, '-c', code ], check=True)
+
+        # decoding imports scaffold types of packages, including those nested in options
+        scaffoldPackage = ScaffoldPackage(scaffolds.findScaffoldTypeByName('3D Small Intestine 1'))
+        jsonString = json.dumps(scaffoldPackage, cls=Scaffolds_JSONEncoder)
+        scaffoldPackage2 = json.loads(jsonString, object_hook=Scaffolds_decodeJSON)
+        self.assertEqual('3D Small Intestine 1', scaffoldPackage2.getScaffoldType().getName())
+        centralPath = scaffoldPackage2.getScaffoldSettings()['Central path']
+        self.assertEqual('1D Path 1', centralPath.getScaffoldType().getName())
+
 
 if __name__ == "__main__":
     unittest.main()
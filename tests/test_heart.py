@@ -1,9 +1,10 @@
 import unittest
 import copy
-from opencmiss.utils.zinc.finiteelement import evaluateFieldNodesetRange, findNodeWithName
+from opencmiss.utils.zinc.finiteelement import evaluateFieldNodesetRange, findNodeWithName, getElementNodeIdentifiersBasisOrder
 from opencmiss.utils.zinc.general import ChangeManager
 from opencmiss.zinc.context import Context
 from opencmiss.zinc.field import Field
+from opencmiss.zinc.node import Node
 from opencmiss.zinc.result import RESULT_OK
 from scaffoldmaker.annotation.annotationgroup import AnnotationGroup, getAnnotationGroupForTerm
 from scaffoldmaker.annotation.heart_terms import get_heart_term
@@ -166,5 +167,153 @@ class HeartScaffoldTestCase(unittest.TestCase):
         self.assertEqual(5, element.getIdentifier())
         assertAlmostEqualList(self, xi, [ 0.0, 0.0, 1.0 ], 1.0E-10)
 
+    def test_heart1_refine_element_grids(self):
+        """
+        Test refinement of heart scaffold evaluating element grids at once matches evaluation with Zinc.
+        """
+        scaffold = MeshType_3d_heart1
+        options = scaffold.getDefaultOptions("Human 1")
+        options['Refine number of elements surface'] = 2
+        options['Refine number of elements through LV wall'] = 2
+        options['Refine number of elements through wall'] = 2
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        annotationGroups = scaffold.generateBaseMesh(region, options)
+        refinedCoordinates = []
+        for evaluateElementGrids in (False, True):
+            refineRegion = region.createRegion()
+            meshrefinement = MeshRefinement(region, refineRegion, annotationGroups, evaluateElementGrids=evaluateElementGrids)
+            scaffold.refineMesh(meshrefinement, options)
+            del meshrefinement
+            refineFieldmodule = refineRegion.getFieldmodule()
+            self.assertEqual(2236, refineFieldmodule.findMeshByDimension(3).getSize())
+            nodes = refineFieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            coordinates = refineFieldmodule.findFieldByName("coordinates").castFiniteElement()
+            fieldcache = refineFieldmodule.createFieldcache()
+            nodeCoordinates = {}
+            nodeiterator = nodes.createNodeiterator()
+            node = nodeiterator.next()
+            while node.isValid():
+                fieldcache.setNode(node)
+                result, x = coordinates.getNodeParameters(fieldcache, -1, Node.VALUE_LABEL_VALUE, 1, 3)
+                if result == RESULT_OK:
+                    nodeCoordinates[node.getIdentifier()] = x
+                node = nodeiterator.next()
+            refinedCoordinates.append(nodeCoordinates)
+        self.assertEqual(3183, len(refinedCoordinates[0]))
+        self.assertEqual(sorted(refinedCoordinates[0].keys()), sorted(refinedCoordinates[1].keys()))
+        for nodeIdentifier, x in refinedCoordinates[0].items():
+            assertAlmostEqualList(self, refinedCoordinates[1][nodeIdentifier], x, delta=1.0E-10)
+
+    def test_heart1_refine_parallel(self):
+        """
+        Test parallel refinement of heart scaffold gives the same nodes and elements as serial refinement.
+        """
+        scaffold = MeshType_3d_heart1
+        options = scaffold.getDefaultOptions("Human 1")
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        annotationGroups = scaffold.generateBaseMesh(region, options)
+        self.assertEqual(289, region.getFieldmodule().findMeshByDimension(3).getSize())
+        refinedCoordinates = []
+        refinedElementNodes = []
+        for parallel in (False, True):
+            refineRegion = region.createRegion()
+            meshrefinement = MeshRefinement(region, refineRegion, annotationGroups, evaluateElementGrids=True)
+            if parallel:
+                # small chunks so nodes are shared between chunks
+                meshrefinement.refineAllElementsCubeStandard3dParallel(2, 2, 2, workers=2, chunkSize=16)
+            else:
+                meshrefinement.refineAllElementsCubeStandard3d(2, 2, 2)
+            del meshrefinement
+            refineFieldmodule = refineRegion.getFieldmodule()
+            mesh = refineFieldmodule.findMeshByDimension(3)
+            self.assertEqual(289*8, mesh.getSize())
+            nodes = refineFieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+            coordinates = refineFieldmodule.findFieldByName("coordinates").castFiniteElement()
+            fieldcache = refineFieldmodule.createFieldcache()
+            nodeCoordinates = {}
+            nodeiterator = nodes.createNodeiterator()
+            node = nodeiterator.next()
+            while node.isValid():
+                fieldcache.setNode(node)
+                result, x = coordinates.getNodeParameters(fieldcache, -1, Node.VALUE_LABEL_VALUE, 1, 3)
+                if result == RESULT_OK:
+                    nodeCoordinates[node.getIdentifier()] = x
+                node = nodeiterator.next()
+            refinedCoordinates.append(nodeCoordinates)
+            elementNodes = {}
+            elementiterator = mesh.createElementiterator()
+            element = elementiterator.next()
+            while element.isValid():
+                eft = element.getElementfieldtemplate(coordinates, -1)
+                elementNodes[element.getIdentifier()] = getElementNodeIdentifiersBasisOrder(element, eft)
+                element = elementiterator.next()
+            refinedElementNodes.append(elementNodes)
+        self.assertEqual(sorted(refinedCoordinates[0].keys()), sorted(refinedCoordinates[1].keys()))
+        for nodeIdentifier, x in refinedCoordinates[0].items():
+            assertAlmostEqualList(self, refinedCoordinates[1][nodeIdentifier], x, delta=1.0E-10)
+        self.assertEqual(refinedElementNodes[0], refinedElementNodes[1])
+
+    def test_heart1_refine_tricubic_hermite(self):
+        """
+        Test refinement of heart scaffold into tricubic Hermite elements reproduces source geometry.
+        """
+        scaffold = MeshType_3d_heart1
+        options = scaffold.getDefaultOptions("Human 1")
+        context = Context("Test")
+        region = context.getDefaultRegion()
+        annotationGroups = scaffold.generateBaseMesh(region, options)
+        volumes = []
+        for refineRegion, tricubicHermite in ((region, None), (region.createRegion(), True)):
+            if tricubicHermite:
+                meshrefinement = MeshRefinement(region, refineRegion, annotationGroups, tricubicHermite=True)
+                meshrefinement.refineAllElementsCubeStandard3d(2, 2, 2)
+                del meshrefinement
+            fieldmodule = refineRegion.getFieldmodule()
+            mesh3d = fieldmodule.findMeshByDimension(3)
+            coordinates = fieldmodule.findFieldByName("coordinates").castFiniteElement()
+            with ChangeManager(fieldmodule):
+                one = fieldmodule.createFieldConstant(1.0)
+                volumeField = fieldmodule.createFieldMeshIntegral(one, coordinates, mesh3d)
+                volumeField.setNumbersOfPoints(4)
+            fieldcache = fieldmodule.createFieldcache()
+            result, volume = volumeField.evaluateReal(fieldcache, 1)
+            self.assertEqual(result, RESULT_OK)
+            volumes.append(volume)
+        self.assertEqual(289*8, mesh3d.getSize())
+        self.assertAlmostEqual(volumes[0], volumes[1], delta=1.0E-4*volumes[0])
+        # coordinates at sampled xi in refined elements match source elements
+        sourceFieldmodule = region.getFieldmodule()
+        sourceMesh3d = sourceFieldmodule.findMeshByDimension(3)
+        sourceCoordinates = sourceFieldmodule.findFieldByName("coordinates").castFiniteElement()
+        sourceFieldcache = sourceFieldmodule.createFieldcache()
+        nodes = sourceFieldmodule.findNodesetByFieldDomainType(Field.DOMAIN_TYPE_NODES)
+        minimums, maximums = evaluateFieldNodesetRange(sourceCoordinates, nodes)
+        tolerance = 1.0E-10*max((maximums[c] - minimums[c]) for c in range(3))
+        sampleXi = [ 0.0, 0.3, 1.0 ]
+        # refined elements are numbered from 1 in order of source elements, then xi3, xi2, xi1 in source element
+        refinedElementIdentifier = 1
+        elementiterator = sourceMesh3d.createElementiterator()
+        sourceElement = elementiterator.next()
+        while sourceElement.isValid():
+            for k in range(2):
+                for j in range(2):
+                    for i in range(2):
+                        refinedElement = mesh3d.findElementByIdentifier(refinedElementIdentifier)
+                        for xi3 in sampleXi:
+                            for xi2 in sampleXi:
+                                for xi1 in sampleXi:
+                                    sourceFieldcache.setMeshLocation(sourceElement, [ 0.5*(i + xi1), 0.5*(j + xi2), 0.5*(k + xi3) ])
+                                    result, sourcex = sourceCoordinates.evaluateReal(sourceFieldcache, 3)
+                                    self.assertEqual(RESULT_OK, result)
+                                    fieldcache.setMeshLocation(refinedElement, [ xi1, xi2, xi3 ])
+                                    result, refinedx = coordinates.evaluateReal(fieldcache, 3)
+                                    self.assertEqual(RESULT_OK, result)
+                                    assertAlmostEqualList(self, refinedx, sourcex, delta=tolerance)
+                        refinedElementIdentifier += 1
+            sourceElement = elementiterator.next()
+        self.assertEqual(289*8 + 1, refinedElementIdentifier)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,388 @@
+import math
+import unittest
+import numpy as np
+from scaffoldmaker.utils import interpolation, interpolation_np
+from scaffoldmaker.utils.boundingvolumehierarchy import BoundingVolumeHierarchy
+from scaffoldmaker.utils.octree import Octree
+from scaffoldmaker.utils.tracksurface import TrackSurface, TrackSurfacePosition
+from testutils import assertAlmostEqualList
+
+
+class UtilsTestCase(unittest.TestCase):
+
+    def test_octree(self):
+        """
+        Test single and batch add and find of objects by coordinates in Octree.
+        """
+        octree = Octree([ 0.0, 0.0, 0.0 ], [ 1.0, 1.0, 1.0 ], tolerance=1.0E-3)
+        x = [ 0.5, 0.25, 0.125 ]
+        self.assertIsNone(octree.findObjectByCoordinates(x))
+        octree.addObjectAtCoordinates(x, 1)
+        self.assertEqual(1, octree.findObjectByCoordinates([ 0.5005, 0.25, 0.125 ]))
+        self.assertIsNone(octree.findObjectByCoordinates([ 0.501, 0.25, 0.125 ]))
+        # nearest of two objects within tolerance is found
+        octree.addObjectAtCoordinates([ 0.5015, 0.25, 0.125 ], 2)
+        self.assertEqual(1, octree.findObjectByCoordinates([ 0.5007, 0.25, 0.125 ]))
+        self.assertEqual(2, octree.findObjectByCoordinates([ 0.5008, 0.25, 0.125 ]))
+        # points outside range are still found
+        octree.addObjectAtCoordinates([ -0.5, 2.0, 0.0 ], 3)
+        self.assertEqual(3, octree.findObjectByCoordinates([ -0.5, 2.0, 0.0002 ]))
+
+        # batch operations agree with single point operations
+        rng = np.random.default_rng(1)
+        points = rng.random((1000, 3))
+        octree.addObjectsAtCoordinates(points, list(range(10, 1010)))
+        queries = np.vstack([ points + rng.uniform(-4.0E-4, 4.0E-4, points.shape), rng.random((100, 3)),
+                              [ [ 0.5007, 0.25, 0.125 ], [ 0.5008, 0.25, 0.125 ], [ -0.5, 2.0, 0.0 ] ] ])
+        results = octree.findObjectsByCoordinates(queries)
+        self.assertEqual(list(range(10, 1010)), results[:1000])
+        self.assertEqual([ 1, 2, 3 ], results[-3:])
+        for query, result in zip(queries, results):
+            self.assertEqual(result, octree.findObjectByCoordinates(query))
+
+
+    def test_bounding_volume_hierarchy(self):
+        """
+        Test finding nearest sample points on objects with BoundingVolumeHierarchy agrees with brute force.
+        """
+        rng = np.random.default_rng(6)
+        samplePoints = rng.uniform(0.0, 10.0, (300, 1, 3)) + rng.uniform(-0.5, 0.5, (300, 9, 3))
+        bvh = BoundingVolumeHierarchy(np.min(samplePoints, axis=1), np.max(samplePoints, axis=1), samplePoints)
+        x = rng.uniform(-2.0, 12.0, (500, 3))
+        objectIndexes, sampleIndexes, distances = bvh.findNearestSamples(x)
+        allDistances = np.linalg.norm(samplePoints.reshape(-1, 3)[np.newaxis, :, :] - x[:, np.newaxis, :], axis=2)
+        nearest = np.argmin(allDistances, axis=1)
+        self.assertEqual((nearest//9).tolist(), objectIndexes.tolist())
+        self.assertEqual((nearest % 9).tolist(), sampleIndexes.tolist())
+        assertAlmostEqualList(self, np.min(allDistances, axis=1).tolist(), distances.tolist(), delta=1.0E-12)
+
+
+    def test_interpolation_np(self):
+        """
+        Test batched cubic Hermite interpolation gives identical results to single curve functions.
+        """
+        rng = np.random.default_rng(2)
+        v1, d1, v2, d2 = (rng.uniform(-1.0, 1.0, (20, 3)) for i in range(4))
+        xi = [ 0.0, 0.1, 0.25, 0.5, 0.8, 1.0 ]
+        for batchFunction, function in (
+                (interpolation_np.interpolateCubicHermite, interpolation.interpolateCubicHermite),
+                (interpolation_np.interpolateCubicHermiteDerivative, interpolation.interpolateCubicHermiteDerivative),
+                (interpolation_np.interpolateCubicHermiteSecondDerivative, interpolation.interpolateCubicHermiteSecondDerivative)):
+            result = batchFunction(v1, d1, v2, d2, xi)
+            self.assertEqual((20, 6, 3), result.shape)
+            for n in range(20):
+                for m in range(6):
+                    self.assertEqual(function(v1[n].tolist(), d1[n].tolist(), v2[n].tolist(), d2[n].tolist(), xi[m]),
+                                     result[n, m].tolist())
+        arcLengths = interpolation_np.getCubicHermiteArcLength(v1, d1, v2, d2)
+        self.assertEqual((20,), arcLengths.shape)
+        arcLengthsToXi = interpolation_np.getCubicHermiteArcLengthToXi(v1, d1, v2, d2, xi)
+        self.assertEqual((20, 6), arcLengthsToXi.shape)
+        for n in range(20):
+            curve = (v1[n].tolist(), d1[n].tolist(), v2[n].tolist(), d2[n].tolist())
+            self.assertEqual(interpolation.getCubicHermiteArcLength(*curve), arcLengths[n])
+            for m in range(6):
+                self.assertEqual(interpolation.getCubicHermiteArcLengthToXi(*curve, xi[m]), arcLengthsToXi[n, m])
+        # single curve, 2 components
+        self.assertEqual((1, 2, 2), interpolation_np.interpolateCubicHermite([ 0.0, 0.0 ], [ 1.0, 0.0 ], [ 1.0, 0.0 ], [ 1.0, 0.0 ], [ 0.0, 1.0 ]).shape)
+        self.assertAlmostEqual(2.0, interpolation_np.getCubicHermiteArcLength([ 0.0, 0.0 ], [ 2.0, 0.0 ], [ 2.0, 0.0 ], [ 2.0, 0.0 ])[0], delta=1.0E-12)
+
+        # curves through nodes
+        nx = np.cumsum(rng.uniform(0.0, 1.0, (11, 3)), axis=0).tolist()
+        nd1 = rng.uniform(0.5, 1.5, (11, 3)).tolist()
+        elementLengths = interpolation_np.getCubicHermiteCurvesElementLengths(nx, nd1)
+        length = 0.0
+        for e in range(10):
+            arcLength = interpolation.getCubicHermiteArcLength(nx[e], nd1[e], nx[e + 1], nd1[e + 1])
+            self.assertEqual(arcLength, elementLengths[e])
+            length += arcLength
+        self.assertEqual(length, interpolation.getCubicHermiteCurvesLength(nx, nd1))
+
+
+    def test_arc_length_table(self):
+        """
+        Test conversion of distances to element xi along cubic Hermite curves with arc length table.
+        """
+        # straight line with varying derivative magnitudes has exact arc lengths
+        nx = [ [ 0.0, 0.0, 0.0 ], [ 2.0, 1.0, 2.0 ], [ 4.0, 2.0, 4.0 ] ]
+        nd1 = [ [ 1.0, 0.5, 1.0 ], [ 3.0, 1.5, 3.0 ], [ 2.0, 1.0, 2.0 ] ]
+        table = interpolation_np.CubicHermiteArcLengthTable(nx, nd1)
+        assertAlmostEqualList(self, [ 3.0, 3.0 ], table.getElementLengths().tolist(), delta=1.0E-12)
+        self.assertAlmostEqual(6.0, table.getLength(), delta=1.0E-12)
+        distances = [ -1.0, 0.0, 0.5, 1.5, 3.0, 4.0, 5.9, 7.0 ]
+        x, d1, e, xi = table.evaluate(distances)
+        self.assertEqual([ 0, 0, 0, 0, 1, 1, 1, 1 ], e.tolist())
+        for i in range(len(distances)):
+            distance = min(max(distances[i], 0.0), 6.0)
+            assertAlmostEqualList(self, [ distance*2.0/3.0, distance/3.0, distance*2.0/3.0 ], x[i].tolist(), delta=1.0E-12)
+            assertAlmostEqualList(self, interpolation.interpolateCubicHermiteDerivative(nx[e[i]], nd1[e[i]], nx[e[i] + 1], nd1[e[i] + 1], xi[i]),
+                                  d1[i].tolist(), delta=1.0E-12)
+        assertAlmostEqualList(self, [ 0.0, 0.0, 0.5, 1.5, 3.0, 4.0, 5.9, 6.0 ], table.getDistances(e, xi).tolist(), delta=1.0E-12)
+        # distances within given elements
+        e, xi = table.getElementXi([ 1.0, 1.0 ], [ 0, 1 ])
+        self.assertEqual([ 0, 1 ], e.tolist())
+        assertAlmostEqualList(self, [ 1.0, 4.0 ], table.getDistances(e, xi).tolist(), delta=1.0E-12)
+
+        # curved path: compare with fine table, and default sampling
+        rng = np.random.default_rng(4)
+        nx = np.cumsum(rng.uniform(-1.0, 1.0, (8, 3)) + [ 1.0, 0.0, 0.0 ], axis=0).tolist()
+        nd1 = (rng.uniform(-1.5, 1.5, (8, 3)) + [ 1.0, 0.0, 0.0 ]).tolist()
+        table = interpolation_np.CubicHermiteArcLengthTable(nx, nd1)
+        fineTable = interpolation_np.CubicHermiteArcLengthTable(nx, nd1, segmentsCount=256)
+        self.assertAlmostEqual(fineTable.getLength(), table.getLength(), delta=1.0E-5)
+        distances = np.linspace(0.0, table.getLength(), 50)
+        e, xi = table.getElementXi(distances)
+        assertAlmostEqualList(self, distances.tolist(), table.getDistances(e, xi).tolist(), delta=1.0E-12)
+        assertAlmostEqualList(self, distances.tolist(), fineTable.getDistances(e, xi).tolist(), delta=1.0E-5)
+        for function in (interpolation.sampleCubicHermiteCurves, interpolation.sampleCubicHermiteCurvesSmooth):
+            px, pd1, pe, pxi, psf = function(nx, nd1, 20)
+            tpx, tpd1, tpe, tpxi, tpsf = function(nx, nd1, 20, arcLengthTable=True)
+            self.assertEqual(21, len(tpx))
+            for i in range(21):
+                assertAlmostEqualList(self, px[i], tpx[i], delta=0.05)
+            # sample points are closer to even spacing along curves
+            spacings = np.diff(fineTable.getDistances(pe, pxi))
+            tableSpacings = np.diff(fineTable.getDistances(tpe, tpxi))
+            if function == interpolation.sampleCubicHermiteCurves:
+                self.assertLess(np.ptp(tableSpacings), 1.0E-5)
+            self.assertLess(np.ptp(tableSpacings), np.ptp(spacings))
+        # table uses fixed quadrature so is not used with an arc length tolerance
+        try:
+            interpolation.setArcLengthTolerance(1.0E-8)
+            for function in (interpolation.sampleCubicHermiteCurves, interpolation.sampleCubicHermiteCurvesSmooth):
+                self.assertEqual(function(nx, nd1, 20), function(nx, nd1, 20, arcLengthTable=True))
+        finally:
+            interpolation.setArcLengthTolerance(None)
+
+
+    def test_arc_length_tolerance(self):
+        """
+        Test adaptive arc length of cubic Hermite curves to set tolerance.
+        """
+        self.assertIsNone(interpolation.getArcLengthTolerance())
+        v1, d1, v2, d2 = [ 0.0, 0.0, 0.0 ], [ 0.0, 5.0, 0.0 ], [ 1.0, 0.0, 0.0 ], [ 0.0, -5.0, 0.0 ]
+        expectedArcLength = interpolation_np.CubicHermiteArcLengthTable([ v1, v2 ], [ d1, d2 ], segmentsCount=4096).getLength()
+        defaultArcLength = interpolation.getCubicHermiteArcLength(v1, d1, v2, d2)
+        self.assertGreater(math.fabs(defaultArcLength - expectedArcLength), 1.0E-2)
+        try:
+            for tolerance in (1.0E-2, 1.0E-6, 1.0E-9):
+                interpolation.setArcLengthTolerance(tolerance)
+                self.assertEqual(tolerance, interpolation.getArcLengthTolerance())
+                arcLength = interpolation.getCubicHermiteArcLength(v1, d1, v2, d2)
+                self.assertAlmostEqual(expectedArcLength, arcLength, delta=tolerance*expectedArcLength)
+            # straight curves are chord length, unless direction reverses
+            self.assertEqual(math.sqrt(8.0), interpolation.getCubicHermiteArcLength([ 0.0, 0.0 ], [ 1.0, 1.0 ], [ 2.0, 2.0 ], [ 3.0, 3.0 ]))
+            v1, d1, v2, d2 = [ 0.0, 0.0, 0.0 ], [ 10.0, 0.0, 0.0 ], [ 1.0, 0.0, 0.0 ], [ 10.0, 0.0, 0.0 ]
+            expectedArcLength = interpolation_np.CubicHermiteArcLengthTable([ v1, v2 ], [ d1, d2 ], segmentsCount=4096).getLength()
+            self.assertAlmostEqual(expectedArcLength, interpolation.getCubicHermiteArcLength(v1, d1, v2, d2), delta=1.0E-6)
+            self.assertGreater(expectedArcLength, 3.0)
+            # setting applies to callers
+            interpolation.setArcLengthTolerance(1.0E-6)
+            nx = [ [ 0.0, 0.0, 0.0 ], [ 1.0, 0.0, 0.0 ], [ 1.0, 1.0, 0.0 ] ]
+            nd1 = [ [ 0.0, 2.0, 0.0 ], [ 2.0, -2.0, 0.0 ], [ -2.0, 0.0, 0.0 ] ]
+            expectedLength = interpolation_np.CubicHermiteArcLengthTable(nx, nd1, segmentsCount=4096).getLength()
+            self.assertAlmostEqual(expectedLength, interpolation.getCubicHermiteCurvesLength(nx, nd1), delta=1.0E-6*expectedLength)
+        finally:
+            interpolation.setArcLengthTolerance(None)
+        self.assertIsNone(interpolation.getArcLengthTolerance())
+
+
+    def test_smooth_derivatives_lines(self):
+        """
+        Test smoothing derivatives of many lines and loops at once matches smoothing each.
+        """
+        rng = np.random.default_rng(5)
+        nx = np.cumsum(rng.uniform(0.0, 1.0, (6, 9, 3)), axis=1)
+        nd1 = rng.uniform(0.2, 1.5, (6, 9, 3))
+        active = [ True, True, False, True, True, True ]
+        for options in ({}, { 'fixAllDirections': True }, { 'fixStartDirection': True, 'fixEndDerivative': True },
+                        { 'magnitudeScalingMode': interpolation.DerivativeScalingMode.HARMONIC_MEAN }):
+            md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLines(nx, nd1, active=active, **options)
+            self.assertEqual((6, 9, 3), md1.shape)
+            for l in range(6):
+                if active[l]:
+                    expectedmd1 = interpolation.smoothCubicHermiteDerivativesLine(nx[l].tolist(), nd1[l].tolist(), **options)
+                    self.assertEqual(expectedmd1, md1[l].tolist())
+                else:
+                    self.assertEqual(0, iterationsCounts[l])
+                    self.assertEqual(nd1[l].tolist(), md1[l].tolist())
+            amd1, accelerationIterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLines(
+                nx, nd1, active=active, accelerationDepth=4, **options)
+            self.assertLess(np.max(np.fabs(amd1 - md1)), 1.0E-5)
+            self.assertLess(sum(accelerationIterationsCounts), sum(iterationsCounts))
+
+        theta = np.linspace(0.0, 2.0*math.pi, 13)[:-1]
+        nx = np.stack([ np.stack([ np.cos(theta)*(1.0 + 0.3*l), np.sin(theta)*(1.0 + 0.2*np.sin(3.0*theta)), np.full(12, 0.1*l) ], axis=1)
+                        for l in range(4) ])
+        nd1 = rng.uniform(-0.5, 0.5, nx.shape) + np.stack([ -np.sin(theta), np.cos(theta), np.zeros(12) ], axis=1)
+        for options in ({}, { 'fixAllDirections': True }):
+            md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLines(nx, nd1, loop=True, **options)
+            for l in range(4):
+                expectedmd1 = interpolation.smoothCubicHermiteDerivativesLoop(nx[l].tolist(), nd1[l].tolist(), **options)
+                self.assertEqual(expectedmd1, md1[l].tolist())
+            amd1, accelerationIterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLines(
+                nx, nd1, loop=True, accelerationDepth=4, **options)
+            self.assertLess(np.max(np.fabs(amd1 - md1)), 1.0E-5)
+
+        # adaptive arc lengths with a tolerance set
+        try:
+            interpolation.setArcLengthTolerance(1.0E-10)
+            for loop in (False, True):
+                md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLines(nx, nd1, loop=loop)
+                smooth = interpolation.smoothCubicHermiteDerivativesLoop if loop else \
+                    interpolation.smoothCubicHermiteDerivativesLine
+                for l in range(4):
+                    self.assertEqual(smooth(nx[l].tolist(), nd1[l].tolist()), md1[l].tolist())
+        finally:
+            interpolation.setArcLengthTolerance(None)
+
+
+    def test_smooth_derivatives_lines_packed(self):
+        """
+        Test smoothing derivatives of ragged lines packed into flat arrays matches smoothing each.
+        """
+        rng = np.random.default_rng(7)
+        nodesCounts = [ 5, 2, 9, 5, 3, 9, 5 ]
+        offsets = interpolation_np.getPackedOffsets(nodesCounts)
+        self.assertEqual([ 0, 5, 7, 16, 21, 24, 33, 38 ], offsets.tolist())
+        x = np.concatenate([ np.cumsum(rng.uniform(0.0, 1.0, (nodesCount, 3)), axis=0) for nodesCount in nodesCounts ])
+        d1 = rng.uniform(0.2, 1.5, x.shape)
+        fixStartDirection = [ True, False, False, True, False, True, False ]
+        fixEndDerivative = [ False, False, True, False, True, False, True ]
+        md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLinesPacked(
+            x, d1, offsets, fixStartDirection=fixStartDirection, fixEndDerivative=fixEndDerivative)
+        self.assertEqual(x.shape, md1.shape)
+        self.assertEqual(len(nodesCounts), len(iterationsCounts))
+        for l in range(len(nodesCounts)):
+            start, end = offsets[l], offsets[l + 1]
+            expectedmd1 = interpolation.smoothCubicHermiteDerivativesLine(x[start:end].tolist(), d1[start:end].tolist(),
+                fixStartDirection=fixStartDirection[l], fixEndDerivative=fixEndDerivative[l])
+            self.assertEqual(expectedmd1, md1[start:end].tolist())
+        # mix of lines and loops
+        loop = [ False, False, True, True, True, False, False ]
+        md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLinesPacked(
+            x, d1, offsets, loop=loop, fixAllDirections=True)
+        for l in range(len(nodesCounts)):
+            start, end = offsets[l], offsets[l + 1]
+            smooth = interpolation.smoothCubicHermiteDerivativesLoop if loop[l] else \
+                interpolation.smoothCubicHermiteDerivativesLine
+            expectedmd1 = smooth(x[start:end].tolist(), d1[start:end].tolist(), fixAllDirections=True)
+            self.assertEqual(expectedmd1, md1[start:end].tolist())
+        # as used by tube generators, with a tolerance set
+        try:
+            interpolation.setArcLengthTolerance(1.0E-10)
+            md1, iterationsCounts = interpolation_np.smoothCubicHermiteDerivativesLinesPacked(
+                x, d1, offsets, fixStartDirection=fixStartDirection, fixEndDerivative=fixEndDerivative)
+            for l in range(len(nodesCounts)):
+                start, end = offsets[l], offsets[l + 1]
+                expectedmd1 = interpolation.smoothCubicHermiteDerivativesLine(x[start:end].tolist(), d1[start:end].tolist(),
+                    fixStartDirection=fixStartDirection[l], fixEndDerivative=fixEndDerivative[l])
+                self.assertEqual(expectedmd1, md1[start:end].tolist())
+        finally:
+            interpolation.setArcLengthTolerance(None)
+
+
+    def test_track_surface_many(self):
+        """
+        Test batched evaluation and nearest position search on a wavy tube TrackSurface.
+        """
+        elementsCount1 = 8
+        elementsCount2 = 6
+        nx = []
+        nd1 = []
+        nd2 = []
+        for n2 in range(elementsCount2 + 1):
+            z = 3.0*n2/elementsCount2
+            radius = 1.0 + 0.3*math.sin(z)
+            dradius = 0.3*math.cos(z)*3.0/elementsCount2
+            for n1 in range(elementsCount1):
+                theta = 2.0*math.pi*n1/elementsCount1
+                cosTheta = math.cos(theta)
+                sinTheta = math.sin(theta)
+                nx.append([ radius*cosTheta, radius*sinTheta, z ])
+                nd1.append([ -radius*sinTheta*2.0*math.pi/elementsCount1, radius*cosTheta*2.0*math.pi/elementsCount1, 0.0 ])
+                nd2.append([ dradius*cosTheta, dradius*sinTheta, 3.0/elementsCount2 ])
+        trackSurface = TrackSurface(elementsCount1, elementsCount2, nx, nd1, nd2, loop1=True)
+        rng = np.random.default_rng(3)
+        positions = [ TrackSurfacePosition(int(rng.integers(trackSurface.elementsCount1)), int(rng.integers(elementsCount2)),
+                                           rng.uniform(), rng.uniform()) for i in range(50) ]
+        x, d1, d2 = trackSurface.evaluateCoordinatesMany(positions, derivatives=True)
+        self.assertEqual((50, 3), x.shape)
+        for i, position in enumerate(positions):
+            ex, ed1, ed2 = trackSurface.evaluateCoordinates(position, derivatives=True)
+            assertAlmostEqualList(self, ex, x[i].tolist(), delta=1.0E-12)
+            assertAlmostEqualList(self, ed1, d1[i].tolist(), delta=1.0E-12)
+            assertAlmostEqualList(self, ed2, d2[i].tolist(), delta=1.0E-12)
+        self.assertEqual(x.tolist(), trackSurface.evaluateCoordinatesMany(positions).tolist())
+
+        targetx = x + rng.normal(0.0, 0.05, x.shape)
+        startPosition = trackSurface.createPositionProportion(1.0, 0.5)
+        nearestPositions = trackSurface.findNearestPositions(targetx, [ startPosition ]*50)
+        for i, nearestPosition in enumerate(nearestPositions):
+            expectedPosition = trackSurface.findNearestPosition(targetx[i].tolist(), startPosition)
+            self.assertEqual((expectedPosition.e1, expectedPosition.e2), (nearestPosition.e1, nearestPosition.e2))
+            self.assertAlmostEqual(expectedPosition.xi1, nearestPosition.xi1, delta=1.0E-10)
+            self.assertAlmostEqual(expectedPosition.xi2, nearestPosition.xi2, delta=1.0E-10)
+        # start from coarse index: points on the surface are found from anywhere
+        nearestPositions = trackSurface.findNearestPositions(x)
+        nearestx = trackSurface.evaluateCoordinatesMany(nearestPositions)
+        self.assertLess(np.max(np.fabs(nearestx - x)), 1.0E-6)
+        nearestPosition = trackSurface.findNearestPosition(x[0].tolist())
+        assertAlmostEqualList(self, x[0].tolist(), trackSurface.evaluateCoordinates(nearestPosition), delta=1.0E-6)
+        self.assertEqual([], trackSurface.findNearestPositions([]))
+        # starting near from bounding volume hierarchy takes fewer iterations
+        trackSurface.resetNearestPositionStatistics()
+        trackSurface.findNearestPositions(targetx, [ startPosition ]*50)
+        startStatistics = trackSurface.getNearestPositionStatistics()
+        self.assertEqual(50, startStatistics['queries'])
+        trackSurface.resetNearestPositionStatistics()
+        trackSurface.findNearestPositions(targetx)
+        statistics = trackSurface.getNearestPositionStatistics()
+        self.assertEqual(50, statistics['queries'])
+        self.assertLess(statistics['iterations'], startStatistics['iterations'])
+        self.assertLessEqual(statistics['maxIterations'], 10)
+
+
+    def test_track_surface_track_vector_adaptive(self):
+        """
+        Test adaptive tracking over a flat TrackSurface with non-uniform parameterisation follows straight lines.
+        """
+        elementsCount1 = 4
+        elementsCount2 = 3
+        nx = []
+        nd1 = []
+        nd2 = []
+        for n2 in range(elementsCount2 + 1):
+            for n1 in range(elementsCount1 + 1):
+                xi = n1/elementsCount1
+                nx.append([ 4.0*xi*xi, float(n2), 0.0 ])
+                nd1.append([ 8.0*xi/elementsCount1, 0.0, 0.0 ])
+                nd2.append([ 0.0, 1.0, 0.0 ])
+        trackSurface = TrackSurface(elementsCount1, elementsCount2, nx, nd1, nd2)
+        startPosition = trackSurface.createPositionProportion(0.5, 0.2)
+        startx = trackSurface.evaluateCoordinates(startPosition)
+        assertAlmostEqualList(self, [ 1.0, 0.6, 0.0 ], startx, delta=1.0E-12)
+        # direction is projected onto surface
+        direction = [ 0.8, 0.6, 0.5 ]
+        for trackDistance in (1.5, -0.5):
+            position, error = trackSurface.trackVectorAdaptive(startPosition, direction, trackDistance)
+            x = trackSurface.evaluateCoordinates(position)
+            assertAlmostEqualList(self, [ startx[0] + 0.8*trackDistance, startx[1] + 0.6*trackDistance, 0.0 ], x, delta=1.0E-6)
+            self.assertLess(error, 1.0E-6)
+            # more accurate than improved Euler
+            eulerx = trackSurface.evaluateCoordinates(trackSurface.trackVector(startPosition, direction, trackDistance))
+            self.assertLess(max(math.fabs(x[c] - startx[c] - [ 0.8, 0.6, 0.0 ][c]*trackDistance) for c in range(3)),
+                            max(math.fabs(eulerx[c] - startx[c] - [ 0.8, 0.6, 0.0 ][c]*trackDistance) for c in range(3)))
+        # batch, including track stopping at boundary x = 4.0
+        positions, errors = trackSurface.trackVectorsAdaptive([ startPosition ]*3, [ direction, [ 0.0, 1.0, 0.0 ], direction ],
+                                                              [ 1.5, 2.0, 10.0 ], tolerance=1.0E-8)
+        self.assertEqual(3, len(positions))
+        self.assertEqual(3, errors.size)
+        assertAlmostEqualList(self, [ 2.2, 1.5, 0.0 ], trackSurface.evaluateCoordinates(positions[0]), delta=1.0E-8)
+        assertAlmostEqualList(self, [ 1.0, 2.6, 0.0 ], trackSurface.evaluateCoordinates(positions[1]), delta=1.0E-8)
+        self.assertEqual((3, 1.0), (positions[2].e1, positions[2].xi1))
+        assertAlmostEqualList(self, [ 4.0, 2.85, 0.0 ], trackSurface.evaluateCoordinates(positions[2]), delta=1.0E-4)
+
+
+if __name__ == "__main__":
+    unittest.main()